@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Asynchronous successive halving module
+
+This script defines an asynchronous successive halving (ASHA) scheduler
+for experiment sweeps (Li et al., "A System for Massively Parallel
+Hyperparameter Tuning"). Each experiment reports its validation metric
+at rung epochs (min_epochs, min_epochs * eta, min_epochs * eta^2, ...),
+and only continues training if the metric is in the top 1 / eta of the
+results reported at that rung so far by the sweep's experiments. The
+rung results are shared through a file, so experiments run sequentially
+or in parallel worker processes are compared with each other.
+
+Author:  Christopher Good
+Version: 1.0.0
+
+Usage: asha.py
+
+"""
+# See following link for proper docstring documentation
+# https://pandas.pydata.org/docs/development/contributing_docstring.html
+
+### Futures ###
+#TODO
+
+### Built-in Imports ###
+from contextlib import contextmanager
+import json
+import os
+
+try:
+    import fcntl
+except ImportError:
+    # No file locking on Windows, where experiments run in one process
+    fcntl = None
+
+### Other Library Imports ###
+import numpy as np
+from tensorflow.keras.callbacks import Callback
+
+### Definitions ###
+
+def get_rung_epochs(min_epochs, max_epochs, reduction_factor):
+    """
+    Returns the epochs at which experiments are compared: min_epochs
+    times each power of the reduction factor, below max_epochs.
+    """
+    rungs = []
+    epoch = min_epochs
+    while epoch < max_epochs:
+        rungs.append(epoch)
+        epoch *= reduction_factor
+    return rungs
+
+def is_lower_better(metric):
+    """Returns whether lower values of a Keras metric are better."""
+    return 'loss' in metric or 'error' in metric
+
+### Classes ###
+
+class ASHAState:
+    """
+    Rung results of a sweep, shared between processes through a JSON
+    file.
+
+    The file maps each rung epoch to the metric each experiment reported
+    at it. It is read and rewritten under an exclusive lock of a lock
+    file, and replaced atomically, so concurrent experiments see every
+    reported result.
+    """
+
+    def __init__(self, path, reset=False):
+        """
+        Parameters
+        ----------
+        path : str
+            Path of the rung results file
+        reset : bool, optional
+            Whether to discard the results of an earlier sweep
+        """
+        self.path = path
+        self.lock_path = path + '.lock'
+        if reset and os.path.exists(path):
+            os.remove(path)
+
+    @contextmanager
+    def _locked(self):
+        with open(self.lock_path, 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, 'r') as sf:
+            return json.load(sf)
+
+    def report(self, rung_epoch, experiment_number, value, reduction_factor,
+               lower_is_better=True):
+        """
+        Records an experiment's metric at a rung and returns whether the
+        experiment is promoted to the next rung.
+
+        An experiment is promoted if its metric is at least as good as
+        the (1 - 1 / reduction_factor) quantile of the metrics reported
+        at the rung so far, including its own, so early experiments of a
+        sweep are promoted and later ones must beat the top fraction.
+
+        Parameters
+        ----------
+        rung_epoch : int
+            The rung's epoch
+        experiment_number : int
+            The reporting experiment's number
+        value : float
+            The experiment's metric
+        reduction_factor : float
+            The rung's reduction factor (eta)
+        lower_is_better : bool, optional
+            Whether lower metric values are better
+
+        Returns
+        -------
+        promoted : bool
+            Whether the experiment should keep training
+        num_results : int
+            Number of results reported at the rung so far
+        """
+        with self._locked():
+            state = self._read()
+            rung = state.setdefault(str(rung_epoch), {})
+            rung[str(experiment_number)] = float(value)
+
+            temp_path = self.path + '.tmp'
+            with open(temp_path, 'w') as sf:
+                json.dump(state, sf, indent=4)
+            os.replace(temp_path, self.path)
+
+        values = np.array(list(rung.values()))
+        if not lower_is_better:
+            values, value = -values, -value
+        cutoff = np.quantile(values, 1.0 / reduction_factor)
+        return bool(value <= cutoff), len(values)
+
+class ASHACallback(Callback):
+    """
+    Stops training an experiment at the first rung epoch where its
+    validation metric is not in the top fraction of the sweep's results
+    at that rung.
+
+    The result at every rung reached is kept in `rung_results`.
+    """
+
+    def __init__(self, state, experiment_number, rung_epochs, reduction_factor,
+                 monitor='val_loss'):
+        """
+        Parameters
+        ----------
+        state : ASHAState
+            The sweep's shared rung results
+        experiment_number : int
+            The experiment's number
+        rung_epochs : list of int
+            The epochs at which the experiment is compared
+        reduction_factor : float
+            Reduction factor (eta) of the rungs
+        monitor : str, optional
+            Validation metric the experiments are compared by
+        """
+        super().__init__()
+        self.state = state
+        self.experiment_number = experiment_number
+        self.rung_epochs = set(rung_epochs)
+        self.reduction_factor = reduction_factor
+        self.monitor = monitor
+        self.lower_is_better = is_lower_better(monitor)
+        self.rung_results = []
+        self.stopped_epoch = None
+
+    def on_epoch_end(self, epoch, logs=None):
+        if epoch + 1 not in self.rung_epochs:
+            return
+        value = (logs or {}).get(self.monitor)
+        if value is None:
+            print(f'<!> ASHA metric {self.monitor} is not available, '
+                  f'skipping rung at epoch {epoch+1} <!>')
+            return
+
+        promoted, num_results = self.state.report(
+            epoch + 1, self.experiment_number, value, self.reduction_factor,
+            self.lower_is_better)
+        self.rung_results.append({
+            'epoch': epoch + 1,
+            self.monitor: float(value),
+            'promoted': promoted,
+        })
+
+        if promoted:
+            print(f'  >>> ASHA rung at epoch {epoch+1}: {self.monitor} = {value:.4f} '
+                  f'is in the top 1/{self.reduction_factor} of {num_results}, continuing')
+        else:
+            print(f'  >>> ASHA rung at epoch {epoch+1}: {self.monitor} = {value:.4f} '
+                  f'is not in the top 1/{self.reduction_factor} of {num_results}, stopping')
+            self.stopped_epoch = epoch + 1
+            self.model.stop_training = True
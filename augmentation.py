@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Data augmentation module
+
+This script defines the flip, radiation noise and mixture noise data
+augmentations of the training patches as batched Tensorflow operations,
+so augmenting a batch costs a few tensor operations instead of a Python
+loop over its samples and pixels.
+
+Author:  Christopher Good
+Version: 1.0.0
+
+Usage: augmentation.py
+
+"""
+# See following link for proper docstring documentation
+# https://pandas.pydata.org/docs/development/contributing_docstring.html
+
+### Futures ###
+#TODO
+
+### Built-in Imports ###
+#TODO
+
+### Other Library Imports ###
+import numpy as np
+import tensorflow as tf
+
+### Local Imports ###
+#TODO
+
+### Constants ###
+
+# Probability that a sample of a batch gets radiation or mixture noise
+RADIATION_PROBABILITY = 0.1
+MIXTURE_PROBABILITY = 0.2
+
+# Scale of the Gaussian noise added by radiation and mixture noise
+NOISE_SCALE = 1 / 25
+
+### Definitions ###
+
+def make_class_pools(data, gt, ignored_labels):
+    """
+    Gathers the spectrum of every labelled pixel of an image into pools
+    of spectra per class, for mixture noise.
+
+    Parameters
+    ----------
+    data : np.ndarray
+        (rows, cols, bands) hyperspectral image
+    gt : np.ndarray
+        (rows, cols) ground truth labels
+    ignored_labels : iterable of int
+        Labels left out of the pools
+
+    Returns
+    -------
+    spectra : tf.Tensor
+        (N, bands) spectra of the labelled pixels, sorted by class
+    offsets : tf.Tensor
+        Position of each label's first spectrum in `spectra`
+    counts : tf.Tensor
+        Number of spectra of each label (0 for ignored labels)
+    """
+    labels = gt.ravel()
+    pixels = np.flatnonzero(~np.isin(labels, list(ignored_labels)))
+    pixels = pixels[np.argsort(labels[pixels], kind='stable')]
+
+    counts = np.bincount(labels[pixels], minlength=int(labels.max()) + 1)
+    offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    rows, cols = np.unravel_index(pixels, gt.shape)
+    spectra = np.asarray(data[rows, cols], dtype=np.float32)
+
+    return (tf.constant(spectra),
+            tf.constant(offsets, dtype=tf.int32),
+            tf.constant(counts, dtype=tf.int32))
+
+def _select_samples(batch_size, probability):
+    """Returns the (K, 1) indices of the samples drawn with a probability."""
+    return tf.where(tf.random.uniform([batch_size]) < probability)
+
+def random_flip(patches, label_patches):
+    """
+    Flips each patch, and its labels, horizontally and vertically, each
+    with a probability of 0.5.
+
+    Parameters
+    ----------
+    patches : tf.Tensor
+        (batch, rows, cols, bands) patches
+    label_patches : tf.Tensor
+        (batch, rows, cols) labels of the patches' pixels
+
+    Returns
+    -------
+    patches : tf.Tensor
+        The flipped patches
+    label_patches : tf.Tensor
+        The flipped labels
+    """
+    batch_size = tf.shape(patches)[0]
+    for axis in (2, 1):
+        flip = tf.random.uniform([batch_size]) < 0.5
+        patches = tf.where(flip[:, None, None, None],
+                           tf.reverse(patches, [axis]), patches)
+        label_patches = tf.where(flip[:, None, None],
+                                 tf.reverse(label_patches, [axis]), label_patches)
+    return patches, label_patches
+
+def radiation_noise(patches, probability=RADIATION_PROBABILITY,
+                    alpha_range=(0.9, 1.1), beta=NOISE_SCALE):
+    """
+    Scales a random subset of the patches by a random illumination
+    factor and adds Gaussian noise to them.
+
+    Parameters
+    ----------
+    patches : tf.Tensor
+        (batch, rows, cols, bands) patches
+    probability : float, optional
+        Probability that a patch is augmented
+    alpha_range : tuple of float, optional
+        Range of the illumination factor
+    beta : float, optional
+        Standard deviation of the noise
+
+    Returns
+    -------
+    tf.Tensor
+        The augmented patches
+    """
+    selected = _select_samples(tf.shape(patches)[0], probability)
+    selected_patches = tf.gather_nd(patches, selected)
+
+    alpha = tf.random.uniform([tf.shape(selected)[0], 1, 1, 1], *alpha_range)
+    noise = tf.random.normal(tf.shape(selected_patches))
+    return tf.tensor_scatter_nd_update(patches, selected,
+                                       alpha * selected_patches + beta * noise)
+
+def mixture_noise(patches, label_patches, class_pools,
+                  probability=MIXTURE_PROBABILITY, beta=NOISE_SCALE):
+    """
+    Mixes each pixel of a random subset of the patches with the spectrum
+    of a random pixel of the same class and adds Gaussian noise.
+
+    Parameters
+    ----------
+    patches : tf.Tensor
+        (batch, rows, cols, bands) patches
+    label_patches : tf.Tensor
+        (batch, rows, cols) labels of the patches' pixels
+    class_pools : tuple of tf.Tensor
+        The spectra pools from make_class_pools. Pixels of labels without
+        a pool are mixed with themselves.
+    probability : float, optional
+        Probability that a patch is augmented
+    beta : float, optional
+        Standard deviation of the noise
+
+    Returns
+    -------
+    tf.Tensor
+        The augmented patches
+    """
+    spectra, offsets, counts = class_pools
+
+    selected = _select_samples(tf.shape(patches)[0], probability)
+    selected_patches = tf.gather_nd(patches, selected)
+    labels = tf.cast(tf.gather_nd(label_patches, selected), tf.int32)
+
+    # Draw a random spectrum from the pool of each pixel's class
+    label_counts = tf.gather(counts, labels)
+    draws = tf.cast(tf.random.uniform(tf.shape(labels))
+                    * tf.cast(label_counts, tf.float32), tf.int32)
+    draws = tf.minimum(draws, tf.maximum(label_counts - 1, 0))
+    pool_indices = tf.minimum(tf.gather(offsets, labels) + draws,
+                              tf.shape(spectra)[0] - 1)
+    others = tf.where((label_counts > 0)[..., None],
+                      tf.gather(spectra, pool_indices), selected_patches)
+
+    num_selected = tf.shape(selected)[0]
+    alpha1 = tf.random.uniform([num_selected, 1, 1, 1], 0.01, 1.0)
+    alpha2 = tf.random.uniform([num_selected, 1, 1, 1], 0.01, 1.0)
+    noise = tf.random.normal(tf.shape(selected_patches))
+    mixed = ((alpha1 * selected_patches + alpha2 * others) / (alpha1 + alpha2)
+             + beta * noise)
+    return tf.tensor_scatter_nd_update(patches, selected, mixed)
+
+### Classes ###
+
+class BatchAugmenter(object):
+    """
+    Augments batches of training patches with random flips, radiation
+    noise and mixture noise.
+
+    The class pools for mixture noise are gathered once from the
+    dataset's image, and the augmentations run as one compiled
+    Tensorflow function per batch.
+    """
+
+    def __init__(self, data, gt, ignored_labels, flip=False, radiation=False,
+                 mixture=False):
+        """
+        Parameters
+        ----------
+        data : np.ndarray
+            (rows, cols, bands) hyperspectral image of the dataset
+        gt : np.ndarray
+            (rows, cols) ground truth labels of the dataset
+        ignored_labels : iterable of int
+            Labels left out of the mixture noise pools
+        flip : bool, optional
+            Set to True to randomly flip the patches
+        radiation : bool, optional
+            Set to True to add radiation noise
+        mixture : bool, optional
+            Set to True to add mixture noise
+        """
+        self.flip = flip
+        self.radiation = radiation
+        self.mixture = mixture
+        self.class_pools = None
+        if mixture:
+            self.class_pools = make_class_pools(data, gt, ignored_labels)
+            if self.class_pools[0].shape[0] == 0:
+                print('<!> No labelled pixels for mixture augmentation, disabling it <!>')
+                self.mixture = False
+        self._augment = tf.function(self.augment, experimental_relax_shapes=True)
+
+    def __call__(self, patches, label_patches):
+        return self._augment(patches, label_patches)
+
+    @property
+    def enabled(self):
+        return self.flip or self.radiation or self.mixture
+
+    def augment(self, patches, label_patches):
+        """
+        Augments a batch.
+
+        Parameters
+        ----------
+        patches : tf.Tensor
+            (batch, rows, cols, bands) patches
+        label_patches : tf.Tensor
+            (batch, rows, cols) labels of the patches' pixels
+
+        Returns
+        -------
+        tf.Tensor
+            The augmented patches
+        """
+        if self.flip:
+            patches, label_patches = random_flip(patches, label_patches)
+        if self.radiation:
+            patches = radiation_noise(patches)
+        if self.mixture:
+            patches = mixture_noise(patches, label_patches, self.class_pools)
+        return patches
@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Batch size and throughput autotuner module
+
+This script defines the autotune mode of the test harness, which finds
+the largest training batch size of a model that fits in device memory,
+measures the training throughput of a few candidate batch sizes and
+data loading worker counts, and writes out the fastest configuration.
+
+Author:  Christopher Good
+Version: 1.0.0
+
+Usage: autotune.py
+
+"""
+# See following link for proper docstring documentation
+# https://pandas.pydata.org/docs/development/contributing_docstring.html
+
+### Futures ###
+#TODO
+
+### Built-in Imports ###
+import gc
+import json
+import os
+import time
+
+### Other Library Imports ###
+import numpy as np
+import tensorflow as tf
+
+### Local Imports ###
+from datasets import HyperspectralDataset
+from model_profiler import (
+    estimate_max_batch_size,
+    get_device_memory_bytes,
+    profile_layers,
+)
+from models import get_optimizer
+
+### Constants ###
+
+# Size of the synthetic image used when no dataset is loaded
+SYNTHETIC_IMAGE_SIZE = 145
+
+### Definitions ###
+
+def make_synthetic_image(bands, num_classes, size=SYNTHETIC_IMAGE_SIZE, seed=0):
+    """
+    Returns a random (size, size, bands) data cube and a ground truth
+    image labelling every pixel with a class in [1, num_classes).
+    """
+    rng = np.random.default_rng(seed)
+    data = rng.random((size, size, bands), dtype=np.float32)
+    gt = rng.integers(1, num_classes, size=(size, size)).astype(np.uint8)
+    return data, gt
+
+def fits_in_memory(model, batch_size, num_classes):
+    """
+    Returns whether a training step of a compiled model on a batch fits
+    in the device's memory.
+    """
+    input_shape = (batch_size,) + tuple(model.input_shape[1:])
+    x = y = None
+    try:
+        x = tf.random.uniform(input_shape, dtype=model.inputs[0].dtype)
+        y = tf.random.uniform((batch_size,), maxval=num_classes, dtype=tf.int64)
+        model.train_on_batch(x, y)
+        return True
+    except tf.errors.ResourceExhaustedError:
+        return False
+    finally:
+        # Free the batch before the next attempt
+        del x, y
+        gc.collect()
+
+def find_max_batch_size(model, num_classes, upper_bound=4096):
+    """
+    Finds the largest training batch size of a compiled model that fits
+    in the device's memory.
+
+    The batch size is doubled until a training step runs out of memory,
+    then binary searched between the last size that fit and the first
+    that did not.
+
+    Parameters
+    ----------
+    model : tf.keras.Model
+        A compiled model
+    num_classes : int
+        Number of classes of the model's output
+    upper_bound : int, optional
+        Largest batch size to try
+
+    Returns
+    -------
+    int
+        The largest batch size that fits (0 if none does)
+    """
+    low, high = 0, None
+    batch_size = 1
+    while batch_size <= upper_bound:
+        fits = fits_in_memory(model, batch_size, num_classes)
+        print(f'  batch size {batch_size}: {"fits" if fits else "out of memory"}')
+        if not fits:
+            high = batch_size
+            break
+        low = batch_size
+        batch_size *= 2
+
+    if high is None:
+        # Every doubling fit, so search up to the upper bound
+        if low == upper_bound:
+            return low
+        high = upper_bound + 1
+
+    while high - low > 1:
+        batch_size = (low + high) // 2
+        fits = fits_in_memory(model, batch_size, num_classes)
+        print(f'  batch size {batch_size}: {"fits" if fits else "out of memory"}')
+        if fits:
+            low = batch_size
+        else:
+            high = batch_size
+    return low
+
+def get_candidate_batch_sizes(max_batch_size, count=4):
+    """
+    Returns the batch sizes whose throughput is measured: the largest
+    batch size that fits and the powers of two below it.
+    """
+    candidates = [max_batch_size]
+    batch_size = 2 ** int(np.log2(max_batch_size))
+    while len(candidates) < count and batch_size >= 1:
+        if batch_size not in candidates:
+            candidates.append(batch_size)
+        batch_size //= 2
+    return candidates
+
+def measure_training_throughput(model, dataset, workers, steps=20, warmup_steps=3):
+    """
+    Measures the training throughput of a compiled model fed by a
+    dataset with a number of data loading workers.
+
+    Parameters
+    ----------
+    model : tf.keras.Model
+        A compiled model
+    dataset : HyperspectralDataset
+        The training dataset, with the batch size to measure
+    workers : int
+        Number of threads loading batches
+    steps : int, optional
+        Number of timed training steps
+    warmup_steps : int, optional
+        Number of untimed training steps, run first so tracing the
+        training function is not timed
+
+    Returns
+    -------
+    float
+        Training samples per second
+    """
+    steps = min(steps, len(dataset))
+    model.fit(dataset, epochs=1, steps_per_epoch=min(warmup_steps, len(dataset)),
+              workers=workers, verbose=0)
+
+    start = time.perf_counter()
+    model.fit(dataset, epochs=1, steps_per_epoch=steps, workers=workers, verbose=0)
+    elapsed = time.perf_counter() - start
+    return steps * dataset.batch_size / elapsed
+
+def run_autotune(hyperparams, device, create_model_function, load_function=None):
+    """
+    Finds the largest batch size of a model that fits in device memory,
+    measures the training throughput of candidate batch sizes and worker
+    counts, and writes the fastest configuration to a JSON file in the
+    output path.
+
+    Parameters
+    ----------
+    hyperparams : dict
+        The command line hyperparameters, with the 'model_id',
+        'patch_size' and either 'autotune_bands' or a 'dataset'
+    device : str
+        Tensorflow device string to tune on
+    create_model_function : callable
+        Function with the signature of test_harness.create_model
+    load_function : callable, optional
+        Function with the signature of test_harness.load_dataset, used
+        when 'autotune_bands' is not given
+
+    Returns
+    -------
+    dict
+        The best configuration and every measurement
+    """
+    patch_size = hyperparams['patch_size']
+    bands = hyperparams.get('autotune_bands')
+
+    # Tune on the dataset, or on a synthetic image with the given bands
+    if bands is None:
+        data, gt, _, dataset_info, _ = load_function(hyperparams['dataset'], **hyperparams)
+        num_classes = dataset_info['num_classes']
+        ignored_labels = dataset_info['ignored_labels']
+        bands = data.shape[-1]
+    else:
+        num_classes = hyperparams.get('autotune_classes', 16)
+        ignored_labels = [0]
+        data, gt = make_synthetic_image(bands, num_classes)
+
+    with tf.device(device):
+        model = create_model_function(patch_size, patch_size, bands,
+                                      num_classes, **hyperparams)
+        model.compile(loss='sparse_categorical_crossentropy',
+                      optimizer=get_optimizer(**hyperparams),
+                      metrics=['sparse_categorical_accuracy'])
+
+        # Out of memory errors are not raised on CPU, so bound the search
+        # with the estimate from the model's layer profile
+        upper_bound = hyperparams['autotune_max_batch_size']
+        memory_bytes = get_device_memory_bytes(device)
+        if 'GPU' not in device and memory_bytes is not None:
+            layer_profile = profile_layers(model, batch_size=1,
+                                           measure_layer_latencies=False)
+            estimate = estimate_max_batch_size(layer_profile, 1, memory_bytes)
+            upper_bound = max(min(upper_bound, estimate), 1)
+
+        print('-------------------------------------------------------------------')
+        print('SEARCHING FOR THE MAXIMUM BATCH SIZE')
+        print('-------------------------------------------------------------------')
+        max_batch_size = find_max_batch_size(model, num_classes, upper_bound)
+        print(f'< Maximum batch size: {max_batch_size} >')
+        if max_batch_size == 0:
+            raise RuntimeError('Not even a batch of 1 fits in device memory!')
+
+        print('-------------------------------------------------------------------')
+        print('MEASURING TRAINING THROUGHPUT')
+        print('-------------------------------------------------------------------')
+        dataset_hyperparams = dict(hyperparams, n_classes=num_classes,
+                                   ignored_labels=ignored_labels,
+                                   supervision='full',
+                                   loss='sparse_categorical_crossentropy',
+                                   input_dtype=model.inputs[0].dtype.name)
+
+        trials = []
+        for batch_size in get_candidate_batch_sizes(max_batch_size):
+            dataset_hyperparams['batch_size'] = batch_size
+            dataset = HyperspectralDataset(data, gt, **dataset_hyperparams)
+            for workers in hyperparams['autotune_workers']:
+                samples_per_sec = measure_training_throughput(
+                    model, dataset, workers, steps=hyperparams['autotune_steps'])
+                trials.append({'batch_size': batch_size, 'workers': workers,
+                               'samples_per_sec': samples_per_sec})
+                print(f'  batch size {batch_size}, {workers} workers: '
+                      f'{samples_per_sec:.1f} samples/sec')
+
+    best = max(trials, key=lambda trial: trial['samples_per_sec'])
+    results = {
+        'model_id': hyperparams['model_id'],
+        'patch_size': patch_size,
+        'bands': int(bands),
+        'device': device,
+        'max_batch_size': max_batch_size,
+        'best': best,
+        'trials': trials,
+    }
+
+    path = os.path.join(hyperparams['output_path'],
+        f'autotune_{hyperparams["model_id"]}_p{patch_size}_b{bands}.json')
+    with open(path, 'w') as jf:
+        json.dump(results, jf, indent=4)
+
+    print('-------------------------------------------------------------------')
+    print(f'< Best configuration: --batch_size {best["batch_size"]} '
+          f'--workers {best["workers"]} ({best["samples_per_sec"]:.1f} samples/sec) >')
+    print(f'< Autotune results written to {path} >')
+
+    return results
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Data pipeline benchmarks module
+
+This script defines benchmarks for the dataset hot paths in datasets.py
+and the tile merging in grss_dfc_2018_uh.py, run on synthetic data.
+
+Author:  Christopher Good
+Version: 1.0.0
+
+Usage: bench_data.py
+
+"""
+# See following link for proper docstring documentation
+# https://pandas.pydata.org/docs/development/contributing_docstring.html
+
+### Other Library Imports ###
+import numpy as np
+
+### Local Imports ###
+from common import (
+    make_hyperparams,
+    make_synthetic_cube,
+    time_function,
+)
+from datasets import (
+    HyperspectralDataset,
+    create_datasets,
+    get_valid_indices,
+    sample_gt,
+)
+
+### Constants ###
+SAMPLE_GT_MODES = ('random', 'fixed', 'disjoint')
+
+### Definitions ###
+
+def bench_get_valid_indices(config):
+    """Times get_valid_indices for each patch size."""
+    data, gt = make_synthetic_cube(config['rows'], config['cols'],
+                                   config['bands'], config['classes'])
+    results = {}
+    for patch_size in config['patch_sizes']:
+        results[f'get_valid_indices/patch_{patch_size}'] = time_function(
+            lambda: get_valid_indices(data, gt, patch_size, [0]),
+            repeats=config['repeats'], warmup=config['warmup'])
+    return results
+
+def bench_sample_gt(config):
+    """Times sample_gt for each sampling mode."""
+    _, gt = make_synthetic_cube(config['rows'], config['cols'],
+                                1, config['classes'])
+    results = {}
+    for mode in SAMPLE_GT_MODES:
+        # Fixed mode samples a fixed number of pixels per class
+        train_size = 10 if mode == 'fixed' else 0.8
+        results[f'sample_gt/{mode}'] = time_function(
+            lambda: sample_gt(gt, train_size, mode=mode),
+            repeats=config['repeats'], warmup=config['warmup'])
+    return results
+
+def _time_getitem(dataset, config):
+    """Times HyperspectralDataset.__getitem__ per batch of a dataset."""
+    num_batches = min(len(dataset), config['getitem_batches'])
+
+    def fetch_batches():
+        for i in range(num_batches):
+            dataset[i]
+
+    stats = time_function(fetch_batches, repeats=config['repeats'],
+                          warmup=config['warmup'])
+
+    # Report the statistics per batch rather than per call
+    for key in ('min', 'median', 'mean', 'std'):
+        stats[key] /= num_batches
+    stats['batch_size'] = config['batch_size']
+    return stats
+
+def bench_dataset_getitem(config):
+    """Times HyperspectralDataset.__getitem__ per batch for each patch size."""
+    data, gt = make_synthetic_cube(config['rows'], config['cols'],
+                                   config['bands'], config['classes'])
+    results = {}
+    for patch_size in config['patch_sizes']:
+        hyperparams = make_hyperparams(config['classes'], patch_size,
+                                       config['batch_size'])
+        dataset = HyperspectralDataset(data, gt, **hyperparams)
+        results[f'HyperspectralDataset.__getitem__/patch_{patch_size}'] = \
+            _time_getitem(dataset, config)
+    return results
+
+def bench_augmented_getitem(config):
+    """
+    Times HyperspectralDataset.__getitem__ per batch with flip, radiation
+    and mixture augmentation for each patch size.
+    """
+    data, gt = make_synthetic_cube(config['rows'], config['cols'],
+                                   config['bands'], config['classes'])
+    results = {}
+    for patch_size in config['patch_sizes']:
+        hyperparams = make_hyperparams(config['classes'], patch_size,
+                                       config['batch_size'],
+                                       flip_augmentation=True,
+                                       radiation_augmentation=True,
+                                       mixture_augmentation=True)
+        dataset = HyperspectralDataset(data, gt, augment=True, **hyperparams)
+        results[f'HyperspectralDataset.__getitem__/augmented/patch_{patch_size}'] = \
+            _time_getitem(dataset, config)
+    return results
+
+def bench_create_datasets(config):
+    """Times create_datasets for each patch size."""
+    data, gt = make_synthetic_cube(config['rows'], config['cols'],
+                                   config['bands'], config['classes'])
+    train_gt, test_gt = sample_gt(gt, 0.5, mode='random')
+    results = {}
+    for patch_size in config['patch_sizes']:
+        hyperparams = make_hyperparams(config['classes'], patch_size,
+                                       config['batch_size'])
+        results[f'create_datasets/patch_{patch_size}'] = time_function(
+            lambda: create_datasets(data, train_gt, test_gt, **hyperparams),
+            repeats=config['repeats'], warmup=config['warmup'])
+    return results
+
+def bench_merge_tiles(config):
+    """Times UH_2018_Dataset.merge_tiles on synthetic tiles."""
+    # Imported here so the remaining benchmarks can run without the
+    # GRSS DFC 2018 dataset dependencies
+    from grss_dfc_2018_uh import UH_2018_Dataset
+
+    dataset = UH_2018_Dataset()
+    num_rows = dataset.dataset_tiled_subset_rows
+    num_cols = dataset.dataset_tiled_subset_cols
+    tile_rows = max(config['rows'] // num_rows, 1)
+    tile_cols = max(config['cols'] // num_cols, 1)
+    rng = np.random.default_rng(0)
+    tiles = [rng.random((tile_rows, tile_cols, config['bands']), dtype=np.float32)
+             for _ in range(num_rows * num_cols)]
+
+    return {
+        'merge_tiles': time_function(
+            lambda: dataset.merge_tiles(tiles, num_rows, num_cols),
+            repeats=config['repeats'], warmup=config['warmup'])
+    }
+
+### Benchmark Registry ###
+DATA_BENCHMARKS = {
+    'get_valid_indices': bench_get_valid_indices,
+    'sample_gt': bench_sample_gt,
+    'getitem': bench_dataset_getitem,
+    'augmented_getitem': bench_augmented_getitem,
+    'create_datasets': bench_create_datasets,
+    'merge_tiles': bench_merge_tiles,
+}
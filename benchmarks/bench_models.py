@@ -0,0 +1,403 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Model benchmarks module
+
+This script defines benchmarks for the forward and backward steps of
+the models defined in models.py, run on synthetic patches.
+
+Author:  Christopher Good
+Version: 1.0.0
+
+Usage: bench_models.py
+
+"""
+# See following link for proper docstring documentation
+# https://pandas.pydata.org/docs/development/contributing_docstring.html
+
+### Other Library Imports ###
+import numpy as np
+import tensorflow as tf
+
+### Local Imports ###
+from callbacks import (
+    get_peak_gpu_memory_mb,
+    get_peak_rss_mb,
+)
+from common import (
+    run_isolated,
+    time_function,
+)
+from model_profiler import (
+    count_flops,
+    measure_latency,
+)
+from models import (
+    BLOCK_TYPES,
+    baseline_cnn_model,
+    cnn_3d_model,
+    densenet_model,
+    get_mixed_precision_policy,
+)
+
+### Constants ###
+
+# DenseNet architectures profiled by the densenet_family benchmark,
+# from the paper's architecture down to smaller and cheaper variants
+DENSENET_FAMILY = [
+    {'blocks': (6, 6, 6), 'growth_rate': 32, 'bottleneck': True, 'compression': 0.5, 'stem_filters': 64},
+    {'blocks': (6, 6, 6), 'growth_rate': 32, 'bottleneck': False, 'compression': 0.5, 'stem_filters': 64},
+    {'blocks': (6, 6, 6), 'growth_rate': 16, 'bottleneck': True, 'compression': 0.5, 'stem_filters': 32},
+    {'blocks': (4, 4, 4), 'growth_rate': 24, 'bottleneck': True, 'compression': 0.5, 'stem_filters': 48},
+    {'blocks': (4, 4), 'growth_rate': 32, 'bottleneck': True, 'compression': 0.5, 'stem_filters': 64},
+    {'blocks': (4, 4), 'growth_rate': 16, 'bottleneck': True, 'compression': 0.5, 'stem_filters': 32},
+    {'blocks': (3, 3, 3), 'growth_rate': 12, 'bottleneck': True, 'compression': 0.5, 'stem_filters': 24},
+    {'blocks': (2, 2), 'growth_rate': 12, 'bottleneck': False, 'compression': 1.0, 'stem_filters': 16},
+]
+
+### Definitions ###
+
+def build_model(model_id, patch_size, bands, num_classes,
+                data_layout='channels', block_type='standard'):
+    """
+    Builds a model the same way the test harness does for a model id.
+    """
+    if model_id == '3d-densenet':
+        return densenet_model(img_rows=patch_size,
+                              img_cols=patch_size,
+                              img_channels=bands,
+                              nb_classes=num_classes,
+                              data_layout=data_layout,
+                              block_type=block_type)
+    elif model_id == '3d-cnn':
+        return cnn_3d_model(img_rows=patch_size,
+                            img_cols=patch_size,
+                            img_channels=bands,
+                            nb_classes=num_classes,
+                            data_layout=data_layout,
+                            block_type=block_type)
+    elif model_id == 'cnn-baseline':
+        return baseline_cnn_model(img_rows=patch_size,
+                                  img_cols=patch_size,
+                                  img_channels=bands,
+                                  patch_size=patch_size // 2 + 1,
+                                  nb_filters=num_classes * 2,
+                                  nb_classes=num_classes,
+                                  data_layout=data_layout)
+    raise ValueError(f'Unknown model id: {model_id}')
+
+def make_step_functions(model, jit_compile=False):
+    """
+    Creates compiled forward and forward/backward step functions for a
+    model, optionally compiled with XLA.
+    """
+    loss_fn = tf.keras.losses.SparseCategoricalCrossentropy()
+    optimizer = tf.keras.optimizers.SGD(learning_rate=0.001)
+
+    # float16 training needs loss scaling to keep gradients from
+    # underflowing, as in training with the test harness
+    loss_scaling = tf.keras.mixed_precision.global_policy().compute_dtype == 'float16'
+    if loss_scaling:
+        optimizer = tf.keras.mixed_precision.LossScaleOptimizer(optimizer)
+
+    @tf.function(jit_compile=jit_compile)
+    def forward_step(x):
+        return model(x, training=False)
+
+    @tf.function(jit_compile=jit_compile)
+    def train_step(x, y):
+        with tf.GradientTape() as tape:
+            loss = loss_fn(y, model(x, training=True))
+            if loss_scaling:
+                scaled_loss = optimizer.get_scaled_loss(loss)
+        if loss_scaling:
+            gradients = tape.gradient(scaled_loss, model.trainable_variables)
+            gradients = optimizer.get_unscaled_gradients(gradients)
+        else:
+            gradients = tape.gradient(loss, model.trainable_variables)
+        optimizer.apply_gradients(zip(gradients, model.trainable_variables))
+        return loss
+
+    return forward_step, train_step
+
+def bench_model_steps(model_id, config, data_layout='channels'):
+    """Times forward and backward steps of a model for each patch size."""
+    results = {}
+    rng = np.random.default_rng(0)
+    for patch_size in config['patch_sizes']:
+        model = build_model(model_id, patch_size, config['bands'],
+                            config['classes'], data_layout)
+        input_shape = (config['batch_size'],) + tuple(model.input_shape[1:])
+        x = tf.constant(rng.random(input_shape, dtype=np.float32))
+        y = tf.constant(rng.integers(0, config['classes'],
+                                     size=config['batch_size']))
+
+        forward_step, train_step = make_step_functions(model)
+
+        # Use at least one warmup call so graph tracing is not timed
+        warmup = max(config['warmup'], 1)
+        name = f'{model_id}/patch_{patch_size}'
+        if data_layout != 'channels':
+            name = f'{model_id}/{data_layout}/patch_{patch_size}'
+        results[f'{name}/forward'] = time_function(
+            lambda: forward_step(x).numpy(),
+            repeats=config['repeats'], warmup=warmup)
+        results[f'{name}/train_step'] = time_function(
+            lambda: train_step(x, y).numpy(),
+            repeats=config['repeats'], warmup=warmup)
+
+        for key in (f'{name}/forward', f'{name}/train_step'):
+            results[key]['batch_size'] = config['batch_size']
+            results[key]['samples_per_sec'] = (
+                config['batch_size'] / results[key]['median'])
+            results[key]['params'] = model.count_params()
+            results[key]['data_layout'] = data_layout
+
+        tf.keras.backend.clear_session()
+    return results
+
+def get_densenet_family_name(densenet_config):
+    """Returns a short name for a DenseNet architecture."""
+    return ('densenet_family/'
+            f'b{"-".join(str(block) for block in densenet_config["blocks"])}'
+            f'_g{densenet_config["growth_rate"]}'
+            f'_{"bn" if densenet_config["bottleneck"] else "nobn"}'
+            f'_c{densenet_config["compression"]}'
+            f'_s{densenet_config["stem_filters"]}')
+
+def bench_densenet_family(config, data_layout='channels'):
+    """
+    Profiles the parameters, FLOPs and CPU latency of each DenseNet
+    architecture in DENSENET_FAMILY at the largest patch size.
+    """
+    results = {}
+    patch_size = max(config['patch_sizes'])
+    for densenet_config in DENSENET_FAMILY:
+        model = densenet_model(img_rows=patch_size,
+                               img_cols=patch_size,
+                               img_channels=config['bands'],
+                               nb_classes=config['classes'],
+                               data_layout=data_layout,
+                               **densenet_config)
+
+        latency = measure_latency(model, batch_size=1,
+                                  repeats=config['repeats'] * 10,
+                                  warmup=max(config['warmup'], 1))
+
+        name = get_densenet_family_name(densenet_config)
+        results[f'{name}/cpu_latency'] = {
+            # Latency is reported in seconds like the other benchmarks
+            'min': latency['min'] / 1000.0,
+            'median': latency['median'] / 1000.0,
+            'mean': latency['mean'] / 1000.0,
+            'patch_size': patch_size,
+            'params': model.count_params(),
+            'flops': count_flops(model),
+            'data_layout': data_layout,
+        }
+
+        tf.keras.backend.clear_session()
+    return results
+
+def measure_densenet_memory(patch_size, config, memory_efficient):
+    """
+    Times the DenseNet training step and records the peak memory of the
+    current process. Run with run_isolated so the peak memory only
+    covers this model.
+    """
+    gpus = tf.config.list_physical_devices('GPU')
+    for gpu in gpus:
+        tf.config.experimental.set_memory_growth(gpu, True)
+
+    rng = np.random.default_rng(0)
+    model = densenet_model(img_rows=patch_size,
+                           img_cols=patch_size,
+                           img_channels=config['bands'],
+                           nb_classes=config['classes'],
+                           memory_efficient=memory_efficient)
+    input_shape = (config['batch_size'],) + tuple(model.input_shape[1:])
+    x = tf.constant(rng.random(input_shape, dtype=np.float32))
+    y = tf.constant(rng.integers(0, config['classes'],
+                                 size=config['batch_size']))
+
+    _, train_step = make_step_functions(model)
+    stats = time_function(lambda: train_step(x, y).numpy(),
+                          repeats=config['repeats'],
+                          warmup=max(config['warmup'], 1))
+
+    # The GPU peak is the allocator peak; on CPU the process peak
+    # resident set size (which includes the Tensorflow runtime) is used
+    if gpus:
+        stats['peak_memory_mb'] = get_peak_gpu_memory_mb('/GPU:0')
+        stats['memory_source'] = 'gpu_allocator'
+    else:
+        stats['peak_memory_mb'] = get_peak_rss_mb()
+        stats['memory_source'] = 'peak_rss'
+    stats['batch_size'] = config['batch_size']
+    stats['params'] = model.count_params()
+    return stats
+
+def bench_densenet_memory(config):
+    """
+    Compares the peak memory and training step time of the standard and
+    memory-efficient DenseNet for each patch size.
+    """
+    results = {}
+    for patch_size in config['patch_sizes']:
+        for memory_efficient in (False, True):
+            mode = 'efficient' if memory_efficient else 'standard'
+            name = f'densenet_memory/{mode}/patch_{patch_size}/train_step'
+            results[name] = run_isolated(measure_densenet_memory, patch_size,
+                                         config, memory_efficient)
+    return results
+
+def bench_block_types(config):
+    """
+    Compares the FLOPs and CPU latency of the convolution block types
+    of the DenseNet and 3D-CNN models at the largest patch size.
+    """
+    results = {}
+    patch_size = max(config['patch_sizes'])
+    has_gpu = bool(tf.config.list_physical_devices('GPU'))
+    for model_id in ('3d-densenet', '3d-cnn'):
+        for data_layout in ('channels', 'spectral'):
+            for block_type in BLOCK_TYPES:
+                # Grouped Conv3D layers only run on GPU
+                if block_type == 'separable' and not has_gpu:
+                    print(f'  Skipping {model_id}/{data_layout}/separable (requires a GPU)')
+                    continue
+
+                model = build_model(model_id, patch_size, config['bands'],
+                                    config['classes'], data_layout, block_type)
+                latency = measure_latency(model, batch_size=1,
+                                          repeats=config['repeats'] * 10,
+                                          warmup=max(config['warmup'], 1))
+
+                name = f'block_types/{model_id}/{data_layout}/{block_type}/cpu_latency'
+                results[name] = {
+                    # Latency is reported in seconds like the other benchmarks
+                    'min': latency['min'] / 1000.0,
+                    'median': latency['median'] / 1000.0,
+                    'mean': latency['mean'] / 1000.0,
+                    'patch_size': patch_size,
+                    'params': model.count_params(),
+                    'flops': count_flops(model),
+                }
+
+                tf.keras.backend.clear_session()
+    return results
+
+def measure_mixed_precision_step(patch_size, config, policy):
+    """
+    Times the DenseNet training step under a precision policy and
+    records the peak memory of the current process. Run with
+    run_isolated so the global policy and peak memory only cover this
+    model.
+    """
+    gpus = tf.config.list_physical_devices('GPU')
+    for gpu in gpus:
+        tf.config.experimental.set_memory_growth(gpu, True)
+    tf.keras.mixed_precision.set_global_policy(policy)
+    input_dtype = tf.keras.mixed_precision.global_policy().compute_dtype
+
+    rng = np.random.default_rng(0)
+    model = densenet_model(img_rows=patch_size,
+                           img_cols=patch_size,
+                           img_channels=config['bands'],
+                           nb_classes=config['classes'])
+    input_shape = (config['batch_size'],) + tuple(model.input_shape[1:])
+    x = tf.cast(rng.random(input_shape, dtype=np.float32), input_dtype)
+    y = tf.constant(rng.integers(0, config['classes'],
+                                 size=config['batch_size']))
+
+    _, train_step = make_step_functions(model)
+    stats = time_function(lambda: train_step(x, y).numpy(),
+                          repeats=config['repeats'],
+                          warmup=max(config['warmup'], 1))
+
+    if gpus:
+        stats['peak_memory_mb'] = get_peak_gpu_memory_mb('/GPU:0')
+        stats['memory_source'] = 'gpu_allocator'
+    else:
+        stats['peak_memory_mb'] = get_peak_rss_mb()
+        stats['memory_source'] = 'peak_rss'
+    stats['samples_per_second'] = config['batch_size'] / stats['median']
+    stats['batch_size'] = config['batch_size']
+    stats['precision'] = policy
+    return stats
+
+def bench_mixed_precision(config):
+    """
+    Compares the DenseNet training step time, throughput and peak memory
+    in float32 and in the mixed precision policies the hardware supports
+    (mixed_float16 on GPU, mixed_bfloat16 on CPUs with bfloat16
+    instructions).
+    """
+    policies = ['float32']
+    if tf.config.list_physical_devices('GPU'):
+        policies.append('mixed_float16')
+    if get_mixed_precision_policy('/CPU:0') == 'mixed_bfloat16':
+        policies.append('mixed_bfloat16')
+
+    results = {}
+    patch_size = max(config['patch_sizes'])
+    for policy in policies:
+        name = f'mixed_precision/{policy}/patch_{patch_size}/train_step'
+        results[name] = run_isolated(measure_mixed_precision_step,
+                                     patch_size, config, policy)
+    return results
+
+def bench_xla(config):
+    """
+    Compares the forward and training step times of the DenseNet and
+    3D-CNN with and without XLA compilation for each patch size, and
+    reports the speedup of the XLA compiled steps.
+    """
+    results = {}
+    rng = np.random.default_rng(0)
+    warmup = max(config['warmup'], 1)
+    for model_id in ('3d-densenet', '3d-cnn'):
+        for patch_size in config['patch_sizes']:
+            model = build_model(model_id, patch_size, config['bands'],
+                                config['classes'])
+            input_shape = (config['batch_size'],) + tuple(model.input_shape[1:])
+            x = tf.constant(rng.random(input_shape, dtype=np.float32))
+            y = tf.constant(rng.integers(0, config['classes'],
+                                         size=config['batch_size']))
+
+            name = f'xla/{model_id}/patch_{patch_size}'
+            for jit_compile in (False, True):
+                mode = 'xla' if jit_compile else 'graph'
+                forward_step, train_step = make_step_functions(model, jit_compile)
+                results[f'{name}/{mode}/forward'] = time_function(
+                    lambda: forward_step(x).numpy(),
+                    repeats=config['repeats'], warmup=warmup)
+                results[f'{name}/{mode}/train_step'] = time_function(
+                    lambda: train_step(x, y).numpy(),
+                    repeats=config['repeats'], warmup=warmup)
+
+            for step in ('forward', 'train_step'):
+                graph_stats = results[f'{name}/graph/{step}']
+                xla_stats = results[f'{name}/xla/{step}']
+                xla_stats['speedup'] = graph_stats['median'] / xla_stats['median']
+                graph_stats['batch_size'] = config['batch_size']
+                xla_stats['batch_size'] = config['batch_size']
+
+            tf.keras.backend.clear_session()
+    return results
+
+### Benchmark Registry ###
+MODEL_BENCHMARKS = {
+    'densenet': lambda config: bench_model_steps('3d-densenet', config),
+    'cnn_3d': lambda config: bench_model_steps('3d-cnn', config),
+    'cnn_baseline': lambda config: bench_model_steps('cnn-baseline', config),
+    'densenet_spectral': lambda config: bench_model_steps('3d-densenet', config, 'spectral'),
+    'densenet_2d': lambda config: bench_model_steps('3d-densenet', config, '2d'),
+    'cnn_3d_spectral': lambda config: bench_model_steps('3d-cnn', config, 'spectral'),
+    'cnn_3d_2d': lambda config: bench_model_steps('3d-cnn', config, '2d'),
+    'densenet_family': bench_densenet_family,
+    'densenet_memory': bench_densenet_memory,
+    'block_types': bench_block_types,
+    'mixed_precision': bench_mixed_precision,
+    'xla': bench_xla,
+}
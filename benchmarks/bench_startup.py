@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Startup benchmarks module
+
+This script defines benchmarks for the time a fresh Python process takes
+to import the harness modules, which is paid by every experiment worker
+process the parallel scheduler spawns, and reports which heavy libraries
+each import loads.
+
+Author:  Christopher Good
+Version: 1.0.0
+
+Usage: bench_startup.py
+
+"""
+# See following link for proper docstring documentation
+# https://pandas.pydata.org/docs/development/contributing_docstring.html
+
+### Built-in Imports ###
+import json
+import os
+import subprocess
+import sys
+
+### Local Imports ###
+from common import (
+    REPO_ROOT,
+    time_function,
+)
+
+### Constants ###
+
+# Harness modules whose import time is measured, in order of increasing
+# dependencies
+STARTUP_MODULES = ('datasets', 'grss_dfc_2018_uh', 'test_harness')
+
+# Libraries whose import dominates startup time
+HEAVY_MODULES = ('tensorflow', 'sklearn', 'pandas', 'matplotlib',
+                 'spectral', 'wx', 'rasterio')
+
+# Child process script that imports a module and prints the heavy
+# libraries it loaded
+IMPORT_SCRIPT = """
+import json, sys
+{import_statement}
+print(json.dumps([name for name in {heavy_modules!r} if name in sys.modules]))
+"""
+
+### Definitions ###
+
+def import_in_fresh_process(module=None):
+    """
+    Imports a module in a fresh Python process.
+
+    Parameters
+    ----------
+    module : str, optional
+        The module to import (None only starts the interpreter)
+
+    Returns
+    -------
+    list of str
+        The heavy libraries loaded by the import
+
+    Raises
+    ------
+    RuntimeError
+        If the import fails
+    """
+    import_statement = f'import {module}' if module is not None else ''
+    script = IMPORT_SCRIPT.format(import_statement=import_statement,
+                                  heavy_modules=HEAVY_MODULES)
+    env = dict(os.environ, TF_CPP_MIN_LOG_LEVEL='2')
+    result = subprocess.run([sys.executable, '-c', script], cwd=REPO_ROOT,
+                            env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f'Importing {module} failed:\n{result.stderr}')
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def bench_startup(config):
+    """
+    Times starting a fresh process that imports each harness module,
+    against starting the bare interpreter.
+    """
+    results = {}
+    for module in (None,) + STARTUP_MODULES:
+        name = f'startup/{module or "python"}'
+        stats = time_function(lambda: import_in_fresh_process(module),
+                              repeats=config['repeats'], warmup=config['warmup'])
+        stats['heavy_modules'] = import_in_fresh_process(module)
+        results[name] = stats
+        print(f'  >>> {name}: {stats["median"]:.3f} s, loads '
+              f'{", ".join(stats["heavy_modules"]) or "no heavy libraries"}')
+    return results
+
+### Benchmark Registry ###
+STARTUP_BENCHMARKS = {
+    'startup': bench_startup,
+}
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Benchmark utilities module
+
+This script defines shared helpers for the benchmark suite, such as
+synthetic hyperspectral data generation and timing functions.
+
+Author:  Christopher Good
+Version: 1.0.0
+
+Usage: common.py
+
+"""
+# See following link for proper docstring documentation
+# https://pandas.pydata.org/docs/development/contributing_docstring.html
+
+### Built-in Imports ###
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+import statistics
+import sys
+import time
+
+### Other Library Imports ###
+import numpy as np
+
+### Environment ###
+# Make the repository modules importable when running benchmark scripts
+# directly from the benchmarks directory
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+### Definitions ###
+
+def make_synthetic_cube(rows, cols, bands, num_classes,
+                        unlabeled_fraction=0.5, seed=0):
+    """
+    Creates a synthetic hyperspectral data cube and ground truth image.
+
+    Parameters
+    ----------
+    rows : int
+        Number of rows in the synthetic image
+    cols : int
+        Number of columns in the synthetic image
+    bands : int
+        Number of spectral bands in the synthetic image
+    num_classes : int
+        Number of classes in the ground truth, including the ignored
+        class 0
+    unlabeled_fraction : float, optional
+        Fraction of ground truth pixels set to the ignored class 0
+    seed : int, optional
+        Random number generator seed
+
+    Returns
+    -------
+    data : np.ndarray
+        (rows, cols, bands) float32 data cube with values in [0, 1)
+    gt : np.ndarray
+        (rows, cols) uint8 ground truth image
+    """
+    rng = np.random.default_rng(seed)
+    data = rng.random((rows, cols, bands), dtype=np.float32)
+    gt = rng.integers(1, num_classes, size=(rows, cols)).astype(np.uint8)
+    gt[rng.random((rows, cols)) < unlabeled_fraction] = 0
+    return data, gt
+
+def make_hyperparams(num_classes, patch_size, batch_size, **kwargs):
+    """
+    Creates the minimal hyperparameter dictionary needed by the dataset
+    functions in datasets.py.
+    """
+    hyperparams = {
+        'n_classes': num_classes,
+        'ignored_labels': [0],
+        'patch_size': patch_size,
+        'batch_size': batch_size,
+        'supervision': 'full',
+        'loss': 'sparse_categorical_crossentropy',
+        'train_split': 0.8,
+        'split_mode': 'random',
+    }
+    hyperparams.update(kwargs)
+    return hyperparams
+
+def time_function(function, repeats=5, warmup=1):
+    """
+    Times repeated calls of a function.
+
+    Parameters
+    ----------
+    function : callable
+        Function with no arguments to time
+    repeats : int, optional
+        Number of timed calls
+    warmup : int, optional
+        Number of untimed calls made before timing begins
+
+    Returns
+    -------
+    dict
+        Timing statistics of the calls in seconds
+    """
+    for _ in range(warmup):
+        function()
+
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    return {
+        'repeats': repeats,
+        'min': min(times),
+        'median': statistics.median(times),
+        'mean': statistics.mean(times),
+        'std': statistics.stdev(times) if len(times) > 1 else 0.0,
+    }
+
+def run_isolated(function, *args, **kwargs):
+    """
+    Runs a function in a fresh process and returns its result.
+
+    Used for measurements such as peak memory that would otherwise be
+    polluted by earlier benchmarks in the same process. The function
+    must be defined at module level so it can be pickled.
+    """
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(function, *args, **kwargs).result()
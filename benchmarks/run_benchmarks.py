@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Benchmark suite runner
+
+This script runs the data and model hot path benchmarks on synthetic
+hyperspectral cubes, saves the results as JSON and optionally compares
+them against a saved baseline to catch performance regressions.
+
+Author:  Christopher Good
+Version: 1.0.0
+
+Usage: python benchmarks/run_benchmarks.py [--output results.json]
+                                           [--compare baseline.json]
+
+"""
+# See following link for proper docstring documentation
+# https://pandas.pydata.org/docs/development/contributing_docstring.html
+
+### Built-in Imports ###
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+
+### Local Imports ###
+from common import REPO_ROOT
+from bench_data import DATA_BENCHMARKS
+from bench_models import MODEL_BENCHMARKS
+from bench_startup import STARTUP_BENCHMARKS
+
+### Environment ###
+# remove abundant output
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
+
+### Constants ###
+ALL_BENCHMARKS = {**DATA_BENCHMARKS, **MODEL_BENCHMARKS, **STARTUP_BENCHMARKS}
+
+### Definitions ###
+
+def run_benchmarks(config, selected=None):
+    """
+    Runs the selected benchmarks.
+
+    Parameters
+    ----------
+    config : dict
+        Synthetic data and timing configuration
+    selected : list of str, optional
+        Names of the benchmarks to run (all benchmarks if None)
+
+    Returns
+    -------
+    dict
+        Benchmark results keyed by benchmark case name
+    """
+    if selected is None:
+        selected = list(ALL_BENCHMARKS)
+
+    results = {}
+    for name in selected:
+        print(f'Running benchmark: {name}')
+        results.update(ALL_BENCHMARKS[name](config))
+    return results
+
+def compare_results(results, baseline, tolerance):
+    """
+    Compares benchmark results against a baseline.
+
+    Parameters
+    ----------
+    results : dict
+        Benchmark results keyed by benchmark case name
+    baseline : dict
+        Baseline benchmark results keyed by benchmark case name
+    tolerance : float
+        Allowed fractional slowdown of the median time before a case
+        is considered a regression
+
+    Returns
+    -------
+    list of dict
+        Comparison of every case present in both result sets
+    """
+    comparison = []
+    for name, stats in results.items():
+        if name not in baseline:
+            continue
+        ratio = stats['median'] / baseline[name]['median']
+        comparison.append({
+            'name': name,
+            'baseline_median': baseline[name]['median'],
+            'median': stats['median'],
+            'ratio': ratio,
+            'regression': ratio > 1.0 + tolerance,
+        })
+    return comparison
+
+def print_comparison(comparison):
+    """Prints a benchmark comparison table."""
+    header = '{:<60} | {:>12} | {:>12} | {:>7}'.format(
+        'BENCHMARK', 'BASELINE (s)', 'CURRENT (s)', 'RATIO')
+    print(header)
+    print('=' * len(header))
+    for row in comparison:
+        flag = '  <!> REGRESSION' if row['regression'] else ''
+        print('{:<60} | {:>12.6f} | {:>12.6f} | {:>7.3f}{}'.format(
+            row['name'], row['baseline_median'], row['median'],
+            row['ratio'], flag))
+
+def benchmark_parser():
+    """
+    Sets up the parser for command-line flags for the benchmark suite.
+
+    Returns
+    -------
+    argparse.ArgumentParser
+        An ArgumentParser object configured with the run_benchmarks.py
+        command-line arguments.
+    """
+    parser = argparse.ArgumentParser(
+        'Benchmark suite for the dataset and model hot paths')
+    parser.add_argument('--rows', type=int, default=256,
+        help='Rows in the synthetic data cube (default = 256)')
+    parser.add_argument('--cols', type=int, default=256,
+        help='Columns in the synthetic data cube (default = 256)')
+    parser.add_argument('--bands', type=int, default=48,
+        help='Spectral bands in the synthetic data cube (default = 48)')
+    parser.add_argument('--classes', type=int, default=21,
+        help='Number of classes, including the ignored class (default = 21)')
+    parser.add_argument('--patch_sizes', type=str, default='3,5,7,9,11,13,15',
+        help='Comma separated patch sizes (default = 3,5,7,9,11,13,15)')
+    parser.add_argument('--batch_size', type=int, default=64,
+        help='Batch size (default = 64)')
+    parser.add_argument('--getitem_batches', type=int, default=20,
+        help='Batches fetched per __getitem__ timing (default = 20)')
+    parser.add_argument('--repeats', type=int, default=5,
+        help='Timed repeats per benchmark case (default = 5)')
+    parser.add_argument('--warmup', type=int, default=1,
+        help='Untimed warmup calls per benchmark case (default = 1)')
+    parser.add_argument('--only', type=str, default=None,
+        help=f'Comma separated benchmarks to run ({",".join(ALL_BENCHMARKS)})')
+    parser.add_argument('--output', type=str, default='benchmark_results.json',
+        help='Path of the JSON results file (default = benchmark_results.json)')
+    parser.add_argument('--compare', type=str, default=None,
+        help='Path of a baseline JSON results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.10,
+        help='Allowed fractional slowdown before a regression (default = 0.10)')
+    return parser
+
+
+### Main ###
+
+if __name__ == "__main__":
+    parser = benchmark_parser()
+    args = parser.parse_args()
+
+    config = {
+        'rows': args.rows,
+        'cols': args.cols,
+        'bands': args.bands,
+        'classes': args.classes,
+        'patch_sizes': [int(p) for p in args.patch_sizes.split(',')],
+        'batch_size': args.batch_size,
+        'getitem_batches': args.getitem_batches,
+        'repeats': args.repeats,
+        'warmup': args.warmup,
+    }
+
+    selected = None
+    if args.only is not None:
+        selected = args.only.split(',')
+        unknown = [name for name in selected if name not in ALL_BENCHMARKS]
+        if unknown:
+            parser.error(f'Unknown benchmarks: {", ".join(unknown)}')
+
+    results = run_benchmarks(config, selected)
+
+    output = {
+        'metadata': {
+            'timestamp': datetime.datetime.now().isoformat(),
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'python': platform.python_version(),
+            'repo_root': REPO_ROOT,
+            'config': config,
+        },
+        'results': results,
+    }
+
+    with open(args.output, 'w') as outfile:
+        json.dump(output, outfile, indent=4)
+    print(f'Benchmark results saved to {args.output}')
+
+    if args.compare is not None:
+        with open(args.compare, 'r') as infile:
+            baseline = json.load(infile)['results']
+
+        comparison = compare_results(results, baseline, args.tolerance)
+        print()
+        print_comparison(comparison)
+
+        if any(row['regression'] for row in comparison):
+            sys.exit(1)
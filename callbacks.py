@@ -0,0 +1,354 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Training callbacks module
+
+This script defines custom Keras callbacks used by the test harness
+while training models.
+
+Author:  Christopher Good
+Version: 1.0.0
+
+Usage: callbacks.py
+
+"""
+# See following link for proper docstring documentation
+# https://pandas.pydata.org/docs/development/contributing_docstring.html
+
+### Futures ###
+#TODO
+
+### Built-in Imports ###
+import glob
+import json
+import os
+import time
+
+try:
+    import resource
+except ImportError:
+    # The resource module is only available on Unix platforms
+    resource = None
+
+### Other Library Imports ###
+import tensorflow as tf
+from tensorflow.keras.callbacks import Callback
+
+### Definitions ###
+
+def get_peak_rss_mb():
+    """
+    Returns the peak resident set size of the current process in
+    megabytes, or None if it cannot be determined on this platform.
+    """
+    if resource is None:
+        return None
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Linux reports ru_maxrss in kilobytes, macOS reports it in bytes
+    if peak_rss > 1 << 32:
+        return peak_rss / (1024 * 1024)
+    return peak_rss / 1024
+
+def get_peak_gpu_memory_mb(device):
+    """
+    Returns the peak memory allocated on a GPU device in megabytes, or
+    None if the device is not a GPU or the statistic is unavailable.
+
+    Parameters
+    ----------
+    device : str
+        Tensorflow device string (e.g. '/GPU:0')
+    """
+    if device is None or 'GPU' not in device:
+        return None
+    try:
+        memory_info = tf.config.experimental.get_memory_info(device.lstrip('/'))
+    except (AttributeError, ValueError):
+        return None
+    return memory_info['peak'] / (1024 * 1024)
+
+def load_resume_state(filepath, config_hash=None):
+    """
+    Loads the training state saved by a ResumeCheckpoint callback.
+
+    Parameters
+    ----------
+    filepath : str
+        Path prefix of the checkpoint
+    config_hash : str, optional
+        Hash of the current experiment configuration. If given, a state
+        saved for a different configuration is ignored.
+
+    Returns
+    -------
+    dict or None
+        The saved state ('epoch', 'best', 'config_hash' and, if saved,
+        'early_stopping'), or None if there is no usable checkpoint
+    """
+    state_path = filepath + '.json'
+    if not os.path.exists(state_path):
+        return None
+
+    with open(state_path, 'r') as sf:
+        try:
+            state = json.load(sf)
+        except json.JSONDecodeError:
+            return None
+
+    if config_hash is not None and state.get('config_hash') != config_hash:
+        return None
+    return state
+
+def remove_resume_checkpoint(filepath):
+    """Removes the files saved by a ResumeCheckpoint callback."""
+    for path in glob.glob(filepath + '.*'):
+        os.remove(path)
+
+### Classes ###
+
+class ThroughputMonitor(Callback):
+    """
+    Records per-epoch training throughput and input pipeline statistics.
+
+    Step time is measured from the start to the end of each training
+    batch. Data wait time is the time the training loop blocked waiting
+    for the next batch of a datasets.TimedBatchInput during the epoch;
+    when it approaches the step time, the model is being starved by the
+    input pipeline. Compute time is the step time not spent waiting for
+    data. Without a timed input (e.g. for a distributed input pipeline)
+    the wait is not measured and its statistics are None.
+
+    Fetch time is the time the dataset spent in `__getitem__` producing
+    the epoch's batches, summed over the worker threads, so it can
+    exceed the step time when batches are produced in parallel.
+
+    The resident memory (peak_rss_mb) is the peak of the whole process
+    so far, since the operating system does not reset it, so it only
+    grows from epoch to epoch. The GPU memory is the peak of the epoch.
+    """
+
+    def __init__(self, dataset, batch_size, device=None, timed_input=None):
+        """
+        Parameters
+        ----------
+        dataset : datasets.HyperspectralDataset
+            The training dataset whose batch fetch time is recorded
+        batch_size : int
+            Number of samples per training batch
+        device : str, optional
+            Tensorflow device string used for the GPU memory statistics
+        timed_input : datasets.TimedBatchInput, optional
+            The training input whose batch wait time is recorded
+        """
+        super().__init__()
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.device = device
+        self.timed_input = timed_input
+        self.epoch_stats = []
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._epoch_start = time.perf_counter()
+        self._step_time = 0.0
+        self._batches = 0
+        self.dataset.reset_fetch_stats()
+        if self.timed_input is not None:
+            self.timed_input.reset_wait_stats()
+
+        # Reset the GPU peak memory counter so the peak is per-epoch
+        if (self.device is not None and 'GPU' in self.device
+                and hasattr(tf.config.experimental, 'reset_memory_stats')):
+            tf.config.experimental.reset_memory_stats(self.device.lstrip('/'))
+
+    def on_train_batch_begin(self, batch, logs=None):
+        self._batch_start = time.perf_counter()
+
+    def on_train_batch_end(self, batch, logs=None):
+        self._step_time += time.perf_counter() - self._batch_start
+        self._batches += 1
+
+    def on_epoch_end(self, epoch, logs=None):
+        epoch_time = time.perf_counter() - self._epoch_start
+        samples = min(self._batches * self.batch_size, len(self.dataset.indices))
+
+        # The batch is fetched within the training step, so the wait is
+        # part of the step time
+        if self.timed_input is not None:
+            data_wait_time = self.timed_input.wait_time
+            compute_time = max(self._step_time - data_wait_time, 0.0)
+            data_wait_ratio = (data_wait_time / self._step_time
+                               if self._step_time > 0 else 0.0)
+        else:
+            data_wait_time = compute_time = data_wait_ratio = None
+
+        stats = {
+            'epoch': epoch + 1,
+            'epoch_time': epoch_time,
+            'samples': samples,
+            'samples_per_sec': samples / epoch_time if epoch_time > 0 else 0.0,
+            'step_time': self._step_time,
+            'mean_step_time': self._step_time / max(self._batches, 1),
+            'fetch_time': self.dataset.fetch_time,
+            'data_wait_time': data_wait_time,
+            'compute_time': compute_time,
+            'data_wait_ratio': data_wait_ratio,
+            # Peak of the process so far, not of the epoch
+            'peak_rss_mb': get_peak_rss_mb(),
+            'peak_gpu_mem_mb': get_peak_gpu_memory_mb(self.device),
+        }
+        self.epoch_stats.append(stats)
+
+    def summary(self):
+        """
+        Returns a summary of the recorded epochs suitable for adding to
+        the experiment results.
+        """
+        if not self.epoch_stats:
+            return {
+                'samples_per_sec': 0.0,
+                'data_wait_time': None,
+                'compute_time': None,
+                'data_wait_ratio': None,
+                'peak_rss_mb': None,
+                'peak_gpu_mem_mb': None,
+            }
+
+        def peak(key):
+            values = [s[key] for s in self.epoch_stats if s[key] is not None]
+            return max(values) if values else None
+
+        total_samples = sum(s['samples'] for s in self.epoch_stats)
+        total_time = sum(s['epoch_time'] for s in self.epoch_stats)
+        step_time = sum(s['step_time'] for s in self.epoch_stats)
+        if self.timed_input is not None:
+            data_wait_time = sum(s['data_wait_time'] for s in self.epoch_stats)
+            compute_time = sum(s['compute_time'] for s in self.epoch_stats)
+            data_wait_ratio = data_wait_time / step_time if step_time > 0 else 0.0
+        else:
+            data_wait_time = compute_time = data_wait_ratio = None
+
+        return {
+            'samples_per_sec': total_samples / total_time if total_time > 0 else 0.0,
+            'data_wait_time': data_wait_time,
+            'compute_time': compute_time,
+            'data_wait_ratio': data_wait_ratio,
+            'peak_rss_mb': peak('peak_rss_mb'),
+            'peak_gpu_mem_mb': peak('peak_gpu_mem_mb'),
+        }
+
+class TensorflowProfiler(Callback):
+    """
+    Runs the Tensorflow profiler over a window of training steps.
+
+    Steps are counted across epochs, so a window may span an epoch
+    boundary. The trace can be viewed with TensorBoard's profile plugin.
+    """
+
+    def __init__(self, logdir, start_step, stop_step):
+        """
+        Parameters
+        ----------
+        logdir : str
+            Directory where the profiler trace is written
+        start_step : int
+            Training step at which profiling starts
+        stop_step : int
+            Training step at which profiling stops
+        """
+        super().__init__()
+        self.logdir = logdir
+        self.start_step = start_step
+        self.stop_step = stop_step
+        self._step = 0
+        self._profiling = False
+
+    def on_train_batch_begin(self, batch, logs=None):
+        if self._step == self.start_step and not self._profiling:
+            tf.profiler.experimental.start(self.logdir)
+            self._profiling = True
+
+    def on_train_batch_end(self, batch, logs=None):
+        self._step += 1
+        if self._step >= self.stop_step and self._profiling:
+            self._stop()
+
+    def on_train_end(self, logs=None):
+        # Make sure the profiler is stopped if training ends early
+        if self._profiling:
+            self._stop()
+
+    def _stop(self):
+        tf.profiler.experimental.stop()
+        self._profiling = False
+        print(f'  >>> Tensorflow profile saved to {self.logdir}')
+
+class ResumeCheckpoint(Callback):
+    """
+    Saves the model and optimizer weights at the end of every epoch so
+    interrupted training can be resumed.
+
+    The weights are saved in the Tensorflow checkpoint format, which
+    includes the optimizer state, to `filepath`. The epoch and the best
+    monitored value so far are saved to `filepath + '.json'` after the
+    weights, so the state only points at complete checkpoints. The state
+    also holds the patience counter and best value of an EarlyStopping
+    callback, which are restored when training begins, since the
+    callback resets them then.
+    """
+
+    def __init__(self, filepath, monitor='val_loss', config_hash=None,
+                 best=None, early_stopping=None, early_stopping_state=None):
+        """
+        Parameters
+        ----------
+        filepath : str
+            Path prefix of the checkpoint
+        monitor : str, optional
+            Quantity tracked as the best value so far
+        config_hash : str, optional
+            Hash of the experiment configuration, saved with the state
+        best : float, optional
+            Best monitored value from before training was resumed
+        early_stopping : tf.keras.callbacks.EarlyStopping, optional
+            Early stopping callback whose state is saved and restored. It
+            must be before this callback in the callback list.
+        early_stopping_state : dict, optional
+            The early stopping state ('wait' and 'best') from before
+            training was resumed
+        """
+        super().__init__()
+        self.filepath = filepath
+        self.monitor = monitor
+        self.config_hash = config_hash
+        self.best = best
+        self.early_stopping = early_stopping
+        self.early_stopping_state = early_stopping_state
+
+    def on_train_begin(self, logs=None):
+        if self.early_stopping is not None and self.early_stopping_state is not None:
+            self.early_stopping.wait = self.early_stopping_state['wait']
+            self.early_stopping.best = self.early_stopping_state['best']
+
+    def on_epoch_end(self, epoch, logs=None):
+        value = (logs or {}).get(self.monitor)
+        if value is not None and (self.best is None or value < self.best):
+            self.best = float(value)
+
+        self.model.save_weights(self.filepath, save_format='tf')
+
+        state = {
+            'epoch': epoch,
+            'best': self.best,
+            'config_hash': self.config_hash,
+        }
+        if self.early_stopping is not None:
+            state['early_stopping'] = {
+                'wait': int(self.early_stopping.wait),
+                'best': float(self.early_stopping.best),
+            }
+        state_path = self.filepath + '.json'
+        with open(state_path + '.tmp', 'w') as sf:
+            json.dump(state, sf)
+        os.replace(state_path + '.tmp', state_path)
@@ -18,19 +18,27 @@ Usage: datasets.py
 #TODO
 
 ### Built-in Imports ###
+import hashlib
+import json
 import math
+import os
+import pickle
+import threading
+import time
 
 ### Other Library Imports ###
 import numpy as np
 from sklearn.model_selection import train_test_split
 import tensorflow as tf
 from tensorflow.keras.utils import (
+    OrderedEnqueuer,
     Sequence,
     to_categorical, 
 ) 
 
 ### Local Imports ###
-from grss_dfc_2018_uh import UH_2018_Dataset
+from augmentation import BatchAugmenter
+from sampling import ClassBalancedSampler
 
 ### Class Definitions ###
 # class HyperspectralDataset(Sequence):
@@ -90,7 +98,8 @@ from grss_dfc_2018_uh import UH_2018_Dataset
 #         return batch_data, batch_labels
 
 class HyperspectralDataset(Sequence):
-    def __init__(self, data, gt, shuffle=True, **hyperparams):
+    def __init__(self, data, gt, shuffle=True, augment=False, balance=False,
+                 **hyperparams):
         """
         Args:
             data: 3D hyperspectral image
@@ -100,6 +109,19 @@ class HyperspectralDataset(Sequence):
                           center pixel
             data_augmentation: bool, set to True to perform random flips
             supervision: 'full' or 'semi' supervised algorithms
+            data_layout: 'channels', 'spectral' or '2d' patch layout
+                         (see models.DATA_LAYOUTS)
+            input_dtype: dtype of the batches ('float32', or 'float16' or
+                         'bfloat16' for mixed precision models)
+            pad_batches: bool, set to True to pad the last batch to the full
+                         batch size and return sample weights that mask the
+                         padding, so every batch has the same shape (e.g.
+                         for XLA compiled models)
+            augment: bool, set to True to augment the batches as set by the
+                     flip_augmentation, radiation_augmentation and
+                     mixture_augmentation hyperparameters
+            balance: bool, set to True to draw class-balanced batches as set
+                     by the class_balancing hyperparameter
         """
         # super(HyperspectralDataset, self).__init__()
         self.data = data
@@ -111,6 +133,9 @@ class HyperspectralDataset(Sequence):
         self.ignored_labels = set(hyperparams["ignored_labels"])
         self.num_classes = hyperparams['n_classes']
         self.loss = hyperparams['loss']
+        self.data_layout = hyperparams.get('data_layout', 'channels')
+        self.input_dtype = hyperparams.get('input_dtype', 'float32')
+        self.pad_batches = hyperparams.get('pad_batches', False)
         
         if self.supervision == "full":
             mask = np.ones_like(gt)
@@ -121,18 +146,31 @@ class HyperspectralDataset(Sequence):
             mask = np.ones_like(gt)
         x_pos, y_pos = np.nonzero(mask)
         num_neighbors = self.patch_size // 2
-        self.indices = np.array(
-            [
-                (x, y)
-                for x, y in zip(x_pos, y_pos)
-                if x > num_neighbors 
-                    and x < data.shape[0] - num_neighbors 
-                    and y > num_neighbors 
-                    and y < data.shape[1] - num_neighbors
-            ]
-        )
-
-        self.labels = np.array([gt[x, y] for x, y in self.indices])
+        # Keep the pixels whose patches are inside the image, without a
+        # Python loop over them, since semi-supervised and pseudo-labelled
+        # datasets can have millions of pixels
+        inside = ((x_pos > num_neighbors)
+                  & (x_pos < data.shape[0] - num_neighbors)
+                  & (y_pos > num_neighbors)
+                  & (y_pos < data.shape[1] - num_neighbors))
+        self.indices = np.stack([x_pos[inside], y_pos[inside]], axis=1)
+
+        self.labels = gt[self.indices[:, 0], self.indices[:, 1]]
+
+        # Set up the batch augmentations
+        self.augmenter = None
+        if augment:
+            self.configure_augmentation(**hyperparams)
+
+        # Set up the class-balanced batch sampler
+        self.sampler = None
+        if balance:
+            self.configure_sampling(**hyperparams)
+
+        # Initialize batch fetch timing statistics, which are updated
+        # by every worker thread fetching batches
+        self._fetch_lock = threading.Lock()
+        self.reset_fetch_stats()
 
         # Run epoch end function to initialize dataset
         self.on_epoch_end()
@@ -140,26 +178,84 @@ class HyperspectralDataset(Sequence):
     def on_epoch_end(self):
         if self.shuffle:
             np.random.shuffle(self.indices)
+        if self.sampler is not None:
+            self.sampler.on_epoch_end()
+
+    def configure_augmentation(self, **hyperparams):
+        """
+        Sets up the batch augmentations enabled by the flip_augmentation,
+        radiation_augmentation and mixture_augmentation hyperparameters.
+        """
+        augmenter = BatchAugmenter(
+            self.data, self.gt, self.ignored_labels,
+            flip=hyperparams.get('flip_augmentation', False) and self.patch_size > 1,
+            radiation=hyperparams.get('radiation_augmentation', False),
+            mixture=hyperparams.get('mixture_augmentation', False))
+        self.augmenter = augmenter if augmenter.enabled else None
+
+    def configure_sampling(self, **hyperparams):
+        """
+        Sets up the class-balanced batch sampler for the class_balancing
+        hyperparameter, a mode of sampling.CLASS_BALANCING_MODES (True
+        selects 'inverse_median'), or None for the natural distribution.
+        """
+        mode = hyperparams.get('class_balancing')
+        if mode is True:
+            mode = 'inverse_median'
+        if not isinstance(mode, str) or len(self.indices) == 0:
+            self.sampler = None
+            return
+        labels = self.gt[self.indices[:, 0], self.indices[:, 1]]
+        self.sampler = ClassBalancedSampler(self.indices, labels, mode)
+
+    def reset_fetch_stats(self):
+        """
+        Resets the accumulated batch fetch time and count. The fetch time
+        is summed over the worker threads, so it can exceed the wall time
+        of an epoch.
+        """
+        with self._fetch_lock:
+            self.fetch_time = 0.0
+            self.fetch_count = 0
 
     def __len__(self):
         return math.ceil(len(self.indices) / self.batch_size)
 
+    def get_batch_indices(self, i):
+        """
+        Returns the (row, column) indices of the items of a batch, drawn
+        by the sampler when balancing the classes. A batch's indices are
+        the same however often they are requested in an epoch.
+        """
+        if self.sampler is not None:
+            return self.sampler.draw_batch(i, self.batch_size)
+        return self.indices[i*self.batch_size:(i+1)*self.batch_size]
+
     def __getitem__(self, i):
+        fetch_start = time.perf_counter()
+
         batch_data = []
         batch_labels = []
+        batch_label_patches = []
 
-        # Get all items in batch
-        for item in range(i*self.batch_size,(i+1)*self.batch_size):
+        # Get the indices of the batch's items
+        batch_indices = self.get_batch_indices(i)
 
-            # Make sure not to look for item id greater than number of
-            # indices
-            if item >= len(self.indices): break
+        # Get all items in batch
+        for index in batch_indices:
 
             # Get index tuple from indices
-            index = tuple(self.indices[item])
-
-            # Get data patch for the index
-            data = self.__get_data_patch(self.data, index, self.patch_size)
+            index = tuple(index)
+
+            # Get data patch for the index. Augmented patches are laid out
+            # after the batch is augmented.
+            if self.augmenter is not None:
+                data = self.__get_raw_patch(self.data, index, self.patch_size)
+                batch_label_patches.append(
+                    self.__get_raw_patch(self.gt, index, self.patch_size))
+            else:
+                data = self.__get_data_patch(self.data, index, self.patch_size,
+                                             self.data_layout)
 
             # Get label for the patch
             label = self.gt[index]
@@ -173,20 +269,55 @@ class HyperspectralDataset(Sequence):
             batch_data.append(data)
             batch_labels.append(label)
 
+        # Pad a partial batch with copies of its last sample, weighted
+        # zero so they do not count towards the loss and metrics
+        if self.pad_batches:
+            batch_weights = [1.0] * len(batch_data)
+            num_padding = self.batch_size - len(batch_data)
+            batch_data.extend([batch_data[-1]] * num_padding)
+            batch_labels.extend([batch_labels[-1]] * num_padding)
+            batch_weights.extend([0.0] * num_padding)
+            if batch_label_patches:
+                batch_label_patches.extend([batch_label_patches[-1]] * num_padding)
+
+        # Augment the whole batch at once
+        if self.augmenter is not None:
+            batch_data = self.augmenter(
+                tf.convert_to_tensor(np.stack(batch_data), dtype=tf.float32),
+                tf.convert_to_tensor(np.stack(batch_label_patches)))
+            batch_data = layout_patch_batch(batch_data, self.patch_size,
+                                            self.data_layout)
+
         batch_data = tf.convert_to_tensor(batch_data)
         batch_labels = tf.convert_to_tensor(batch_labels)
 
+        # Feed half precision batches to mixed precision models
+        if self.input_dtype != 'float32':
+            batch_data = tf.cast(batch_data, self.input_dtype)
+
+        # Record time spent producing the batch
+        fetch_time = time.perf_counter() - fetch_start
+        with self._fetch_lock:
+            self.fetch_time += fetch_time
+            self.fetch_count += 1
+
+        if self.pad_batches:
+            return batch_data, batch_labels, tf.constant(batch_weights)
         return batch_data, batch_labels
 
     @staticmethod
-    def __get_data_patch(data, index, patch_size):
+    def __get_raw_patch(array, index, patch_size):
         x, y = index
         x1 = x - patch_size // 2    # Leftmost edge of patch
         y1 = y - patch_size // 2    # Topmost edge of patch
         x2 = x1 + patch_size        # Rightmost edge of patch
         y2 = y1 + patch_size        # Bottommost edge of patch
 
-        patch = data[x1:x2, y1:y2]
+        return array[x1:x2, y1:y2]
+
+    @staticmethod
+    def __get_data_patch(data, index, patch_size, data_layout='channels'):
+        patch = HyperspectralDataset.__get_raw_patch(data, index, patch_size)
 
         # Copy the data into numpy arrays
         # patch = np.asarray(np.copy(patch), dtype="float32")
@@ -196,16 +327,199 @@ class HyperspectralDataset(Sequence):
             patch = patch[:, 0, 0]
 
         # Add a fourth dimension for 3D CNN
-        if patch_size > 1:
+        if patch_size > 1 and data_layout == 'channels':
             # Make 4D data ((Batch x) Planes x Channels x Width x Height)
             # patch = np.expand_dims(patch, 0)
             patch = tf.expand_dims(patch, 0)
+        elif patch_size > 1 and data_layout == 'spectral':
+            # Make 4D data ((Batch x) Width x Height x Bands x Planes) so
+            # 3D convolutions run along the spectral bands
+            patch = tf.expand_dims(patch, -1)
         
         return patch
 
+class DistillationDataset(HyperspectralDataset):
+    """
+    Hyperspectral dataset whose batches also carry the teacher model's
+    logits for each patch, for knowledge distillation.
+
+    The targets of each batch are a (labels, teacher_logits) tuple. The
+    logits are looked up by the pixel indices of each batch's patches,
+    so they match the patches however the batch was drawn (shuffled or
+    class-balanced). Augmented patches keep the teacher's logits of the
+    original patch.
+    """
+
+    def __init__(self, data, gt, teacher_indices, teacher_logits,
+                 shuffle=True, augment=False, balance=False, **hyperparams):
+        """
+        Args:
+            data: 3D hyperspectral image
+            gt: 2D array of labels
+            teacher_indices: (N, 2) array of the (row, column) of each
+                             patch with precomputed teacher logits
+            teacher_logits: (N, n_classes) array of the teacher's logits
+                            for each patch in teacher_indices
+            augment: bool, see HyperspectralDataset
+            balance: bool, see HyperspectralDataset
+            **hyperparams: see HyperspectralDataset
+        """
+        super().__init__(data, gt, shuffle=shuffle, augment=augment,
+                         balance=balance, **hyperparams)
+
+        # Map the flattened pixel index of every patch with logits to its
+        # row of logits, sorted by key for lookups
+        order = np.argsort(self.__get_keys(teacher_indices))
+        self.teacher_keys = self.__get_keys(teacher_indices)[order]
+        self.teacher_logits = np.asarray(teacher_logits, dtype=np.float32)[order]
+
+        if len(self.indices) and (len(self.teacher_keys) == 0
+                                  or np.any(self.__find_rows(self.indices) < 0)):
+            raise ValueError('Teacher logits are missing for some patches of the dataset')
+
+    def __get_keys(self, indices):
+        return indices[:, 0].astype(np.int64) * self.gt.shape[1] + indices[:, 1]
+
+    def __find_rows(self, indices):
+        """Returns the logits row of each index, or -1 if it has none."""
+        keys = self.__get_keys(indices)
+        rows = np.minimum(np.searchsorted(self.teacher_keys, keys),
+                          len(self.teacher_keys) - 1)
+        return np.where(self.teacher_keys[rows] == keys, rows, -1)
+
+    def __getitem__(self, i):
+        batch = super().__getitem__(i)
+        batch_data, batch_labels = batch[:2]
+
+        batch_logits = self.teacher_logits[self.__find_rows(self.get_batch_indices(i))]
+        if self.pad_batches and len(batch_logits) < self.batch_size:
+            num_padding = self.batch_size - len(batch_logits)
+            batch_logits = np.concatenate(
+                [batch_logits, np.repeat(batch_logits[-1:], num_padding, axis=0)])
+        batch_logits = tf.convert_to_tensor(batch_logits)
+
+        return (batch_data, (batch_labels, batch_logits)) + tuple(batch[2:])
+
+
+class TimedBatchInput:
+    """
+    Feeds a dataset's batches to Keras as a tf.data pipeline and records
+    the time the training loop blocks waiting for them.
+
+    The batches are produced ahead by the worker threads of a Keras
+    OrderedEnqueuer, which reshuffles the dataset between epochs like
+    Keras does with a Sequence. The pipeline has no prefetch buffer, so
+    each training step's request for a batch waits on the enqueuer for
+    as long as the workers are behind, and that wait is what is timed.
+    """
+
+    def __init__(self, sequence, workers=1, max_queue_size=10):
+        """
+        Parameters
+        ----------
+        sequence : HyperspectralDataset
+            The dataset
+        workers : int, optional
+            Number of threads producing batches
+        max_queue_size : int, optional
+            Maximum number of batches produced ahead
+        """
+        self.sequence = sequence
+        self.workers = max(workers, 1)
+        self.max_queue_size = max_queue_size
+        self.enqueuer = OrderedEnqueuer(sequence, use_multiprocessing=False,
+                                        shuffle=False)
+        self._output = None
+        self.reset_wait_stats()
+
+        self.dataset = tf.data.Dataset.from_generator(
+            self._generator, output_signature=get_batch_spec(sequence))
+        self.dataset = self.dataset.apply(
+            tf.data.experimental.assert_cardinality(len(sequence)))
+
+    def reset_wait_stats(self):
+        """Resets the accumulated batch wait time and count."""
+        self.wait_time = 0.0
+        self.wait_count = 0
+
+    def stop(self):
+        """Stops the enqueuer's worker threads."""
+        if self.enqueuer.is_running():
+            self.enqueuer.stop()
+        self._output = None
+
+    def _generator(self):
+        # Start producing batches when the first epoch is iterated, and
+        # keep producing them across epochs
+        if self._output is None:
+            self.enqueuer.start(workers=self.workers,
+                                max_queue_size=self.max_queue_size)
+            self._output = self.enqueuer.get()
+
+        for _ in range(len(self.sequence)):
+            wait_start = time.perf_counter()
+            batch = next(self._output)
+            self.wait_time += time.perf_counter() - wait_start
+            self.wait_count += 1
+            yield batch
+
 
 ### Function Definitions ###
 
+def get_batch_spec(sequence):
+    """
+    Returns the tf.TensorSpec structure of a dataset's (possibly nested)
+    batches, with an unknown batch dimension.
+    """
+    return tf.nest.map_structure(
+        lambda tensor: tf.TensorSpec((None,) + tuple(tensor.shape[1:]),
+                                     dtype=tf.as_dtype(tensor.dtype)),
+        sequence[0])
+
+def layout_patch_batch(batch, patch_size, data_layout='channels'):
+    """
+    Lays out a batch of raw (batch, rows, cols, bands) patches like
+    HyperspectralDataset lays out its patches for a data layout.
+    """
+    if patch_size == 1:
+        return batch[:, 0, 0]
+    if data_layout == 'channels':
+        return tf.expand_dims(batch, 1)
+    if data_layout == 'spectral':
+        return tf.expand_dims(batch, -1)
+    return batch
+
+def extract_patch_batch(data, indices, patch_size):
+    """
+    Extracts the raw patches centered on a batch of pixels.
+
+    The patches are gathered from a strided view of the image's patch
+    windows, so only the batch's patches are copied.
+
+    Parameters
+    ----------
+    data : np.ndarray
+        (rows, cols, bands) image, padded so every patch is inside it
+    indices : np.ndarray
+        (batch, 2) array of the (row, column) of each patch's center
+    patch_size : int
+        Size of the patches
+
+    Returns
+    -------
+    np.ndarray
+        (batch, patch_size, patch_size, bands) patches
+    """
+    rows, cols, bands = data.shape
+    windows = np.lib.stride_tricks.as_strided(
+        data,
+        shape=(rows - patch_size + 1, cols - patch_size + 1,
+               patch_size, patch_size, bands),
+        strides=data.strides[:2] + data.strides,
+        writeable=False)
+    half = patch_size // 2
+    return windows[indices[:, 0] - half, indices[:, 1] - half]
+
 def hs_dataset_generator(data, gt, shuffle=True, **hyperparams):
 
     patch_size = hyperparams['patch_size']
@@ -399,7 +713,9 @@ def sample_gt(gt, train_size, mode='random'):
 
 def load_grss_dfc_2018_uh_dataset(**hyperparams):
     #TODO
-    
+    # Imported here so the other datasets can be loaded without the
+    # GRSS DFC 2018 dataset dependencies (e.g. rasterio)
+    from grss_dfc_2018_uh import UH_2018_Dataset
 
     dataset = UH_2018_Dataset()
     train_gt = dataset.load_full_gt_image(train_only=True)
@@ -584,8 +900,17 @@ def create_datasets(data, train_gt, test_gt, **hyperparams):
     # Set pad length per dimension
     pad = patch_size // 2
 
-    # Pad only first two dimensions
-    data = np.pad(data, [(pad,), (pad,), (0,)], mode='constant')
+    # Pad only first two dimensions. If the data was already padded
+    # (e.g. a dataset shared between processes), take a view of it with
+    # the right amount of padding instead of copying it, or only add the
+    # missing padding.
+    data_padding = hyperparams.get('data_padding', 0)
+    if data_padding >= pad:
+        offset = data_padding - pad
+        data = data[offset:data.shape[0] - offset, offset:data.shape[1] - offset]
+    else:
+        missing = pad - data_padding
+        data = np.pad(data, [(missing,), (missing,), (0,)], mode='constant')
     train_gt = np.pad(train_gt, [(pad,), (pad,)], mode='constant')
     test_gt = np.pad(test_gt, [(pad,), (pad,)], mode='constant')
 
@@ -597,13 +922,100 @@ def create_datasets(data, train_gt, test_gt, **hyperparams):
     # Create validation dataset from training set
     train_gt, val_gt = sample_gt(train_gt, train_split, mode=split_mode)
 
-    train_dataset = HyperspectralDataset(data, train_gt, **hyperparams)
+    train_dataset = HyperspectralDataset(data, train_gt, augment=True, balance=True,
+                                         **hyperparams)
     val_dataset = HyperspectralDataset(data, val_gt, **hyperparams)
     test_dataset = HyperspectralDataset(data, test_gt, shuffle=False, **hyperparams)
     true_test = np.array(test_dataset.labels)
 
     return train_dataset, val_dataset, test_dataset, true_test
 
+def get_shared_dataset_key(dataset_choice, **hyperparams):
+    """
+    Returns a key identifying a loaded and preprocessed dataset, used to
+    share it between experiments run in different processes.
+    """
+    key_params = {
+        'dataset': dataset_choice,
+        'use_hs_data': hyperparams['use_hs_data'],
+        'use_lidar_ms_data': hyperparams['use_lidar_ms_data'],
+        'use_lidar_ndsm_data': hyperparams['use_lidar_ndsm_data'],
+        'use_vhr_data': hyperparams['use_vhr_data'],
+        'use_all_data': hyperparams['use_all_data'],
+        'skip_data_preprocessing': hyperparams['skip_data_preprocessing'],
+        'skip_band_selection': hyperparams['skip_band_selection'],
+    }
+    key_hash = hashlib.sha1(
+        json.dumps(key_params, sort_keys=True).encode()).hexdigest()[:12]
+    return f'{dataset_choice}_{key_hash}'
+
+def save_shared_dataset(directory, key, data, train_gt, test_gt,
+                        dataset_info, data_padding=0):
+    """
+    Saves a dataset so it can be memory-mapped by other processes.
+
+    The data is saved already padded by `data_padding` pixels on each
+    spatial edge, so that create_datasets can take views of it for any
+    patch size up to 2 * data_padding + 1 without copying it.
+
+    Parameters
+    ----------
+    directory : str
+        Directory where shared datasets are stored
+    key : str
+        The shared dataset key from get_shared_dataset_key
+    data : np.ndarray
+        The dataset image data
+    train_gt : np.ndarray
+        The training ground truth image
+    test_gt : np.ndarray
+        The testing ground truth image
+    dataset_info : dict
+        Information about the dataset's name and classes
+    data_padding : int, optional
+        Number of pixels to pad each spatial edge of the data with
+    """
+    dataset_dir = os.path.join(directory, key)
+    os.makedirs(dataset_dir, exist_ok=True)
+
+    data = np.pad(data, [(data_padding,), (data_padding,), (0,)], mode='constant')
+    np.save(os.path.join(dataset_dir, 'data.npy'), data)
+    np.save(os.path.join(dataset_dir, 'train_gt.npy'), train_gt)
+    np.save(os.path.join(dataset_dir, 'test_gt.npy'), test_gt)
+
+    dataset_info = dict(dataset_info, data_padding=data_padding)
+    with open(os.path.join(dataset_dir, 'dataset_info.pkl'), 'wb') as outfile:
+        pickle.dump(dataset_info, outfile)
+
+def load_shared_dataset(directory, dataset_choice, **hyperparams):
+    """
+    Loads a dataset saved by save_shared_dataset, memory-mapping the
+    image data read-only so it is shared between processes.
+
+    Returns
+    -------
+    data : np.memmap
+        The padded dataset image data
+    train_gt : np.ndarray
+        The training ground truth image
+    test_gt : np.ndarray
+        The testing ground truth image
+    dataset_info : dict
+        Information about the dataset's name and classes, including the
+        'data_padding' of the image data
+    """
+    key = get_shared_dataset_key(dataset_choice, **hyperparams)
+    dataset_dir = os.path.join(directory, key)
+
+    print(f'Loading shared dataset {key}...')
+    data = np.load(os.path.join(dataset_dir, 'data.npy'), mmap_mode='r')
+    train_gt = np.load(os.path.join(dataset_dir, 'train_gt.npy'))
+    test_gt = np.load(os.path.join(dataset_dir, 'test_gt.npy'))
+    with open(os.path.join(dataset_dir, 'dataset_info.pkl'), 'rb') as infile:
+        dataset_info = pickle.load(infile)
+
+    return data, train_gt, test_gt, dataset_info
+
 def preprocess_data(data, **hyperparams):
     
     #TODO
@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Knowledge distillation module
+
+This script defines the knowledge distillation training mode of the
+test harness, which trains a compact student model on the soft targets
+of a trained teacher model (e.g. the 3D-DenseNet). The teacher's logits
+are computed once and cached on disk with the patch indices, so the
+student's epochs do not run the teacher.
+
+Author:  Christopher Good
+Version: 1.0.0
+
+Usage: distillation.py
+
+"""
+# See following link for proper docstring documentation
+# https://pandas.pydata.org/docs/development/contributing_docstring.html
+
+### Futures ###
+#TODO
+
+### Built-in Imports ###
+import hashlib
+import os
+import tempfile
+
+### Other Library Imports ###
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.models import Model
+
+### Local Imports ###
+from models import (
+    DATA_LAYOUTS,
+    EfficientDenseLayer,
+    get_input_shape,
+)
+
+### Constants ###
+
+# Smallest probability used when converting probabilities to logits
+_EPSILON = 1e-7
+
+### Definitions ###
+
+def load_teacher(path):
+    """
+    Loads a saved teacher model (e.g. a best weights checkpoint of the
+    test harness).
+
+    Checkpoints of models trained by distillation or with gradient
+    accumulation are saved under the Distiller or
+    GradientAccumulationModel class, which only change the training
+    step of the functional model they wrap, so they are loaded as the
+    plain functional model.
+
+    Parameters
+    ----------
+    path : str
+        Path of the saved model
+
+    Returns
+    -------
+    tf.keras.Model
+        The teacher model
+    """
+    return tf.keras.models.load_model(
+        path, compile=False,
+        custom_objects={
+            'EfficientDenseLayer': EfficientDenseLayer,
+            'Distiller': Model,
+            'GradientAccumulationModel': Model,
+        })
+
+def get_model_data_layout(model, patch_size, num_bands):
+    """
+    Returns the data layout of a model's input for a patch size and
+    number of bands.
+
+    Raises
+    ------
+    ValueError
+        If the model's input does not fit any layout of such patches
+    """
+    input_shape = tuple(model.input_shape[1:])
+    for data_layout in DATA_LAYOUTS:
+        if get_input_shape(patch_size, patch_size, num_bands, data_layout) == input_shape:
+            return data_layout
+    raise ValueError(f'Model input shape {input_shape} does not fit patches of size '
+                     f'{patch_size} with {num_bands} bands')
+
+def probabilities_to_logits(probabilities):
+    """
+    Returns logits of class probabilities.
+
+    The logits are the log probabilities, which differ from the original
+    logits of a softmax by a constant per sample, so they give the same
+    softened distribution at any temperature.
+    """
+    return tf.math.log(tf.clip_by_value(probabilities, _EPSILON, 1.0))
+
+def compute_teacher_logits(teacher, dataset):
+    """
+    Runs a teacher model over every patch of a dataset.
+
+    Parameters
+    ----------
+    teacher : tf.keras.Model
+        The teacher model, with a softmax output
+    dataset : HyperspectralDataset
+        The dataset. Its patches are fed in the teacher's data layout.
+
+    Returns
+    -------
+    indices : np.ndarray
+        (N, 2) array of the (row, column) of each patch
+    logits : np.ndarray
+        (N, n_classes) array of the teacher's logits for each patch
+    """
+    num_bands = dataset.data.shape[-1]
+    teacher_layout = get_model_data_layout(teacher, dataset.patch_size, num_bands)
+    teacher_dtype = teacher.inputs[0].dtype
+
+    @tf.function
+    def teacher_step(x):
+        return probabilities_to_logits(teacher(tf.cast(x, teacher_dtype), training=False))
+
+    # Iterate the unaugmented, unbalanced batches in the dataset's
+    # current order, so the logits line up with its indices
+    data_layout, augmenter, sampler = dataset.data_layout, dataset.augmenter, dataset.sampler
+    dataset.data_layout, dataset.augmenter, dataset.sampler = teacher_layout, None, None
+    try:
+        logits = [teacher_step(dataset[i][0]).numpy() for i in range(len(dataset))]
+    finally:
+        dataset.data_layout, dataset.augmenter, dataset.sampler = data_layout, augmenter, sampler
+
+    # Drop the logits of any padding in the last batch
+    indices = np.array(dataset.indices)
+    logits = np.concatenate(logits)[:len(indices)]
+    return indices, logits
+
+def get_teacher_logits_cache_path(teacher_path, cache_dir, **hyperparams):
+    """
+    Returns the path of the teacher logits cache for a teacher checkpoint
+    and the dataset options the patches depend on.
+    """
+    key = '|'.join(str(value) for value in (
+        os.path.abspath(teacher_path),
+        os.path.getmtime(teacher_path),
+        hyperparams['dataset'],
+        hyperparams['patch_size'],
+        hyperparams['skip_data_preprocessing'],
+        hyperparams['skip_band_selection'],
+    ))
+    key_hash = hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]
+    return os.path.join(cache_dir, f'teacher_logits_{key_hash}.npz')
+
+def get_teacher_logits(teacher_path, dataset, cache_path):
+    """
+    Returns the teacher's logits for every patch of a dataset, loading
+    them from the cache if it covers the dataset and otherwise computing
+    and caching them.
+
+    Parameters
+    ----------
+    teacher_path : str
+        Path of the saved teacher model
+    dataset : HyperspectralDataset
+        The dataset the student is trained on
+    cache_path : str
+        Path of the .npz teacher logits cache
+
+    Returns
+    -------
+    indices : np.ndarray
+        (N, 2) array of the (row, column) of each cached patch
+    logits : np.ndarray
+        (N, n_classes) array of the teacher's logits for each patch
+    """
+    if os.path.exists(cache_path):
+        with np.load(cache_path) as cache:
+            indices, logits = cache['indices'], cache['logits']
+
+        # The cache may be for another split of the dataset
+        width = dataset.gt.shape[1]
+        cached_keys = indices[:, 0] * width + indices[:, 1]
+        keys = dataset.indices[:, 0] * width + dataset.indices[:, 1]
+        if np.isin(keys, cached_keys).all():
+            print(f'< Loaded cached teacher logits from {cache_path} >')
+            return indices, logits
+
+    print(f'< Computing teacher logits with {teacher_path} >')
+    teacher = load_teacher(teacher_path)
+    indices, logits = compute_teacher_logits(teacher, dataset)
+    del teacher
+
+    # Write the cache atomically, since experiments run in parallel may
+    # share it
+    directory = os.path.dirname(os.path.abspath(cache_path))
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(suffix='.npz.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as cache_file:
+            np.savez(cache_file, indices=indices, logits=logits)
+        os.replace(temp_path, cache_path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    print(f'< Cached teacher logits to {cache_path} >')
+
+    return indices, logits
+
+### Classes ###
+
+class Distiller(Model):
+    """
+    A student model trained on both the true labels and the softened
+    predictions of a teacher (Hinton et al., "Distilling the Knowledge
+    in a Neural Network").
+
+    The Distiller is a functional model sharing the student's layers, so
+    it is compiled, checkpointed and evaluated like the student. Only
+    its training step differs: the training targets are (labels,
+    teacher_logits) tuples, as produced by DistillationDataset, and the
+    loss is
+
+        (1 - alpha) * student_loss + alpha * T^2 * KL(teacher_T || student_T)
+
+    where student_loss is the compiled loss on the true labels and X_T
+    is the softmax of X's logits at temperature T. Validation and
+    testing use the compiled loss on the labels only.
+    """
+
+    def __init__(self, student, temperature=4.0, alpha=0.5):
+        """
+        Parameters
+        ----------
+        student : tf.keras.Model
+            The functional student model, with a softmax output
+        temperature : float, optional
+            Softmax temperature of the soft targets
+        alpha : float, optional
+            Weight of the distillation loss, between 0 and 1
+        """
+        super().__init__(inputs=student.inputs, outputs=student.outputs,
+                         name=student.name)
+        self.temperature = temperature
+        self.alpha = alpha
+        self.distillation_loss_tracker = tf.keras.metrics.Mean(name='distillation_loss')
+
+    @property
+    def metrics(self):
+        return super().metrics + [self.distillation_loss_tracker]
+
+    def distillation_loss(self, teacher_logits, y_pred, sample_weight=None):
+        """Returns the temperature-scaled KL divergence of the soft targets."""
+        student_logits = probabilities_to_logits(tf.cast(y_pred, tf.float32))
+        teacher_log_probs = tf.nn.log_softmax(teacher_logits / self.temperature)
+        student_log_probs = tf.nn.log_softmax(student_logits / self.temperature)
+
+        kl_divergence = tf.reduce_sum(
+            tf.exp(teacher_log_probs) * (teacher_log_probs - student_log_probs),
+            axis=-1)
+        if sample_weight is None:
+            loss = tf.reduce_mean(kl_divergence)
+        else:
+            sample_weight = tf.cast(tf.reshape(sample_weight, [-1]), tf.float32)
+            loss = (tf.reduce_sum(kl_divergence * sample_weight)
+                    / tf.maximum(tf.reduce_sum(sample_weight), 1.0))
+        return loss * self.temperature ** 2
+
+    def train_step(self, data):
+        x, y, sample_weight = tf.keras.utils.unpack_x_y_sample_weight(data)
+        labels, teacher_logits = y
+
+        with tf.GradientTape() as tape:
+            y_pred = self(x, training=True)
+            student_loss = self.compiled_loss(labels, y_pred, sample_weight,
+                                              regularization_losses=self.losses)
+            distillation_loss = self.distillation_loss(teacher_logits, y_pred,
+                                                       sample_weight)
+            loss = (1.0 - self.alpha) * student_loss + self.alpha * distillation_loss
+
+        # minimize applies loss scaling for mixed precision optimizers
+        self.optimizer.minimize(loss, self.trainable_variables, tape=tape)
+
+        self.compiled_metrics.update_state(labels, y_pred, sample_weight)
+        self.distillation_loss_tracker.update_state(distillation_loss)
+        return {metric.name: metric.result() for metric in self.metrics}
+
+    def test_step(self, data):
+        # Evaluation only uses the true labels
+        logs = super().test_step(data)
+        logs.pop(self.distillation_loss_tracker.name, None)
+        return logs
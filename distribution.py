@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Distributed training module
+
+This script defines the distribution strategies the test harness can
+train an experiment's model with, so a single experiment scales across
+every local GPU (or logical CPU device) of a node with a
+MirroredStrategy, or across the nodes of a cluster with a
+MultiWorkerMirroredStrategy, and the input pipeline that batches the
+harness datasets for them.
+
+Author:  Christopher Good
+Version: 1.0.0
+
+Usage: distribution.py
+
+"""
+# See following link for proper docstring documentation
+# https://pandas.pydata.org/docs/development/contributing_docstring.html
+
+### Futures ###
+#TODO
+
+### Built-in Imports ###
+import json
+import os
+
+### Other Library Imports ###
+import tensorflow as tf
+
+### Local Imports ###
+from datasets import get_batch_spec
+
+### Constants ###
+
+DISTRIBUTION_STRATEGIES = ('mirrored', 'multi_worker')
+
+### Definitions ###
+
+def configure_logical_cpus(count):
+    """
+    Splits the CPU into logical devices, so a MirroredStrategy can be
+    run and tested with several replicas on a machine without GPUs.
+
+    This must be called before Tensorflow initializes its devices.
+
+    Parameters
+    ----------
+    count : int
+        Number of logical CPU devices
+
+    Returns
+    -------
+    list of str
+        The names of the logical CPU devices
+    """
+    cpu = tf.config.list_physical_devices('CPU')[0]
+    tf.config.set_logical_device_configuration(
+        cpu, [tf.config.LogicalDeviceConfiguration() for _ in range(count)])
+    return [device.name for device in tf.config.list_logical_devices('CPU')]
+
+def get_distribution_strategy(strategy, logical_cpus=0):
+    """
+    Creates a distribution strategy.
+
+    The strategy must be created before any other Tensorflow operations
+    are run, so it should be created once at program startup and shared
+    by every experiment.
+
+    Parameters
+    ----------
+    strategy : str
+        'mirrored' to train on every local GPU (or the logical CPU
+        devices, if there are no GPUs), or 'multi_worker' to train on
+        the cluster given by the TF_CONFIG environment variable
+    logical_cpus : int, optional
+        Number of logical CPU devices to split the CPU into when there
+        are no GPUs (0 trains on the single CPU device)
+
+    Returns
+    -------
+    tf.distribute.Strategy
+        The distribution strategy
+
+    Raises
+    ------
+    ValueError
+        If the strategy is unknown, or 'multi_worker' is requested without
+        a TF_CONFIG cluster
+    """
+    if strategy not in DISTRIBUTION_STRATEGIES:
+        raise ValueError(f'Unknown distribution strategy: {strategy}')
+
+    gpus = tf.config.list_physical_devices('GPU')
+    if logical_cpus > 0 and not gpus:
+        cpu_devices = configure_logical_cpus(logical_cpus)
+    else:
+        cpu_devices = None
+
+    if strategy == 'mirrored':
+        if cpu_devices is not None:
+            # NCCL all-reduce is only available for GPUs
+            return tf.distribute.MirroredStrategy(
+                devices=cpu_devices,
+                cross_device_ops=tf.distribute.ReductionToOneDevice())
+        return tf.distribute.MirroredStrategy()
+
+    if 'TF_CONFIG' not in os.environ:
+        raise ValueError('The multi_worker strategy needs the cluster and task '
+                         'of this worker in the TF_CONFIG environment variable')
+    return tf.distribute.MultiWorkerMirroredStrategy()
+
+def get_worker_output_path(output_path):
+    """
+    Returns the output path of this worker of a multi-worker cluster.
+
+    The chief (or worker 0, if the cluster has no chief) writes to the
+    output path, and every other worker writes to a subdirectory of it,
+    so the workers' results files do not overwrite each other.
+    """
+    if 'TF_CONFIG' not in os.environ:
+        return output_path
+    task = json.loads(os.environ['TF_CONFIG']).get('task', {})
+    task_type = task.get('type', 'worker')
+    task_index = task.get('index', 0)
+    if task_type == 'chief' or (task_type == 'worker' and task_index == 0):
+        return output_path
+    return os.path.join(output_path, f'{task_type}_{task_index}')
+
+def make_distributed_dataset(sequence, strategy):
+    """
+    Creates the input pipeline of a harness dataset for a distribution
+    strategy.
+
+    The dataset's batches are split into samples and rebatched to the
+    global batch size (the dataset's batch size times the number of
+    replicas), which the strategy splits back into one batch of the
+    dataset's size per replica. With several workers, each worker keeps
+    the replica batches of its own replicas.
+
+    Parameters
+    ----------
+    sequence : HyperspectralDataset
+        The dataset, whose batch size is the per-replica batch size
+    strategy : tf.distribute.Strategy
+        The distribution strategy
+
+    Returns
+    -------
+    tf.data.Dataset
+        The dataset's global batches
+    """
+    element_spec = get_batch_spec(sequence)
+
+    def generator():
+        for i in range(len(sequence)):
+            yield sequence[i]
+        # Reshuffle the dataset like Keras does with a Sequence
+        sequence.on_epoch_end()
+
+    # Padded and class-balanced datasets fill their last batch
+    if sequence.pad_batches or sequence.sampler is not None:
+        num_samples = len(sequence) * sequence.batch_size
+    else:
+        num_samples = len(sequence.indices)
+    global_batch_size = sequence.batch_size * strategy.num_replicas_in_sync
+    num_batches = -(-num_samples // global_batch_size)
+
+    dataset = tf.data.Dataset.from_generator(generator, output_signature=element_spec)
+    dataset = dataset.unbatch().batch(global_batch_size)
+    dataset = dataset.apply(tf.data.experimental.assert_cardinality(num_batches))
+    dataset = dataset.prefetch(tf.data.experimental.AUTOTUNE)
+
+    # A generator can not be sharded by file, so each worker keeps its
+    # replicas' share of every global batch
+    options = tf.data.Options()
+    options.experimental_distribute.auto_shard_policy = \
+        tf.data.experimental.AutoShardPolicy.DATA
+    return dataset.with_options(options)
@@ -0,0 +1,493 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Model export module
+
+This script converts a trained model checkpoint into TFLite models for
+CPU inference (float32, dynamic-range quantized and full-integer
+quantized), optionally exports it to ONNX, and writes a report comparing
+the accuracy and latency of each exported model on the test split.
+
+The model architecture and dataset are given with the same command-line
+flags as the test harness, and the checkpoint with --restore.
+
+Author:  Christopher Good
+Version: 1.0.0
+
+Usage: python export_model.py --restore CHECKPOINT [test harness flags]
+                              [--quantization all] [--export_dir DIR]
+
+"""
+# See following link for proper docstring documentation
+# https://pandas.pydata.org/docs/development/contributing_docstring.html
+
+### Futures ###
+#TODO
+
+### Built-in Imports ###
+import os
+import time
+
+### Other Library Imports ###
+import numpy as np
+import pandas as pd
+from sklearn import metrics
+import tensorflow as tf
+
+### Local Imports ###
+from test_harness import (
+    create_model,
+    load_experiment_datasets,
+    test_harness_parser,
+)
+from utilities import write_csv_atomic
+
+### Constants ###
+
+# TFLite model variants that can be exported
+QUANTIZATION_MODES = ('float32', 'dynamic', 'int8')
+
+### Definitions ###
+
+def representative_patches(dataset, num_samples):
+    """
+    Returns a generator of single patches drawn from random batches of a
+    dataset, used to calibrate full-integer quantization.
+
+    Parameters
+    ----------
+    dataset : HyperspectralDataset
+        Dataset to draw patches from (usually the training split)
+    num_samples : int
+        Number of patches to yield
+
+    Returns
+    -------
+    callable
+        Generator function yielding lists holding one float32 patch
+        with a batch dimension, as expected by the TFLite converter
+    """
+    def generator():
+        yielded = 0
+        for batch_index in np.random.permutation(len(dataset)):
+            batch_data = dataset[batch_index][0]
+            for patch in np.asarray(batch_data, dtype=np.float32):
+                yield [patch[np.newaxis, ...]]
+                yielded += 1
+                if yielded >= num_samples:
+                    return
+    return generator
+
+def convert_to_tflite(model, quantization, representative_dataset=None):
+    """
+    Converts a Keras model to a TFLite model.
+
+    Parameters
+    ----------
+    model : tf.keras.Model
+        The trained model
+    quantization : str
+        'float32' for no quantization, 'dynamic' for dynamic-range
+        quantization (int8 weights, float activations) or 'int8' for
+        full-integer quantization
+    representative_dataset : callable, optional
+        Generator function of calibration patches, required for 'int8'
+
+    Returns
+    -------
+    bytes
+        The serialized TFLite model
+    """
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+
+    if quantization == 'float32':
+        return converter.convert()
+
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == 'dynamic':
+        return converter.convert()
+
+    if quantization != 'int8':
+        raise ValueError(f"Invalid quantization '{quantization}'! "
+                         f"Use one of {QUANTIZATION_MODES}")
+    if representative_dataset is None:
+        raise ValueError('Full-integer quantization requires a representative dataset')
+
+    converter.representative_dataset = representative_dataset
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    converter.inference_input_type = tf.int8
+    converter.inference_output_type = tf.int8
+    try:
+        return converter.convert()
+    except Exception:
+        # Some operations (e.g. TFLite's 3D convolution) have no integer
+        # kernels, so keep them in float with float inputs and outputs
+        print('<!> Model has operations without int8 kernels, '
+              'keeping them in float32 <!>')
+        converter.target_spec.supported_ops = [
+            tf.lite.OpsSet.TFLITE_BUILTINS_INT8,
+            tf.lite.OpsSet.TFLITE_BUILTINS,
+        ]
+        converter.inference_input_type = tf.float32
+        converter.inference_output_type = tf.float32
+        return converter.convert()
+
+def export_onnx(model, path, opset=13):
+    """
+    Exports a Keras model to ONNX with tf2onnx, if it is installed.
+
+    Parameters
+    ----------
+    model : tf.keras.Model
+        The trained model
+    path : str
+        Path of the ONNX file to write
+    opset : int, optional
+        ONNX opset version
+
+    Returns
+    -------
+    bool
+        Whether the model was exported
+    """
+    try:
+        import tf2onnx
+    except ImportError:
+        print('<!> tf2onnx is not installed, skipping ONNX export <!>')
+        return False
+
+    input_signature = [tf.TensorSpec((None,) + tuple(model.input_shape[1:]),
+                                     tf.float32, name='input')]
+    tf2onnx.convert.from_keras(model, input_signature=input_signature,
+                               opset=opset, output_path=path)
+    return True
+
+def predict_dataset(predict_function, dataset, max_samples=None):
+    """
+    Runs a prediction function over the batches of a dataset.
+
+    Parameters
+    ----------
+    predict_function : callable
+        Function mapping a batch of patches to class probabilities
+    dataset : HyperspectralDataset
+        Dataset to predict (not shuffled)
+    max_samples : int, optional
+        Maximum number of samples to predict
+
+    Returns
+    -------
+    np.ndarray
+        Predicted class of each sample
+    """
+    predictions = []
+    num_samples = 0
+    for i in range(len(dataset)):
+        batch_data = np.asarray(dataset[i][0], dtype=np.float32)
+        predictions.append(np.asarray(predict_function(batch_data)).argmax(axis=1))
+        num_samples += len(batch_data)
+        if max_samples is not None and num_samples >= max_samples:
+            break
+    return np.concatenate(predictions)[:max_samples]
+
+def measure_single_patch_latency(predict_function, patch, repeats=100, warmup=10):
+    """
+    Returns the median latency in milliseconds of predicting a single
+    patch.
+    """
+    batch = patch[np.newaxis, ...]
+    for _ in range(max(warmup, 1)):
+        predict_function(batch)
+
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        predict_function(batch)
+        times.append((time.perf_counter() - start) * 1000.0)
+    return float(np.median(times))
+
+def compare_models(keras_model, tflite_paths, test_dataset, num_threads=None,
+                   use_xnnpack=True, max_samples=None, repeats=100):
+    """
+    Compares the accuracy and single-patch CPU latency of the Keras model
+    and its exported TFLite models on the test split.
+
+    Parameters
+    ----------
+    keras_model : tf.keras.Model
+        The trained model
+    tflite_paths : dict
+        Path of each exported TFLite model by quantization mode
+    test_dataset : HyperspectralDataset
+        The testing split
+    num_threads : int, optional
+        Number of CPU threads used by the TFLite interpreters
+    use_xnnpack : bool, optional
+        Whether the TFLite interpreters use the XNNPACK delegate
+    max_samples : int, optional
+        Maximum number of test samples to evaluate
+    repeats : int, optional
+        Number of timed single-patch predictions per model
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per model with its size, accuracy, agreement with the
+        Keras model and latency
+    """
+    target_test = np.asarray(test_dataset.labels)[:max_samples]
+    patch = np.asarray(test_dataset[0][0], dtype=np.float32)[0]
+
+    keras_predict = tf.function(lambda x: keras_model(x, training=False))
+    with tf.device('/CPU:0'):
+        keras_pred = predict_dataset(lambda x: keras_predict(x).numpy(),
+                                     test_dataset, max_samples)
+        keras_latency = measure_single_patch_latency(
+            lambda x: keras_predict(x).numpy(), patch, repeats=repeats)
+
+    rows = [{
+        'model': 'keras',
+        'size_kb': None,
+        'overall_accuracy': metrics.accuracy_score(target_test, keras_pred),
+        'cohen_kappa_score': metrics.cohen_kappa_score(target_test, keras_pred),
+        'agreement': 1.0,
+        'cpu_latency_ms': keras_latency,
+    }]
+
+    for quantization, path in tflite_paths.items():
+        classifier = TFLiteClassifier(path, num_threads=num_threads,
+                                      use_xnnpack=use_xnnpack)
+        pred = predict_dataset(classifier.predict, test_dataset, max_samples)
+        rows.append({
+            'model': f'tflite_{quantization}',
+            'size_kb': os.path.getsize(path) / 1024.0,
+            'overall_accuracy': metrics.accuracy_score(target_test, pred),
+            'cohen_kappa_score': metrics.cohen_kappa_score(target_test, pred),
+            'agreement': float(np.mean(pred == keras_pred)),
+            'cpu_latency_ms': measure_single_patch_latency(
+                classifier.predict, patch, repeats=repeats),
+        })
+
+    return pd.DataFrame(rows).set_index('model')
+
+def export_model_parser():
+    """
+    Sets up the parser for command-line flags for the model exporter.
+
+    The exporter takes the test harness flags, which describe the model
+    and dataset, and the export options.
+
+    Returns
+    -------
+    argparse.ArgumentParser
+        An ArgumentParser object configured with the export_model.py
+        command-line arguments.
+    """
+    parser = test_harness_parser()
+
+    group_export = parser.add_argument_group("Export")
+    group_export.add_argument(
+        '--quantization',
+        type=str,
+        nargs='+',
+        choices=QUANTIZATION_MODES,
+        default=list(QUANTIZATION_MODES),
+        help='TFLite model variants to export (default = all)'
+    )
+    group_export.add_argument(
+        '--export_dir',
+        type=str,
+        default=None,
+        help='Directory of the exported models and report '
+             '(defaults to the output path)'
+    )
+    group_export.add_argument(
+        '--experiment_number',
+        type=int,
+        default=1,
+        help='Experiment the checkpoint was trained in, used to reproduce '
+             'its data split (default = 1)'
+    )
+    group_export.add_argument(
+        '--calibration_samples',
+        type=int,
+        default=500,
+        help='Number of training patches used to calibrate int8 '
+             'quantization (default = 500)'
+    )
+    group_export.add_argument(
+        '--report_samples',
+        type=int,
+        default=None,
+        help='Maximum number of test patches in the comparison report '
+             '(defaults to the whole test split)'
+    )
+    group_export.add_argument(
+        '--num_threads',
+        type=int,
+        default=None,
+        help='CPU threads of the TFLite interpreter'
+    )
+    group_export.add_argument(
+        '--no_xnnpack',
+        action='store_true',
+        help='Run the TFLite models without the XNNPACK delegate'
+    )
+    group_export.add_argument(
+        '--onnx',
+        action='store_true',
+        help='Also export the model to ONNX (requires tf2onnx)'
+    )
+    return parser
+
+### Classes ###
+
+class TFLiteClassifier:
+    """
+    CPU inference backend running a TFLite model.
+
+    Float operations run on the XNNPACK delegate unless it is disabled.
+    Inputs and outputs of full-integer models are quantized and
+    dequantized, so every variant takes and returns float32 arrays.
+    """
+
+    def __init__(self, model_path, num_threads=None, use_xnnpack=True):
+        """
+        Parameters
+        ----------
+        model_path : str
+            Path of the TFLite model
+        num_threads : int, optional
+            Number of CPU threads used by the interpreter
+        use_xnnpack : bool, optional
+            Whether to apply the XNNPACK delegate
+        """
+        interpreter_kwargs = {'model_path': model_path,
+                              'num_threads': num_threads}
+
+        # XNNPACK is one of the interpreter's default delegates
+        op_resolver_type = getattr(tf.lite.experimental, 'OpResolverType', None)
+        if op_resolver_type is not None:
+            if use_xnnpack:
+                interpreter_kwargs['experimental_op_resolver_type'] = op_resolver_type.AUTO
+            else:
+                interpreter_kwargs['experimental_op_resolver_type'] = \
+                    op_resolver_type.BUILTIN_WITHOUT_DEFAULT_DELEGATES
+        elif not use_xnnpack:
+            print('<!> This Tensorflow version cannot disable the XNNPACK '
+                  'delegate <!>')
+
+        self.interpreter = tf.lite.Interpreter(**interpreter_kwargs)
+        self.input_details = self.interpreter.get_input_details()[0]
+        self.output_details = self.interpreter.get_output_details()[0]
+        self.batch_size = None
+
+    def _resize(self, batch_size):
+        """Resizes the interpreter's input to a batch size."""
+        if batch_size != self.batch_size:
+            input_shape = list(self.input_details['shape'])
+            input_shape[0] = batch_size
+            self.interpreter.resize_tensor_input(self.input_details['index'],
+                                                 input_shape)
+            self.interpreter.allocate_tensors()
+            self.input_details = self.interpreter.get_input_details()[0]
+            self.output_details = self.interpreter.get_output_details()[0]
+            self.batch_size = batch_size
+
+    def predict(self, batch_data):
+        """
+        Returns the class probabilities of a batch of patches.
+
+        Parameters
+        ----------
+        batch_data : np.ndarray
+            Batch of float32 patches
+
+        Returns
+        -------
+        np.ndarray
+            Class probabilities, one row per patch
+        """
+        batch_data = np.asarray(batch_data, dtype=np.float32)
+        self._resize(len(batch_data))
+
+        input_dtype = self.input_details['dtype']
+        if input_dtype != np.float32:
+            scale, zero_point = self.input_details['quantization']
+            info = np.iinfo(input_dtype)
+            batch_data = np.clip(np.round(batch_data / scale + zero_point),
+                                 info.min, info.max).astype(input_dtype)
+
+        self.interpreter.set_tensor(self.input_details['index'], batch_data)
+        self.interpreter.invoke()
+        output = self.interpreter.get_tensor(self.output_details['index'])
+
+        if self.output_details['dtype'] != np.float32:
+            scale, zero_point = self.output_details['quantization']
+            output = (output.astype(np.float32) - zero_point) * scale
+        return output
+
+
+### Main ###
+
+if __name__ == "__main__":
+    parser = export_model_parser()
+    args = parser.parse_args()
+    hyperparams = vars(args)
+
+    if hyperparams['restore'] is None:
+        parser.error('--restore must give the checkpoint to export')
+
+    export_dir = hyperparams['export_dir'] or hyperparams['output_path']
+    os.makedirs(export_dir, exist_ok=True)
+
+    print('-------------------------------------------------------------------')
+    print('LOADING DATASET...')
+    print('-------------------------------------------------------------------')
+    train_dataset, _, test_dataset, dataset_info, num_bands = load_experiment_datasets(
+        hyperparams, hyperparams['experiment_number'])
+
+    print('-------------------------------------------------------------------')
+    print('LOADING MODEL...')
+    print('-------------------------------------------------------------------')
+    patch_size = hyperparams['patch_size']
+    model = create_model(patch_size, patch_size, num_bands,
+                         dataset_info['num_classes'], **hyperparams)
+    model.load_weights(hyperparams['restore'])
+    print(f'< Loaded {model.name} weights from {hyperparams["restore"]} >')
+
+    print('-------------------------------------------------------------------')
+    print('EXPORTING MODEL...')
+    print('-------------------------------------------------------------------')
+    representative_dataset = representative_patches(
+        train_dataset, hyperparams['calibration_samples'])
+
+    tflite_paths = {}
+    for quantization in hyperparams['quantization']:
+        path = os.path.join(export_dir, f'{model.name}_{quantization}.tflite')
+        tflite_model = convert_to_tflite(model, quantization,
+                                         representative_dataset)
+        with open(path, 'wb') as tf_file:
+            tf_file.write(tflite_model)
+        tflite_paths[quantization] = path
+        print(f'< Exported {quantization} TFLite model to {path} >')
+
+    if hyperparams['onnx']:
+        path = os.path.join(export_dir, f'{model.name}.onnx')
+        if export_onnx(model, path):
+            print(f'< Exported ONNX model to {path} >')
+
+    print('-------------------------------------------------------------------')
+    print('COMPARING MODELS...')
+    print('-------------------------------------------------------------------')
+    report = compare_models(model, tflite_paths, test_dataset,
+                            num_threads=hyperparams['num_threads'],
+                            use_xnnpack=not hyperparams['no_xnnpack'],
+                            max_samples=hyperparams['report_samples'])
+
+    report_path = os.path.join(export_dir, f'{model.name}_export_report.csv')
+    write_csv_atomic(report, report_path)
+
+    print(report.to_string())
+    print('-------------------------------------------------------------------')
+    print(f'< Report written to {report_path} >')
@@ -14,14 +14,13 @@ import os
 
 ### Other Library Imports ###
 
-import matplotlib.pyplot as plt
+# The display libraries (matplotlib, spectral and wx) and pandas are
+# imported by the methods that use them, so loading the dataset for
+# training does not import them (or need wx on headless nodes)
 import numpy as np
-import pandas as pd
 import rasterio
 from rasterio.enums import Resampling
 from rasterio.windows import Window
-import spectral
-import wx
 
 
 ### Local Imports ###
@@ -744,6 +743,8 @@ class UH_2018_Dataset:
             # Add key value pair to dictionary
             statistics[key] = value
 
+        import pandas as pd
+
         # Create Pandas DataFrame from statistics dictionary and set the
         # index to be the class labels
         statistics_df = pd.DataFrame(data=statistics)
@@ -1017,6 +1018,9 @@ class UH_2018_Dataset:
             classes = None
             title = 'Hyperspectral image'
 
+        import matplotlib.pyplot as plt
+        import spectral
+
         plt.close('all')
 
         view = spectral.imshow(image, 
@@ -1044,6 +1048,9 @@ class UH_2018_Dataset:
         # hyperspectral image
         if self.hs_image is None: self.load_full_hs_image()
 
+        import spectral
+        import wx
+
         # Setup WxApp to display 3D spectral cube
         app = wx.App(False)
 
@@ -1373,6 +1380,9 @@ class UH_2018_Dataset:
             classes = None
             title = 'LiDAR multispectral intensity image'
 
+        import matplotlib.pyplot as plt
+        import spectral
+
         plt.close('all')
 
         view = spectral.imshow(image, 
@@ -1651,6 +1661,9 @@ class UH_2018_Dataset:
             classes = None
             title = 'LiDAR Digital Surface Model (DSM) image'
 
+        import matplotlib.pyplot as plt
+        import spectral
+
         plt.close('all')
 
         view = spectral.imshow(image, 
@@ -1947,6 +1960,9 @@ class UH_2018_Dataset:
             classes = None
             title = 'LiDAR Digital Elevation Model (DEM) image'
 
+        import matplotlib.pyplot as plt
+        import spectral
+
         plt.close('all')
 
         view = spectral.imshow(image, 
@@ -2283,6 +2299,9 @@ class UH_2018_Dataset:
             classes = None
             title = 'LiDAR Normalized Digital Surface Model (NDSM) image'
 
+        import matplotlib.pyplot as plt
+        import spectral
+
         plt.close('all')
 
         view = spectral.imshow(image, 
@@ -2433,6 +2452,9 @@ class UH_2018_Dataset:
             classes = None
             title = 'VHR RGB image'
 
+        import matplotlib.pyplot as plt
+        import spectral
+
         plt.close('all')
 
         view = spectral.imshow(image, 
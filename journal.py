@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Sweep journal module
+
+This script defines the sweep journal, an append-only record of the
+experiments of a sweep that have finished, used to resume a sweep
+after it was interrupted without re-running finished experiments.
+
+Author:  Christopher Good
+Version: 1.0.0
+
+Usage: journal.py
+
+"""
+# See following link for proper docstring documentation
+# https://pandas.pydata.org/docs/development/contributing_docstring.html
+
+### Futures ###
+#TODO
+
+### Built-in Imports ###
+import hashlib
+import json
+import os
+
+### Definitions ###
+
+def _json_default(value):
+    """Converts values the json module cannot serialize."""
+    # NumPy scalars and arrays
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    return str(value)
+
+def get_config_hash(hyperparams, ignored_keys=()):
+    """
+    Returns a hash identifying an experiment configuration.
+
+    Parameters
+    ----------
+    hyperparams : dict
+        The experiment hyperparameters
+    ignored_keys : iterable of str, optional
+        Hyperparameters that do not affect the experiment's results
+        (e.g. the output path) and are left out of the hash
+
+    Returns
+    -------
+    str
+        Hex digest of the configuration
+    """
+    config = {key: value for key, value in hyperparams.items()
+                if key not in ignored_keys}
+    config_json = json.dumps(config, sort_keys=True, default=_json_default)
+    return hashlib.sha1(config_json.encode('utf-8')).hexdigest()
+
+### Classes ###
+
+class SweepJournal:
+    """
+    Append-only journal of the finished experiments of a sweep.
+
+    Each line of the journal file is a JSON record with the experiment
+    number, its configuration hash, whether it succeeded and its
+    results. Records are flushed to disk as they are written, so the
+    journal survives the process being killed.
+    """
+
+    def __init__(self, path, resume=True):
+        """
+        Parameters
+        ----------
+        path : str
+            Path of the journal file
+        resume : bool, optional
+            Whether to keep the records of an existing journal. If
+            False, any existing journal is discarded.
+        """
+        self.path = path
+        self.records = {}
+
+        if resume and os.path.exists(path):
+            self._load()
+        else:
+            open(path, 'w').close()
+
+    def _load(self):
+        with open(self.path, 'r') as jf:
+            lines = jf.readlines()
+
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # The last line may be incomplete if the process was
+                # killed while writing it
+                continue
+            self.records[record['experiment_number']] = record
+
+        # Terminate an incomplete last line so new records start on a
+        # line of their own
+        if lines and not lines[-1].endswith('\n'):
+            with open(self.path, 'a') as jf:
+                jf.write('\n')
+
+    def get_completed(self, experiment_number, config_hash):
+        """
+        Returns the journal record of an experiment if it finished
+        successfully with the same configuration, otherwise None.
+
+        Parameters
+        ----------
+        experiment_number : int
+            The experiment number (iteration + 1)
+        config_hash : str
+            Hash of the experiment's current configuration
+        """
+        record = self.records.get(experiment_number)
+        if (record is None or not record['success']
+                or record['config_hash'] != config_hash):
+            return None
+        return record
+
+    def record(self, experiment_number, config_hash, experiment_data,
+               per_class_data, dataset_choice):
+        """
+        Appends a finished experiment to the journal.
+
+        Parameters
+        ----------
+        experiment_number : int
+            The experiment number (iteration + 1)
+        config_hash : str
+            Hash of the experiment's configuration
+        experiment_data : dict
+            The experiment's results
+        per_class_data : dict or None
+            The experiment's per-class accuracies
+        dataset_choice : str or None
+            The name of the dataset used by the experiment
+        """
+        record = {
+            'experiment_number': experiment_number,
+            'config_hash': config_hash,
+            'success': bool(experiment_data.get('success', False)),
+            'dataset_choice': dataset_choice,
+            'experiment_data': experiment_data,
+            'per_class_data': per_class_data,
+        }
+        # Round-trip through JSON so the in-memory record matches what
+        # would be loaded from the file
+        record_json = json.dumps(record, default=_json_default)
+        self.records[experiment_number] = json.loads(record_json)
+
+        with open(self.path, 'a') as jf:
+            jf.write(record_json + '\n')
+            jf.flush()
+            os.fsync(jf.fileno())
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Metrics log module
+
+This script defines the structured metrics log of the test harness, a
+JSON Lines file of an experiment's events (per-epoch metrics and
+throughput, the duration and resource usage of each phase, and the
+experiment's configuration and results). Events are queued by the
+training thread and serialized and written by a background writer
+thread in buffered batches, so logging costs the training loop a queue
+insertion.
+
+Each line of the log is a JSON object with the event's `time` (seconds
+since the epoch), its `event` type, the logger's context fields (e.g.
+`experiment`) and the event's own fields.
+
+Author:  Christopher Good
+Version: 1.0.0
+
+Usage: metrics_log.py
+
+"""
+# See following link for proper docstring documentation
+# https://pandas.pydata.org/docs/development/contributing_docstring.html
+
+### Futures ###
+#TODO
+
+### Built-in Imports ###
+from contextlib import contextmanager, nullcontext
+import json
+import queue
+import threading
+import time
+
+### Other Library Imports ###
+from tensorflow.keras.callbacks import Callback
+
+### Local Imports ###
+from callbacks import (
+    get_peak_gpu_memory_mb,
+    get_peak_rss_mb,
+)
+from journal import _json_default
+from utilities import print_d
+
+### Constants ###
+
+# Seconds between flushes of the log file while events are written
+FLUSH_INTERVAL = 1.0
+
+### Definitions ###
+
+def log_phase(logger, name, **fields):
+    """
+    Returns the context manager logging a phase to a metrics log, or one
+    that does nothing if there is no log.
+    """
+    if logger is None:
+        return nullcontext()
+    return logger.phase(name, **fields)
+
+### Classes ###
+
+class MetricsLogger:
+    """
+    Writes events to a JSON Lines file from a background thread.
+
+    `log` only timestamps an event and queues it. The writer thread
+    serializes the queued events, writes them through a buffered file
+    and flushes it at most every `flush_interval` seconds, and when the
+    logger is closed.
+    """
+
+    _CLOSE = object()
+
+    def __init__(self, path, flush_interval=FLUSH_INTERVAL, device=None, **context):
+        """
+        Parameters
+        ----------
+        path : str
+            Path of the log file, which is overwritten
+        flush_interval : float, optional
+            Seconds between flushes of the log file
+        device : str, optional
+            Tensorflow device string used for the GPU memory of phases
+        **context
+            Fields added to every event (e.g. the experiment number)
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        self.device = device
+        self.context = context
+        self._queue = queue.SimpleQueue()
+        self._file = open(path, 'w', buffering=1 << 16)
+        self._thread = threading.Thread(target=self._write_events,
+                                        name='metrics-log-writer', daemon=True)
+        self._thread.start()
+
+    def log(self, event, **fields):
+        """
+        Queues an event.
+
+        Parameters
+        ----------
+        event : str
+            The event type
+        **fields
+            The event's fields, which must not be modified after they
+            are logged. Values the json module cannot serialize (e.g.
+            NumPy scalars) are converted.
+        """
+        self._queue.put((time.time(), event, fields))
+
+    @contextmanager
+    def phase(self, name, **fields):
+        """
+        Context manager that logs a 'phase' event with the wall and CPU
+        time of the wrapped code and the peak memory at its end.
+        """
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            self.log('phase', phase=name,
+                     wall_time=time.perf_counter() - wall_start,
+                     cpu_time=time.process_time() - cpu_start,
+                     peak_rss_mb=get_peak_rss_mb(),
+                     peak_gpu_mem_mb=get_peak_gpu_memory_mb(self.device),
+                     **fields)
+
+    def close(self):
+        """Writes the queued events and closes the log file."""
+        if self._thread.is_alive():
+            self._queue.put(self._CLOSE)
+            self._thread.join()
+
+    def _write_events(self):
+        last_flush = time.monotonic()
+        closing = False
+        while not closing:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = None
+
+            # Write every queued event before flushing
+            while item is not None:
+                if item is self._CLOSE:
+                    closing = True
+                    break
+                self._write(*item)
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    item = None
+
+            if closing or time.monotonic() - last_flush >= self.flush_interval:
+                self._file.flush()
+                last_flush = time.monotonic()
+        self._file.close()
+
+    def _write(self, timestamp, event, fields):
+        record = {'time': timestamp, 'event': event, **self.context, **fields}
+        line = json.dumps(record, default=_json_default)
+        self._file.write(line + '\n')
+        print_d(f'  [{event}] {line}')
+
+class MetricsLogCallback(Callback):
+    """
+    Logs the start of training and the metrics of each epoch, with the
+    throughput and memory statistics of a ThroughputMonitor when given.
+    """
+
+    def __init__(self, logger, throughput_monitor=None):
+        """
+        Parameters
+        ----------
+        logger : MetricsLogger
+            The log to write the events to
+        throughput_monitor : callbacks.ThroughputMonitor, optional
+            Monitor whose statistics are added to each epoch's event. It
+            must be before this callback in the callback list.
+        """
+        super().__init__()
+        self.logger = logger
+        self.throughput_monitor = throughput_monitor
+
+    def on_train_begin(self, logs=None):
+        self.logger.log('train_begin', model=self.model.name,
+                        epochs=self.params.get('epochs'),
+                        steps=self.params.get('steps'))
+
+    def on_epoch_end(self, epoch, logs=None):
+        fields = dict(logs or {})
+        if self.throughput_monitor is not None and self.throughput_monitor.epoch_stats:
+            fields.update(self.throughput_monitor.epoch_stats[-1])
+        fields['epoch'] = epoch + 1
+        self.logger.log('epoch', **fields)
+
+    def on_train_end(self, logs=None):
+        self.logger.log('train_end', **dict(logs or {}))
@@ -0,0 +1,582 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Model profiler module
+
+This script defines functions that report the cost of a model (its
+parameter count, floating point operations and measured CPU latency),
+profile the cost and latency of each of its layers to estimate the
+largest batch size that fits in device memory, and select the
+Pareto-optimal models of an experiment sweep by accuracy and latency.
+
+Author:  Christopher Good
+Version: 1.0.0
+
+Usage: python model_profiler.py RESULTS_CSV [--accuracy overall_accuracy]
+                                            [--latency cpu_latency_ms]
+       python model_profiler.py --layers MODEL_ID --bands BANDS
+                                [--patch_size 11] [--batch_size 64]
+
+"""
+# See following link for proper docstring documentation
+# https://pandas.pydata.org/docs/development/contributing_docstring.html
+
+### Futures ###
+#TODO
+
+### Built-in Imports ###
+import argparse
+import math
+import os
+import subprocess
+import time
+
+### Other Library Imports ###
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.layers import (
+    Activation,
+    BatchNormalization,
+    Conv2D,
+    Conv3D,
+    Dense,
+    DepthwiseConv2D,
+    ReLU,
+)
+
+### Local Imports ###
+from utilities import write_csv_atomic
+
+### Definitions ###
+
+def _prod(values):
+    """Returns the product of a shape's known dimensions."""
+    return int(np.prod([value for value in values if value is not None]))
+
+def _get_shape(shape):
+    """Returns the first shape of a layer with multiple inputs/outputs."""
+    if isinstance(shape, list):
+        return shape[0]
+    return shape
+
+def get_layer_flops(layer):
+    """
+    Returns the number of floating point operations of a single forward
+    pass of a layer for one sample.
+
+    Multiply-adds count as two operations. Layers without arithmetic
+    (reshapes, concatenations, dropout) count as zero.
+
+    Parameters
+    ----------
+    layer : tf.keras.layers.Layer
+        A built layer of a functional model
+
+    Returns
+    -------
+    int
+        Floating point operations per sample
+    """
+    output_shape = _get_shape(layer.output_shape)[1:]
+    output_size = _prod(output_shape)
+
+    # Custom layers that know their own cost
+    if hasattr(layer, 'get_flops'):
+        return layer.get_flops()
+
+    if isinstance(layer, DepthwiseConv2D):
+        flops = 2 * _prod(layer.kernel_size) * output_size
+        if layer.use_bias:
+            flops += output_size
+        return flops
+    elif isinstance(layer, (Conv2D, Conv3D)):
+        input_channels = _get_shape(layer.input_shape)[-1]
+        groups = getattr(layer, 'groups', 1)
+        kernel_size = _prod(layer.kernel_size)
+        flops = 2 * kernel_size * (input_channels // groups) * output_size
+        if layer.use_bias:
+            flops += output_size
+        return flops
+    elif isinstance(layer, Dense):
+        input_size = _get_shape(layer.input_shape)[-1]
+        flops = 2 * input_size * layer.units
+        if layer.use_bias:
+            flops += layer.units
+        return flops
+    elif isinstance(layer, BatchNormalization):
+        # Inference-time scale and shift
+        return 2 * output_size
+    elif isinstance(layer, (Activation, ReLU)):
+        return output_size
+    elif 'Pooling' in type(layer).__name__:
+        if 'Global' in type(layer).__name__:
+            return _prod(_get_shape(layer.input_shape)[1:])
+        return _prod(layer.pool_size) * output_size
+    return 0
+
+def count_flops(model):
+    """
+    Returns the number of floating point operations of a single forward
+    pass of a model for one sample.
+
+    Parameters
+    ----------
+    model : tf.keras.Model
+        A functional Keras model
+
+    Returns
+    -------
+    int
+        Floating point operations per sample
+    """
+    return sum(get_layer_flops(layer) for layer in model.layers)
+
+def measure_latency(model, batch_size=1, repeats=50, warmup=5,
+                    device='/CPU:0'):
+    """
+    Measures the forward pass latency of a model on a device.
+
+    The model is cloned onto the device so that measuring CPU latency
+    does not copy weights from a GPU on every call.
+
+    Parameters
+    ----------
+    model : tf.keras.Model
+        A Keras model
+    batch_size : int, optional
+        Number of samples per forward pass
+    repeats : int, optional
+        Number of timed forward passes
+    warmup : int, optional
+        Number of untimed forward passes (at least one, so graph tracing
+        is not timed)
+    device : str, optional
+        Tensorflow device string to measure on
+
+    Returns
+    -------
+    dict
+        Median, mean and minimum latency in milliseconds
+    """
+    with tf.device(device):
+        device_model = tf.keras.models.clone_model(model)
+        device_model.set_weights(model.get_weights())
+
+        forward = tf.function(lambda x: device_model(x, training=False))
+
+        input_shape = (batch_size,) + tuple(model.input_shape[1:])
+        x = tf.random.uniform(input_shape)
+
+        for _ in range(max(warmup, 1)):
+            forward(x).numpy()
+
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            forward(x).numpy()
+            times.append((time.perf_counter() - start) * 1000.0)
+
+    return {
+        'median': float(np.median(times)),
+        'mean': float(np.mean(times)),
+        'min': float(np.min(times)),
+    }
+
+def profile_model(model, measure_cpu_latency=False, batch_size=1,
+                  repeats=50, warmup=5):
+    """
+    Reports the cost of a model.
+
+    Parameters
+    ----------
+    model : tf.keras.Model
+        A functional Keras model
+    measure_cpu_latency : bool, optional
+        Whether to measure the CPU forward pass latency
+    batch_size : int, optional
+        Number of samples per forward pass when measuring latency
+    repeats : int, optional
+        Number of timed forward passes when measuring latency
+    warmup : int, optional
+        Number of untimed forward passes when measuring latency
+
+    Returns
+    -------
+    dict
+        The 'params', 'trainable_params', 'flops' and 'cpu_latency_ms'
+        (None unless measured) of the model
+    """
+    trainable_params = int(sum(_prod(weight.shape)
+                               for weight in model.trainable_weights))
+    profile = {
+        'params': int(model.count_params()),
+        'trainable_params': trainable_params,
+        'flops': count_flops(model),
+        'cpu_latency_ms': None,
+    }
+
+    if measure_cpu_latency:
+        latency = measure_latency(model, batch_size=batch_size,
+                                  repeats=repeats, warmup=warmup)
+        profile['cpu_latency_ms'] = latency['median']
+
+    return profile
+
+def _get_layer_inputs(layer, batch_size):
+    """Returns random inputs for a layer of a functional model."""
+    def random_input(shape):
+        return tf.random.uniform((batch_size,) + tuple(shape[1:]),
+                                 dtype=layer.compute_dtype)
+
+    if isinstance(layer.input_shape, list):
+        return [random_input(shape) for shape in layer.input_shape]
+    return random_input(layer.input_shape)
+
+def measure_layer_latency(layer, batch_size=1, repeats=20, warmup=3):
+    """
+    Measures the forward pass latency of a single layer of a functional
+    model on the current device.
+
+    Parameters
+    ----------
+    layer : tf.keras.layers.Layer
+        A built layer of a functional model
+    batch_size : int, optional
+        Number of samples per forward pass
+    repeats : int, optional
+        Number of timed forward passes
+    warmup : int, optional
+        Number of untimed forward passes (at least one, so graph tracing
+        is not timed)
+
+    Returns
+    -------
+    float
+        Median latency in milliseconds
+    """
+    inputs = _get_layer_inputs(layer, batch_size)
+    forward = tf.function(lambda x: layer(x, training=False))
+
+    for _ in range(max(warmup, 1)):
+        forward(inputs).numpy()
+
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        forward(inputs).numpy()
+        times.append((time.perf_counter() - start) * 1000.0)
+    return float(np.median(times))
+
+def profile_layers(model, batch_size=1, measure_layer_latencies=True,
+                   repeats=20, warmup=3):
+    """
+    Reports the cost of each layer of a model for a batch size.
+
+    Parameters
+    ----------
+    model : tf.keras.Model
+        A functional Keras model
+    batch_size : int, optional
+        Number of samples per batch
+    measure_layer_latencies : bool, optional
+        Whether to measure the forward pass latency of each layer on
+        the current device
+    repeats : int, optional
+        Number of timed forward passes per layer
+    warmup : int, optional
+        Number of untimed forward passes per layer
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per layer with its 'type', 'output_shape', 'params',
+        'param_bytes', 'flops' and 'activation_bytes' for the batch, and
+        'latency_ms' (None unless measured)
+    """
+    rows = []
+    for layer in model.layers:
+        output_shape = _get_shape(layer.output_shape)
+        output_dtype = tf.as_dtype(layer.output.dtype
+                                   if not isinstance(layer.output, list)
+                                   else layer.output[0].dtype)
+
+        latency = None
+        if measure_layer_latencies and not isinstance(layer, tf.keras.layers.InputLayer):
+            latency = measure_layer_latency(layer, batch_size=batch_size,
+                                            repeats=repeats, warmup=warmup)
+
+        rows.append({
+            'layer': layer.name,
+            'type': type(layer).__name__,
+            'output_shape': str((batch_size,) + tuple(output_shape[1:])),
+            'params': int(sum(_prod(weight.shape) for weight in layer.weights)),
+            'param_bytes': int(sum(_prod(weight.shape) * weight.dtype.size
+                                   for weight in layer.weights)),
+            'flops': get_layer_flops(layer) * batch_size,
+            'activation_bytes': _prod(output_shape[1:]) * output_dtype.size * batch_size,
+            'latency_ms': latency,
+        })
+
+    # pandas is only imported when a profile is made, so the harness
+    # processes that import this module start faster
+    import pandas as pd
+
+    return pd.DataFrame(rows).set_index('layer')
+
+def get_device_memory_bytes(device):
+    """
+    Returns the total memory of a device in bytes, or None if it cannot
+    be determined.
+
+    CPU memory is the physical memory of the machine. GPU memory is
+    read from nvidia-smi.
+
+    Parameters
+    ----------
+    device : str
+        Tensorflow device string (e.g. '/GPU:0' or '/CPU:0')
+    """
+    if 'GPU' in device:
+        gpu_num = device.split(':')[-1]
+        try:
+            output = subprocess.run(
+                ['nvidia-smi', '--query-gpu=memory.total',
+                 '--format=csv,noheader,nounits', f'--id={gpu_num}'],
+                capture_output=True, text=True, check=True).stdout
+            return int(float(output.strip().splitlines()[0]) * 1024 ** 2)
+        except (OSError, subprocess.CalledProcessError, ValueError, IndexError):
+            return None
+
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+def estimate_max_batch_size(layer_profile, batch_size, memory_bytes,
+                            training=True, optimizer_slots=2,
+                            memory_fraction=0.8):
+    """
+    Estimates the largest batch size whose activations and weights fit
+    in a device's memory.
+
+    When training, every layer's output is kept for backpropagation, and
+    the weights need their gradients and optimizer slots. At inference,
+    only a layer's inputs and output are live at once. The estimate
+    ignores the memory of the Tensorflow runtime and of temporary
+    buffers, which memory_fraction leaves room for.
+
+    Parameters
+    ----------
+    layer_profile : pd.DataFrame
+        Layer profile from profile_layers
+    batch_size : int
+        Batch size the layers were profiled with
+    memory_bytes : int
+        Total memory of the device in bytes
+    training : bool, optional
+        Whether to estimate for training rather than inference
+    optimizer_slots : int, optional
+        Number of optimizer variables per weight (e.g. 2 for Adam)
+    memory_fraction : float, optional
+        Fraction of the device memory the model may use
+
+    Returns
+    -------
+    int
+        The estimated maximum batch size (0 if even the weights do not
+        fit)
+    """
+    activation_bytes = layer_profile['activation_bytes'] / batch_size
+    param_bytes = layer_profile['param_bytes'].sum()
+
+    if training:
+        # Stored activations plus the largest activation gradient
+        per_sample = activation_bytes.sum() + activation_bytes.max()
+        fixed = param_bytes * (2 + optimizer_slots)
+    else:
+        # The largest consecutive pair of activations
+        per_sample = (activation_bytes + activation_bytes.shift(1, fill_value=0)).max()
+        fixed = param_bytes
+
+    available = memory_bytes * memory_fraction - fixed
+    if available <= 0 or per_sample <= 0:
+        return 0
+    return int(available // per_sample)
+
+def report_layer_profile(model, batch_size, device, path,
+                         measure_layer_latencies=True, memory_bytes=None):
+    """
+    Profiles the layers of a model on a device, writes the profile to a
+    CSV file and prints the estimated maximum batch sizes.
+
+    Parameters
+    ----------
+    model : tf.keras.Model
+        A functional Keras model
+    batch_size : int
+        Number of samples per batch
+    device : str
+        Tensorflow device string to measure on
+    path : str
+        Path of the layer profile CSV file
+    measure_layer_latencies : bool, optional
+        Whether to measure the forward pass latency of each layer
+    memory_bytes : int, optional
+        Total memory of the device (defaults to get_device_memory_bytes)
+
+    Returns
+    -------
+    dict
+        The estimated 'max_train_batch_size' and
+        'max_inference_batch_size' (None if the device memory is unknown)
+    """
+    with tf.device(device):
+        layer_profile = profile_layers(model, batch_size=batch_size,
+            measure_layer_latencies=measure_layer_latencies)
+    write_csv_atomic(layer_profile, path)
+
+    if memory_bytes is None:
+        memory_bytes = get_device_memory_bytes(device)
+
+    estimates = {'max_train_batch_size': None, 'max_inference_batch_size': None}
+    if memory_bytes is not None:
+        estimates['max_train_batch_size'] = estimate_max_batch_size(
+            layer_profile, batch_size, memory_bytes, training=True)
+        estimates['max_inference_batch_size'] = estimate_max_batch_size(
+            layer_profile, batch_size, memory_bytes, training=False)
+
+    print(f'< Layer profile written to {path} >')
+    print(f'< Batch of {batch_size}: '
+          f'{layer_profile["flops"].sum()} FLOPs, '
+          f'{layer_profile["activation_bytes"].sum() / 1024 ** 2:.1f} MB of activations, '
+          f'{layer_profile["param_bytes"].sum() / 1024 ** 2:.1f} MB of parameters >')
+    if memory_bytes is None:
+        print('<!> Device memory is unknown, so the maximum batch size is not estimated <!>')
+    else:
+        print(f'< Estimated maximum batch size on {device} '
+              f'({memory_bytes / 1024 ** 3:.1f} GB): '
+              f'{estimates["max_train_batch_size"]} for training, '
+              f'{estimates["max_inference_batch_size"]} for inference >')
+
+    return estimates
+
+def pareto_front(results, maximize, minimize):
+    """
+    Returns the Pareto-optimal rows of a results table, the rows no
+    other row beats in one objective without losing in the other.
+
+    Parameters
+    ----------
+    results : pd.DataFrame
+        Experiment results
+    maximize : str
+        Column to maximize (e.g. 'overall_accuracy')
+    minimize : str
+        Column to minimize (e.g. 'cpu_latency_ms')
+
+    Returns
+    -------
+    pd.DataFrame
+        The Pareto-optimal rows, sorted by the minimized column
+    """
+    candidates = results.dropna(subset=[maximize, minimize])
+    candidates = candidates.sort_values([minimize, maximize],
+                                        ascending=[True, False])
+
+    # Walking from lowest to highest cost, a row is on the front if it
+    # is more accurate than every cheaper row
+    front = []
+    best = -math.inf
+    for index, row in candidates.iterrows():
+        if row[maximize] > best:
+            front.append(index)
+            best = row[maximize]
+
+    return candidates.loc[front]
+
+def model_profiler_parser():
+    """
+    Sets up the parser for command-line flags for the model profiler.
+
+    Returns
+    -------
+    argparse.ArgumentParser
+        An ArgumentParser object configured with the model_profiler.py
+        command-line arguments.
+    """
+    parser = argparse.ArgumentParser(
+        'Selects the Pareto-optimal models of an experiment sweep, or '
+        'profiles the layers of a model')
+    parser.add_argument('results_csv', type=str, nargs='?',
+        help='Path of an experiment results CSV file')
+    parser.add_argument('--accuracy', type=str, default='overall_accuracy',
+        help='Accuracy column to maximize (default = overall_accuracy)')
+    parser.add_argument('--latency', type=str, default='cpu_latency_ms',
+        help='Latency (or cost) column to minimize (default = cpu_latency_ms)')
+
+    group_layers = parser.add_argument_group("Layer profile")
+    group_layers.add_argument('--layers', type=str, default=None,
+        help='Profile the layers of a model_id instead of selecting models')
+    group_layers.add_argument('--bands', type=int, default=None,
+        help='Number of spectral bands of the patches')
+    group_layers.add_argument('--classes', type=int, default=16,
+        help='Number of classes (default = 16)')
+    group_layers.add_argument('--patch_size', type=int, default=11,
+        help='Size of the patches (default = 11)')
+    group_layers.add_argument('--batch_size', type=int, default=64,
+        help='Batch size (default = 64)')
+    group_layers.add_argument('--data_layout', type=str, default='channels',
+        help="Input tensor layout (default = 'channels')")
+    group_layers.add_argument('--cuda', type=int, default=-1,
+        help='CUDA device to profile on (defaults to -1, the CPU)')
+    group_layers.add_argument('--memory_mb', type=int, default=None,
+        help='Device memory in MB (defaults to the detected memory)')
+    group_layers.add_argument('--no_latency', action='store_true',
+        help='Do not measure the latency of each layer')
+    group_layers.add_argument('--output', type=str, default=None,
+        help='Path of the layer profile CSV file '
+             '(defaults to <model name>_layer_profile.csv)')
+    return parser
+
+
+### Main ###
+
+if __name__ == "__main__":
+    parser = model_profiler_parser()
+    args = parser.parse_args()
+
+    if args.layers is not None:
+        if args.bands is None:
+            parser.error('--bands is required to profile the layers of a model')
+        from test_harness import create_model
+
+        device = '/CPU:0' if args.cuda < 0 else f'/GPU:{args.cuda}'
+        with tf.device(device):
+            model = create_model(args.patch_size, args.patch_size, args.bands,
+                                 args.classes, model_id=args.layers,
+                                 patch_size=args.patch_size,
+                                 data_layout=args.data_layout)
+        path = args.output or f'{model.name}_layer_profile.csv'
+        memory_bytes = args.memory_mb * 1024 ** 2 if args.memory_mb else None
+        report_layer_profile(model, args.batch_size, device, path,
+                             measure_layer_latencies=not args.no_latency,
+                             memory_bytes=memory_bytes)
+        raise SystemExit(0)
+
+    if args.results_csv is None:
+        parser.error('RESULTS_CSV is required unless --layers is given')
+
+    import pandas as pd
+
+    results = pd.read_csv(args.results_csv, index_col=0)
+    if 'success' in results:
+        results = results[results['success'].astype(bool)]
+
+    front = pareto_front(results, args.accuracy, args.latency)
+
+    columns = [column for column in ('experiment_number', 'model', 'params',
+                                     'flops', args.latency, args.accuracy)
+                if column in front]
+    print('PARETO-OPTIMAL EXPERIMENTS')
+    print('-------------------------------------------------------------------')
+    print(front[columns].to_string(index=False))
@@ -18,9 +18,11 @@ Usage: models.py
 #TODO
 
 ### Built-in Imports ###
+import inspect
 import math
 
 ### Other Library Imports ###
+import cpuinfo
 import tensorflow as tf
 from tensorflow.keras import backend as K
 from tensorflow.keras import regularizers
@@ -30,6 +32,7 @@ from tensorflow.keras.callbacks import (
 )
 from tensorflow.keras.layers import (
     Activation,
+    AveragePooling2D,
     AveragePooling3D,
     BatchNormalization,
     Concatenate,
@@ -37,10 +40,14 @@ from tensorflow.keras.layers import (
     Conv3D,
     Convolution3D,
     Dense,
+    DepthwiseConv2D,
     Dropout,
     Flatten,
+    GlobalAveragePooling2D,
     GlobalAveragePooling3D,
     Input,
+    Layer,
+    MaxPooling2D,
     MaxPooling3D
 )
 from tensorflow.keras.models import (
@@ -58,6 +65,227 @@ from tensorflow.keras.optimizers import (
     SGD,
 )
 
+### Constants ###
+
+# Input tensor layouts supported by the model builders:
+#   'channels' - (1, rows, cols, bands); the spectral bands are the
+#                channel axis of a depth-1 volume
+#   'spectral' - (rows, cols, bands, 1); the spectral bands are the
+#                depth axis, so 3D kernels convolve along the spectrum
+#   '2d'       - (rows, cols, bands); 2D convolutions with the spectral
+#                bands as channels
+DATA_LAYOUTS = ('channels', 'spectral', '2d')
+
+# Convolution building blocks supported by the model builders:
+#   'standard'   - full spectral-spatial convolutions
+#   'factorized' - a spectral convolution followed by a spatial
+#                  convolution
+#   'separable'  - depthwise spectral and spatial convolutions followed
+#                  by a pointwise convolution. 3D depthwise convolutions
+#                  use grouped Conv3D layers, which Tensorflow only
+#                  supports on GPU.
+BLOCK_TYPES = ('standard', 'factorized', 'separable')
+
+# Default DenseNet architecture, as described in the 3D-DenseNet paper
+DENSENET_DEFAULTS = {
+    'blocks': (6, 6, 6),
+    'growth_rate': 32,
+    'bottleneck': True,
+    'compression': 0.5,
+    'stem_filters': 64,
+    'memory_efficient': False,
+}
+
+### Definitions ###
+
+def get_input_shape(img_rows, img_cols, img_channels, data_layout='channels'):
+    """
+    Returns the model input shape of a patch for a data layout.
+
+    Parameters
+    ----------
+    img_rows : int
+        Number of rows in neighborhood patch.
+    img_cols : int
+        Number of columns in neighborhood patch.
+    img_channels : int
+        Number of spectral bands.
+    data_layout : str, optional
+        One of DATA_LAYOUTS
+
+    Returns
+    -------
+    tuple of int
+        The input shape, without the batch dimension
+    """
+    if data_layout == 'channels':
+        return (1, img_rows, img_cols, img_channels)
+    elif data_layout == 'spectral':
+        return (img_rows, img_cols, img_channels, 1)
+    elif data_layout == '2d':
+        return (img_rows, img_cols, img_channels)
+    raise ValueError(f"Unknown data layout '{data_layout}'! "
+                     f"Valid layouts are: {', '.join(DATA_LAYOUTS)}")
+
+def get_densenet_config(**hyperparams):
+    """
+    Returns the DenseNet architecture parameters from hyperparameter
+    inputs, using the defaults for any that are not set.
+
+    Parameters
+    ----------
+    **hyperparams : dict
+        dictionary of hyperparameter values, which may include
+        'densenet_blocks' (list of int or comma separated str),
+        'growth_rate', 'no_bottleneck', 'compression', 'stem_filters'
+        and 'memory_efficient'
+
+    Returns
+    -------
+    dict
+        Keyword arguments for DensenetBuilder.build
+    """
+    config = dict(DENSENET_DEFAULTS)
+
+    blocks = hyperparams.get('densenet_blocks')
+    if isinstance(blocks, str):
+        blocks = [block for block in blocks.split(',') if block.strip()]
+    if blocks is not None:
+        config['blocks'] = tuple(int(block) for block in blocks)
+    if hyperparams.get('growth_rate') is not None:
+        config['growth_rate'] = int(hyperparams['growth_rate'])
+    if hyperparams.get('no_bottleneck'):
+        config['bottleneck'] = False
+    if hyperparams.get('compression') is not None:
+        config['compression'] = float(hyperparams['compression'])
+    if hyperparams.get('stem_filters') is not None:
+        config['stem_filters'] = int(hyperparams['stem_filters'])
+    if hyperparams.get('memory_efficient'):
+        config['memory_efficient'] = True
+
+    if not config['blocks'] or min(config['blocks']) < 1:
+        raise ValueError("'densenet_blocks' must have at least one stage "
+                         "with at least one layer")
+    if not 0.0 < config['compression'] <= 1.0:
+        raise ValueError("'compression' must be in the range (0, 1]")
+
+    return config
+
+def get_spectral_axis(data_layout):
+    """
+    Returns the index of the spectral axis among the convolved axes of
+    a data layout, or None if the spectral bands are the channel axis.
+    """
+    if data_layout == 'channels':
+        # The bands are channels of a depth-1 volume, so the depth axis
+        # stands in for the spectral axis
+        return 0
+    elif data_layout == 'spectral':
+        return 2
+    return None
+
+def spectral_spatial_conv(x, filters, kernel_size, strides=1, name=None,
+                          conv_dims=3, block_type='standard',
+                          spectral_axis=None, use_bias=True,
+                          **conv_kwargs):
+    """
+    Applies a convolution, optionally factorized into its spectral and
+    spatial parts.
+
+    Parameters
+    ----------
+    x : tf.Tensor
+        Input tensor
+    filters : int
+        Number of output filters
+    kernel_size : int or tuple of int
+        Size of the full convolution kernel
+    strides : int or tuple of int, optional
+        Strides of the full convolution
+    name : str, optional
+        Layer name, used as a prefix for the factorized layers
+    conv_dims : int, optional
+        2 or 3 for 2D or 3D convolutions
+    block_type : str, optional
+        One of BLOCK_TYPES
+    spectral_axis : int, optional
+        Index of the spectral axis among the convolved axes (see
+        get_spectral_axis), or None if the bands are the channel axis.
+        When the spectral axis has a length of 1, the spectral part is
+        a pointwise convolution over the channels instead.
+    use_bias : bool, optional
+        Whether the (last) convolution uses a bias
+    **conv_kwargs : dict
+        Other keyword arguments for the full (or pointwise) convolution
+        layers, e.g. kernel_regularizer
+
+    Returns
+    -------
+    tf.Tensor
+        Output tensor
+    """
+    if block_type not in BLOCK_TYPES:
+        raise ValueError(f"Unknown block type '{block_type}'! "
+                         f"Valid block types are: {', '.join(BLOCK_TYPES)}")
+
+    conv, _, _, _ = _get_layers(conv_dims)
+    if isinstance(kernel_size, int):
+        kernel_size = (kernel_size,) * conv_dims
+    if isinstance(strides, int):
+        strides = (strides,) * conv_dims
+
+    def layer_name(suffix):
+        return None if name is None else f'{name}_{suffix}'
+
+    if block_type == 'standard':
+        return conv(filters, kernel_size, strides=strides, padding='same',
+                    use_bias=use_bias, name=name, **conv_kwargs)(x)
+
+    # Split the kernel and strides into their spectral and spatial parts
+    axes = range(conv_dims)
+    if spectral_axis is None or K.int_shape(x)[1 + spectral_axis] == 1:
+        spectral_kernel = (1,) * conv_dims
+        spectral_strides = (1,) * conv_dims
+    else:
+        spectral_kernel = tuple(kernel_size[axis] if axis == spectral_axis else 1 for axis in axes)
+        spectral_strides = tuple(strides[axis] if axis == spectral_axis else 1 for axis in axes)
+    spatial_kernel = tuple(1 if axis == spectral_axis else kernel_size[axis] for axis in axes)
+    spatial_strides = tuple(1 if axis == spectral_axis else strides[axis] for axis in axes)
+
+    if block_type == 'factorized':
+        x = conv(filters, spectral_kernel, strides=spectral_strides,
+                 padding='same', use_bias=False, name=layer_name('spectral'),
+                 **conv_kwargs)(x)
+        return conv(filters, spatial_kernel, strides=spatial_strides,
+                    padding='same', use_bias=use_bias,
+                    name=layer_name('spatial'), **conv_kwargs)(x)
+
+    # Depthwise separable convolution
+    channels = K.int_shape(x)[-1]
+    if conv_dims == 2:
+        x = DepthwiseConv2D(spatial_kernel, strides=spatial_strides,
+                            padding='same', use_bias=False,
+                            name=layer_name('depthwise'))(x)
+    else:
+        if spectral_kernel != (1,) * conv_dims:
+            x = conv(channels, spectral_kernel, strides=spectral_strides,
+                     padding='same', groups=channels, use_bias=False,
+                     name=layer_name('spectral_depthwise'))(x)
+        x = conv(channels, spatial_kernel, strides=spatial_strides,
+                 padding='same', groups=channels, use_bias=False,
+                 name=layer_name('spatial_depthwise'))(x)
+    return conv(filters, 1, padding='same', use_bias=use_bias,
+                name=layer_name('pointwise'), **conv_kwargs)(x)
+
+def _get_layers(conv_dims):
+    """
+    Returns the convolution and pooling layer classes for 2D or 3D
+    convolutions.
+    """
+    if conv_dims == 2:
+        return Conv2D, MaxPooling2D, AveragePooling2D, GlobalAveragePooling2D
+    return Conv3D, MaxPooling3D, AveragePooling3D, GlobalAveragePooling3D
+
 def get_optimizer(**hyperparams):
     """
     Returns appropriately constructed optimizer from hyperparameter
@@ -176,8 +404,93 @@ def get_optimizer(**hyperparams):
         # function optimizer argument
         optimizer = 'rmsprop' 
 
+    # Scale the loss to keep small float16 gradients from underflowing
+    if tf.keras.mixed_precision.global_policy().compute_dtype == 'float16':
+        optimizer = tf.keras.mixed_precision.LossScaleOptimizer(
+            tf.keras.optimizers.get(optimizer))
+
     return optimizer
 
+def get_mixed_precision_policy(device):
+    """
+    Returns the mixed precision policy supported by a device.
+
+    Parameters
+    ----------
+    device : str
+        Tensorflow device string (e.g. '/GPU:0' or '/CPU:0')
+
+    Returns
+    -------
+    str or None
+        'mixed_float16' for GPUs, 'mixed_bfloat16' for CPUs with
+        AVX512-BF16 or AMX instructions, or None if the device has no
+        fast half precision support
+    """
+    if 'GPU' in device:
+        return 'mixed_float16'
+
+    cpu_flags = cpuinfo.get_cpu_info().get('flags', [])
+    if 'avx512_bf16' in cpu_flags or 'amx_bf16' in cpu_flags:
+        return 'mixed_bfloat16'
+    return None
+
+def get_xla_compile_options():
+    """
+    Enables XLA compilation of a model's training, evaluation and
+    prediction steps.
+
+    Tensorflow versions whose Model.compile has a `jit_compile` argument
+    compile only the model's steps. Older versions fall back to XLA
+    auto-clustering of every Tensorflow graph in the process.
+
+    Returns
+    -------
+    dict
+        Keyword arguments to pass to Model.compile
+    """
+    if 'jit_compile' in inspect.signature(Model.compile).parameters:
+        return {'jit_compile': True}
+
+    tf.config.optimizer.set_jit(True)
+    return {}
+
+def make_compiled_predict(model, batch_size):
+    """
+    Returns an XLA compiled prediction function for a model.
+
+    The function only accepts batches of exactly `batch_size` samples,
+    so it is compiled once. Partial batches must be padded (see the
+    HyperspectralDataset `pad_batches` option).
+
+    Parameters
+    ----------
+    model : tf.keras.Model
+        A Keras model
+    batch_size : int
+        Number of samples per batch
+
+    Returns
+    -------
+    callable
+        Function mapping a batch of inputs to the model's outputs
+    """
+    input_spec = tf.TensorSpec((batch_size,) + tuple(model.input_shape[1:]),
+                               dtype=model.inputs[0].dtype)
+
+    @tf.function(input_signature=[input_spec], jit_compile=True)
+    def predict_step(x):
+        return model(x, training=False)
+
+    return predict_step
+
+def _get_input_dtype():
+    """
+    Returns the model input dtype for the global precision policy, so
+    half precision patches are not cast back to float32.
+    """
+    return tf.keras.mixed_precision.global_policy().compute_dtype
+
 def _handle_dim_ordering():
     global CONV_DIM1
     global CONV_DIM2
@@ -195,77 +508,433 @@ def _handle_dim_ordering():
         CONV_DIM3 = 4
 
 
-def dense_block(x, blocks, name):
+class EfficientDenseLayer(Layer):
+    """
+    The concatenation, batch normalization, ReLU and convolution at the
+    start of a dense layer, with the concatenation and normalization
+    outputs recomputed during backpropagation instead of stored.
+
+    A standard dense layer stores a new concatenation and batch
+    normalization output of all the previous feature maps, so activation
+    memory grows quadratically with the dense block depth. This layer
+    takes the list of feature maps and wraps the concatenation,
+    normalization and convolution in tf.recompute_grad, so only the
+    feature maps and the convolution output are kept (the shared memory
+    approach of Pleiss et al., "Memory-Efficient Implementation of
+    DenseNets").
+
+    The batch statistics are computed outside the recomputed function
+    from each feature map (the per-channel moments of a concatenation
+    are the concatenated moments of its parts), so the moving averages
+    are only updated once per step. Only channels_last is supported.
+    """
+
+    def __init__(self, filters, kernel_size, conv_dims=3, momentum=0.99,
+                 epsilon=1.001e-5, **kwargs):
+        """
+        Parameters
+        ----------
+        filters : int
+            Number of convolution filters
+        kernel_size : int
+            Size of the convolution kernel in every dimension
+        conv_dims : int, optional
+            2 or 3 for 2D or 3D convolutions
+        momentum : float, optional
+            Momentum of the batch normalization moving averages
+        epsilon : float, optional
+            Batch normalization variance epsilon
+        """
+        super().__init__(**kwargs)
+        self.filters = filters
+        self.kernel_size = kernel_size
+        self.conv_dims = conv_dims
+        self.momentum = momentum
+        self.epsilon = epsilon
+
+    def build(self, input_shape):
+        channels = sum(int(shape[-1]) for shape in input_shape)
+        # The normalization parameters stay float32 under mixed
+        # precision, like in BatchNormalization
+        self.gamma = self.add_weight(name='gamma', shape=(channels,),
+                                     initializer='ones',
+                                     experimental_autocast=False)
+        self.beta = self.add_weight(name='beta', shape=(channels,),
+                                    initializer='zeros',
+                                    experimental_autocast=False)
+        # The moving averages are updated by each replica and averaged
+        # when read, like in BatchNormalization, so they can be updated
+        # in a distribution strategy's replica context
+        self.moving_mean = self.add_weight(
+            name='moving_mean',
+            shape=(channels,),
+            initializer='zeros',
+            trainable=False,
+            synchronization=tf.VariableSynchronization.ON_READ,
+            aggregation=tf.VariableAggregation.MEAN,
+            experimental_autocast=False)
+        self.moving_variance = self.add_weight(
+            name='moving_variance',
+            shape=(channels,),
+            initializer='ones',
+            trainable=False,
+            synchronization=tf.VariableSynchronization.ON_READ,
+            aggregation=tf.VariableAggregation.MEAN,
+            experimental_autocast=False)
+        self.kernel = self.add_weight(
+            name='kernel',
+            shape=(self.kernel_size,) * self.conv_dims + (channels, self.filters),
+            initializer='glorot_uniform')
+        super().build(input_shape)
+
+    def _batch_moments(self, inputs):
+        """
+        Returns the per-channel batch moments of the concatenated inputs
+        and updates the moving averages with them.
+        """
+        # Per-channel moments of each feature map over the batch and
+        # spatial axes
+        moments = [tf.nn.moments(tf.cast(feature, tf.float32),
+                                 axes=list(range(len(feature.shape) - 1)))
+                   for feature in inputs]
+        mean = tf.concat([feature_mean for feature_mean, _ in moments], axis=0)
+        variance = tf.concat([feature_variance for _, feature_variance in moments], axis=0)
+
+        self.moving_mean.assign_sub(
+            (self.moving_mean - tf.stop_gradient(mean)) * (1.0 - self.momentum))
+        self.moving_variance.assign_sub(
+            (self.moving_variance - tf.stop_gradient(variance)) * (1.0 - self.momentum))
+        return mean, variance
+
+    def _moving_moments(self):
+        return tf.identity(self.moving_mean), tf.identity(self.moving_variance)
+
+    def call(self, inputs, training=None):
+        # Like BatchNormalization, fall back on the Keras learning phase
+        # and branch in the graph when the training flag is a tensor
+        if training is None:
+            training = K.learning_phase()
+        if isinstance(training, (bool, int)):
+            if training:
+                mean, variance = self._batch_moments(inputs)
+            else:
+                mean, variance = self._moving_moments()
+        else:
+            mean, variance = tf.cond(tf.cast(training, tf.bool),
+                                     lambda: self._batch_moments(inputs),
+                                     self._moving_moments)
+
+        @tf.recompute_grad
+        def concat_bn_relu_conv(*args):
+            features, mean, variance = args[:-2], args[-2], args[-1]
+            x = tf.cast(tf.concat(features, axis=-1), tf.float32)
+            x = tf.nn.batch_normalization(x, mean, variance, self.beta,
+                                          self.gamma, self.epsilon)
+            x = tf.cast(tf.nn.relu(x), self.compute_dtype)
+            # Cast explicitly, since the recomputation during
+            # backpropagation runs outside the layer's autocast scope
+            kernel = tf.cast(self.kernel, self.compute_dtype)
+            return tf.nn.convolution(x, kernel, padding='SAME')
+
+        return concat_bn_relu_conv(*inputs, mean, variance)
+
+    def compute_output_shape(self, input_shape):
+        return tuple(input_shape[0][:-1]) + (self.filters,)
+
+    def get_flops(self):
+        """
+        Returns the floating point operations of a forward pass for one
+        sample.
+        """
+        channels = int(self.gamma.shape[0])
+        positions = math.prod(self.output_shape[1:-1])
+        # Normalization and ReLU of the concatenation, then convolution
+        return positions * (3 * channels
+                            + 2 * self.kernel_size ** self.conv_dims
+                            * channels * self.filters)
+
+    def get_config(self):
+        config = super().get_config()
+        config.update({
+            'filters': self.filters,
+            'kernel_size': self.kernel_size,
+            'conv_dims': self.conv_dims,
+            'momentum': self.momentum,
+            'epsilon': self.epsilon,
+        })
+        return config
+
+
+class GradientAccumulationModel(Model):
+    """
+    A model whose training step splits each batch into micro-batches and
+    accumulates their gradients before a single optimizer update, so a
+    large effective batch is trained with the activation memory of a
+    micro-batch.
+
+    The model is a functional model sharing the wrapped model's layers
+    (like distillation.Distiller), so it is compiled, checkpointed and
+    evaluated like the wrapped model. Evaluation and prediction run on
+    whole batches.
+
+    Each micro-batch's gradients are weighted by its share of the batch,
+    so the update equals that of the whole batch for losses averaged
+    over the batch. Batch normalization is the exception: each
+    micro-batch is normalized with its own statistics, as when training
+    with the micro-batch size, and the moving averages are updated once
+    per micro-batch, so they move accumulation_steps times per optimizer
+    update. Micro-batches should therefore stay large enough for stable
+    batch statistics.
+    """
+
+    def __init__(self, model, accumulation_steps):
+        """
+        Parameters
+        ----------
+        model : tf.keras.Model
+            The functional model to train
+        accumulation_steps : int
+            Number of micro-batches each training batch is split into.
+            It should divide the batch size, so every micro-batch (and
+            XLA compiled step) has the same shape.
+        """
+        super().__init__(inputs=model.inputs, outputs=model.outputs,
+                         name=model.name)
+        self.accumulation_steps = accumulation_steps
+
+    def train_step(self, data):
+        x, y, sample_weight = tf.keras.utils.unpack_x_y_sample_weight(data)
+
+        # Split the batch into at most accumulation_steps micro-batches
+        batch_size = tf.shape(y)[0]
+        micro_batch_size = -(-batch_size // self.accumulation_steps)
+        num_micro_batches = -(-batch_size // micro_batch_size)
+
+        loss_scaling = isinstance(self.optimizer,
+                                  tf.keras.mixed_precision.LossScaleOptimizer)
+        trainable_variables = self.trainable_variables
+        gradients = [tf.zeros_like(variable) for variable in trainable_variables]
+
+        for i in tf.range(num_micro_batches):
+            start = i * micro_batch_size
+            end = tf.minimum(start + micro_batch_size, batch_size)
+            micro_x = x[start:end]
+            micro_y = y[start:end]
+            micro_weight = None if sample_weight is None else sample_weight[start:end]
+
+            with tf.GradientTape() as tape:
+                y_pred = self(micro_x, training=True)
+                loss = self.compiled_loss(micro_y, y_pred, micro_weight,
+                                          regularization_losses=self.losses)
+                if loss_scaling:
+                    loss = self.optimizer.get_scaled_loss(loss)
+            micro_gradients = tape.gradient(loss, trainable_variables)
+            if loss_scaling:
+                micro_gradients = self.optimizer.get_unscaled_gradients(micro_gradients)
+
+            # Weight the micro-batch's mean loss gradients by its share
+            # of the batch
+            share = tf.cast(end - start, tf.float32) / tf.cast(batch_size, tf.float32)
+            gradients = [
+                accumulated if gradient is None
+                else accumulated + tf.cast(tf.convert_to_tensor(gradient),
+                                           accumulated.dtype) * share
+                for accumulated, gradient in zip(gradients, micro_gradients)
+            ]
+
+            self.compiled_metrics.update_state(micro_y, y_pred, micro_weight)
+
+        # Loss scale optimizers skip the update if a gradient overflowed
+        self.optimizer.apply_gradients(zip(gradients, trainable_variables))
+        return {metric.name: metric.result() for metric in self.metrics}
+
+
+def dense_block(x, blocks, name, conv_dims=3, growth_rate=32,
+                bottleneck=True, memory_efficient=False,
+                block_type='standard', spectral_axis=None,
+                layer_widths=None):
     """A dense block.
 
     # Arguments
         x: input tensor.
         blocks: integer, the number of building blocks.
         name: string, block label.
+        conv_dims: integer, 2 or 3 for 2D or 3D convolutions.
+        growth_rate: integer, growth rate at dense layers.
+        bottleneck: boolean, whether to use 1x1 bottleneck layers.
+        memory_efficient: boolean, whether to recompute the
+            concatenations and batch normalizations during
+            backpropagation instead of storing them.
+        block_type: string, one of BLOCK_TYPES.
+        spectral_axis: integer, index of the spectral axis among the
+            convolved axes, or None if the bands are the channel axis.
+        layer_widths: dict, optional (bottleneck filters, growth filters)
+            of building blocks by name (e.g. 'conv1_block2'), for pruned
+            models. Building blocks with 0 growth filters are left out.
 
     # Returns
         output tensor for the block.
     """
+    if layer_widths is None:
+        layer_widths = {}
+
+    if memory_efficient:
+        if layer_widths:
+            raise ValueError('The memory-efficient DenseNet does not '
+                             'support per-layer widths')
+        # Keep the list of feature maps and only concatenate them once,
+        # at the end of the block
+        features = [x]
+        for i in range(blocks):
+            features.append(efficient_conv_block(
+                features, growth_rate, name=name + '_block' + str(i + 1),
+                conv_dims=conv_dims, bottleneck=bottleneck,
+                block_type=block_type, spectral_axis=spectral_axis))
+        return Concatenate(axis=-1, name=name + '_concat')(features)
+
     for i in range(blocks):
-        x = conv_block(x, 32, name=name + '_block' + str(i + 1))
+        block_name = name + '_block' + str(i + 1)
+        bottleneck_filters, block_growth_rate = layer_widths.get(
+            block_name, (None, growth_rate))
+        if block_growth_rate == 0:
+            continue
+        x = conv_block(x, block_growth_rate, name=block_name,
+                       conv_dims=conv_dims, bottleneck=bottleneck,
+                       block_type=block_type, spectral_axis=spectral_axis,
+                       bottleneck_filters=bottleneck_filters)
     return x
 
 
-def conv_block(x, growth_rate, name):
+def conv_block(x, growth_rate, name, conv_dims=3, bottleneck=True,
+               block_type='standard', spectral_axis=None,
+               bottleneck_filters=None):
     """A building block for a dense block.
 
     # Arguments
         x: input tensor.
         growth_rate: float, growth rate at dense layers.
         name: string, block label.
+        conv_dims: integer, 2 or 3 for 2D or 3D convolutions.
+        bottleneck: boolean, whether to reduce the input with a 1x1
+            convolution to 4 * growth_rate filters first.
+        block_type: string, one of BLOCK_TYPES.
+        spectral_axis: integer, index of the spectral axis among the
+            convolved axes, or None if the bands are the channel axis.
+        bottleneck_filters: integer, optional number of bottleneck
+            filters (defaults to 4 * growth_rate).
 
     # Returns
         output tensor for the block.
     """
-    bn_axis = 4 if K.image_data_format() == 'channels_last' else 1
-    x1 = BatchNormalization(axis=bn_axis, epsilon=1.001e-5,
-                            name=name + '_0_bn')(x)
-    x1 = Activation('relu', name=name + '_0_relu')(x1)
-    x1 = Conv3D(4 * growth_rate, 1, use_bias=False,
-                name=name + '_1_conv', padding='same')(x1)
+    conv, _, _, _ = _get_layers(conv_dims)
+    bn_axis = -1 if K.image_data_format() == 'channels_last' else 1
+    if bottleneck_filters is None:
+        bottleneck_filters = 4 * growth_rate
+    x1 = x
+    if bottleneck:
+        x1 = BatchNormalization(axis=bn_axis, epsilon=1.001e-5,
+                                name=name + '_0_bn')(x1)
+        x1 = Activation('relu', name=name + '_0_relu')(x1)
+        x1 = conv(bottleneck_filters, 1, use_bias=False,
+                  name=name + '_1_conv', padding='same')(x1)
     x1 = BatchNormalization(axis=bn_axis, epsilon=1.001e-5,
                             name=name + '_1_bn')(x1)
     x1 = Activation('relu', name=name + '_1_relu')(x1)
-    x1 = Conv3D(growth_rate, 3, padding='same', use_bias=False,
-                name=name + '_2_conv')(x1)
+    x1 = spectral_spatial_conv(x1, growth_rate, 3, use_bias=False,
+                               name=name + '_2_conv', conv_dims=conv_dims,
+                               block_type=block_type,
+                               spectral_axis=spectral_axis)
     x = Concatenate(axis=bn_axis, name=name + '_concat')([x, x1])
     return x
 
 
-def transition_block(x, reduction, name):
+def efficient_conv_block(features, growth_rate, name, conv_dims=3,
+                         bottleneck=True, block_type='standard',
+                         spectral_axis=None):
+    """A memory-efficient building block for a dense block.
+
+    # Arguments
+        features: list of input tensors, the feature maps of the
+            previous layers in the dense block.
+        growth_rate: float, growth rate at dense layers.
+        name: string, block label.
+        conv_dims: integer, 2 or 3 for 2D or 3D convolutions.
+        bottleneck: boolean, whether to reduce the input with a 1x1
+            convolution to 4 * growth_rate filters first.
+        block_type: string, one of BLOCK_TYPES. Without a bottleneck,
+            only 'standard' is supported.
+        spectral_axis: integer, index of the spectral axis among the
+            convolved axes, or None if the bands are the channel axis.
+
+    # Returns
+        the new feature map of the block.
+    """
+    if not bottleneck:
+        if block_type != 'standard':
+            raise ValueError('The memory-efficient DenseNet without '
+                             'bottleneck layers only supports standard blocks')
+        return EfficientDenseLayer(growth_rate, 3, conv_dims=conv_dims,
+                                   name=name + '_2_conv')(features)
+
+    x1 = EfficientDenseLayer(4 * growth_rate, 1, conv_dims=conv_dims,
+                             name=name + '_1_conv')(features)
+    x1 = BatchNormalization(axis=-1, epsilon=1.001e-5,
+                            name=name + '_1_bn')(x1)
+    x1 = Activation('relu', name=name + '_1_relu')(x1)
+    x1 = spectral_spatial_conv(x1, growth_rate, 3, use_bias=False,
+                               name=name + '_2_conv', conv_dims=conv_dims,
+                               block_type=block_type,
+                               spectral_axis=spectral_axis)
+    return x1
+
+
+def transition_block(x, reduction, name, conv_dims=3, filters=None):
     """A transition block.
 
     # Arguments
         x: input tensor.
         reduction: float, compression rate at transition layers.
         name: string, block label.
+        conv_dims: integer, 2 or 3 for 2D or 3D convolutions.
+        filters: integer, optional number of output filters, which
+            overrides the compression rate (e.g. for pruned models).
 
     # Returns
         output tensor for the block.
     """
-    bn_axis = 4 if K.image_data_format() == 'channels_last' else 1
+    conv, _, avg_pool, _ = _get_layers(conv_dims)
+    bn_axis = -1 if K.image_data_format() == 'channels_last' else 1
     x = BatchNormalization(axis=bn_axis, epsilon=1.001e-5,
                            name=name + '_bn')(x)
     x = Activation('relu', name=name + '_relu')(x)
-    x = Conv3D(int(K.int_shape(x)[bn_axis] * reduction), 1, use_bias=False,
-               name=name + '_conv', padding='same')(x)
-    x = AveragePooling3D(1, strides=(2, 2, 2), name=name + '_pool', padding='same')(x)
+    if filters is None:
+        filters = int(K.int_shape(x)[bn_axis] * reduction)
+    x = conv(filters, 1, use_bias=False,
+             name=name + '_conv', padding='same')(x)
+    x = avg_pool(1, strides=2, name=name + '_pool', padding='same')(x)
     return x
 
 
 # 组合模型
 class DensenetBuilder(object):
     @staticmethod
-    def build(input_shape, num_outputs):
+    def build(input_shape, num_outputs, data_layout='channels',
+              block_type='standard',
+              blocks=DENSENET_DEFAULTS['blocks'],
+              growth_rate=DENSENET_DEFAULTS['growth_rate'],
+              bottleneck=DENSENET_DEFAULTS['bottleneck'],
+              compression=DENSENET_DEFAULTS['compression'],
+              stem_filters=DENSENET_DEFAULTS['stem_filters'],
+              memory_efficient=DENSENET_DEFAULTS['memory_efficient'],
+              layer_widths=None):
         print('original input shape:', input_shape)
         _handle_dim_ordering()
-        if len(input_shape) != 4:
+        conv_dims = 2 if data_layout == '2d' else 3
+        if len(input_shape) != conv_dims + 1:
             raise Exception("Input shape should be a tuple (nb_channels, kernel_dim1, kernel_dim2, kernel_dim3)")
+        if memory_efficient and K.image_data_format() != 'channels_last':
+            raise ValueError('The memory-efficient DenseNet requires the channels_last data format')
+        conv, max_pool, _, global_pool = _get_layers(conv_dims)
 
         print('original input shape:', input_shape)
         # orignal input shape: 1,7,7,200
@@ -275,43 +944,65 @@ class DensenetBuilder(object):
         # print('change input shape:', input_shape)
 
         # 张量流输入
-        input = Input(shape=input_shape)
+        input = Input(shape=input_shape, dtype=_get_input_dtype())
 
         # 3D Convolution and pooling
-        conv1 = Conv3D(64, kernel_size=(3, 3, 3), strides=(1, 1, 1), padding='SAME', kernel_initializer='he_normal')(
-            input)
-        pool1 = MaxPooling3D(pool_size=(3, 3, 3), strides=(2, 2, 2), padding='same')(conv1)
-
-        # Dense Block1
-        x = dense_block(pool1, 6, name='conv1')
-        x = transition_block(x, 0.5, name='pool1')
-        x = dense_block(x, 6, name='conv2')
-        x = transition_block(x, 0.5, name='pool2')
-        x = dense_block(x, 6, name='conv3')
+        spectral_axis = get_spectral_axis(data_layout)
+        conv1 = spectral_spatial_conv(input, stem_filters, kernel_size=3, strides=1, kernel_initializer='he_normal',
+                                      name='stem_conv', conv_dims=conv_dims, block_type=block_type,
+                                      spectral_axis=spectral_axis)
+        x = max_pool(pool_size=3, strides=2, padding='same', name='stem_pool')(conv1)
+
+        # Dense blocks, with a transition block between each stage
+        # (pruned models give the width of each layer by name)
+        if layer_widths is None:
+            layer_widths = {}
+        for stage, stage_blocks in enumerate(blocks):
+            if stage > 0:
+                x = transition_block(x, compression, name=f'pool{stage}',
+                                     conv_dims=conv_dims,
+                                     filters=layer_widths.get(f'pool{stage}'))
+            x = dense_block(x, stage_blocks, name=f'conv{stage+1}',
+                            conv_dims=conv_dims, growth_rate=growth_rate,
+                            bottleneck=bottleneck,
+                            memory_efficient=memory_efficient,
+                            block_type=block_type,
+                            spectral_axis=spectral_axis,
+                            layer_widths=layer_widths)
         print(x.shape)
-        x = GlobalAveragePooling3D(name='avg_pool')(x)
+        x = global_pool(name='avg_pool')(x)
         print(x.shape)
         # x = Dense(16, activation='softmax')(x)
 
         # 输入分类器
         # Classifier block
-        dense = Dense(units=num_outputs, activation="softmax", kernel_initializer="he_normal")(x)
+        # Keep the softmax in float32 for numerical stability under mixed
+        # precision
+        dense = Dense(units=num_outputs, activation="softmax", kernel_initializer="he_normal",
+                      dtype='float32')(x)
 
-        model = Model(inputs=input, outputs=dense, name='3D-DenseNet')
+        model = Model(inputs=input, outputs=dense,
+                      name='2D-DenseNet' if conv_dims == 2 else '3D-DenseNet')
         return model
 
     @staticmethod
-    def build_resnet_8(input_shape, num_outputs):
+    def build_resnet_8(input_shape, num_outputs, data_layout='channels',
+                       block_type='standard', **densenet_config):
         # (1,7,7,200),16
-        return DensenetBuilder.build(input_shape, num_outputs)
+        return DensenetBuilder.build(input_shape, num_outputs, data_layout,
+                                     block_type, **densenet_config)
 
 class CNN3DBuilder(object):
     @staticmethod
-    def build(input_shape, num_outputs):
+    def build(input_shape, num_outputs, data_layout='channels',
+              block_type='standard'):
         print('original input shape:', input_shape)
         _handle_dim_ordering()
-        if len(input_shape) != 4:
+        conv_dims = 2 if data_layout == '2d' else 3
+        if len(input_shape) != conv_dims + 1:
             raise Exception("Input shape should be a tuple (nb_channels, kernel_dim1, kernel_dim2, kernel_dim3)")
+        _, max_pool, _, _ = _get_layers(conv_dims)
+        spectral_axis = get_spectral_axis(data_layout)
 
         print('original input shape:', input_shape)
         # orignal input shape: 1,7,7,200
@@ -320,7 +1011,7 @@ class CNN3DBuilder(object):
         #     input_shape = (input_shape[1], input_shape[2], input_shape[3], input_shape[0])
         # print('change input shape:', input_shape)
 
-        input = Input(shape=input_shape)
+        input = Input(shape=input_shape, dtype=_get_input_dtype())
 
         # conv1 = Conv3D(filters=128, kernel_size=(3, 3, 20), strides=(1, 1, 5),
         #                kernel_regularizer=regularizers.l2(0.01))(input)
@@ -342,19 +1033,24 @@ class CNN3DBuilder(object):
         # fc1 = Dense(200, kernel_regularizer=regularizers.l2(0.01))(flatten1)
         # act3 = Activation('relu')(fc1)
 
-        conv1 = Conv3D(filters=32, kernel_size=(3, 3, 20), strides=(1, 1, 5), padding='same',
-                       kernel_regularizer=regularizers.l2(0.01))(input)
+        # The kernel sizes and strides are (rows, cols, bands) in the
+        # spectral layout; the 2D layout drops the spectral dimension
+        conv1 = spectral_spatial_conv(input, filters=32, kernel_size=(3, 3, 20)[:conv_dims], strides=(1, 1, 5)[:conv_dims],
+                                      conv_dims=conv_dims, block_type=block_type, spectral_axis=spectral_axis,
+                                      kernel_regularizer=regularizers.l2(0.01))
         act1 = Activation('relu')(conv1)
-        pool1 = MaxPooling3D(pool_size=(2, 2, 2), strides=(1, 1, 1), padding='same')(act1)
+        pool1 = max_pool(pool_size=2, strides=1, padding='same')(act1)
 
-        conv2 = Conv3D(filters=64, kernel_size=(2, 2, 3), strides=(1, 1, 2), padding='same',
-                       kernel_regularizer=regularizers.l2(0.01))(pool1)
+        conv2 = spectral_spatial_conv(pool1, filters=64, kernel_size=(2, 2, 3)[:conv_dims], strides=(1, 1, 2)[:conv_dims],
+                                      conv_dims=conv_dims, block_type=block_type, spectral_axis=spectral_axis,
+                                      kernel_regularizer=regularizers.l2(0.01))
         act2 = Activation('relu')(conv2)
         drop1 = Dropout(0.5)(act2)
-        pool2 = MaxPooling3D(pool_size=(2, 2, 2), strides=(1, 1, 1), padding='same')(drop1)
+        pool2 = max_pool(pool_size=2, strides=1, padding='same')(drop1)
 
-        conv3 = Conv3D(filters=128, kernel_size=(3, 3, 3), strides=(1, 1, 2), padding='same',
-                       kernel_regularizer=regularizers.l2(0.01))(pool2)
+        conv3 = spectral_spatial_conv(pool2, filters=128, kernel_size=(3, 3, 3)[:conv_dims], strides=(1, 1, 2)[:conv_dims],
+                                      conv_dims=conv_dims, block_type=block_type, spectral_axis=spectral_axis,
+                                      kernel_regularizer=regularizers.l2(0.01))
         act3 = Activation('relu')(conv3)
         drop2 = Dropout(0.5)(act3)
 
@@ -364,33 +1060,75 @@ class CNN3DBuilder(object):
 
 
         # Classifier block
-        dense = Dense(units=num_outputs, activation="softmax", kernel_initializer="he_normal")(act3)
+        # Keep the softmax in float32 for numerical stability under mixed
+        # precision
+        dense = Dense(units=num_outputs, activation="softmax", kernel_initializer="he_normal",
+                      dtype='float32')(act3)
 
-        model = Model(inputs=input, outputs=dense, name='3D-CNN')
+        model = Model(inputs=input, outputs=dense,
+                      name='2D-CNN' if conv_dims == 2 else '3D-CNN')
         return model
 
     @staticmethod
-    def build_resnet_8(input_shape, num_outputs):
+    def build_resnet_8(input_shape, num_outputs, data_layout='channels',
+                       block_type='standard'):
         # (1,7,7,200),16
-        return CNN3DBuilder.build(input_shape, num_outputs)
+        return CNN3DBuilder.build(input_shape, num_outputs, data_layout,
+                                  block_type)
 
 
-def densenet_model(img_rows, img_cols, img_channels, nb_classes):
+def densenet_model(img_rows, img_cols, img_channels, nb_classes,
+                   data_layout='channels', block_type='standard',
+                   **densenet_config):
+    """
+    Generates a DenseNet model for classifying HSI dataset.
 
+    Parameters
+    ----------
+    img_rows : int
+        Number of rows in neighborhood patch.
+    img_cols : int
+        Number of columns in neighborhood patch.
+    img_channels : int
+        Number of spectral bands.
+    nb_classes : int
+        Number of label categories.
+    data_layout : str, optional
+        Input tensor layout, one of DATA_LAYOUTS
+    block_type : str, optional
+        Convolution building block, one of BLOCK_TYPES
+    **densenet_config : dict
+        DenseNet architecture parameters ('blocks', 'growth_rate',
+        'bottleneck', 'compression', 'stem_filters' and
+        'memory_efficient'), see
+        get_densenet_config. Missing parameters use DENSENET_DEFAULTS.
+        Pruned models also give 'layer_widths', the widths of their
+        building blocks and transition layers by name (see
+        pruning.make_pruning_plan).
+
+    Returns
+    -------
+    model : Model
+        A keras API model of the constructed ML network.
+    """
     model = DensenetBuilder.build_resnet_8(
-        (1, img_rows, img_cols, img_channels), nb_classes)
+        get_input_shape(img_rows, img_cols, img_channels, data_layout),
+        nb_classes, data_layout, block_type, **densenet_config)
 
     return model
 
-def cnn_3d_model(img_rows, img_cols, img_channels, nb_classes):
+def cnn_3d_model(img_rows, img_cols, img_channels, nb_classes,
+                 data_layout='channels', block_type='standard'):
 
     model = CNN3DBuilder.build_resnet_8(
-        (1, img_rows, img_cols, img_channels), nb_classes)
+        get_input_shape(img_rows, img_cols, img_channels, data_layout),
+        nb_classes, data_layout, block_type)
 
     return model
 
 def baseline_cnn_model(img_rows, img_cols, img_channels, 
-                       patch_size, nb_filters, nb_classes):
+                       patch_size, nb_filters, nb_classes,
+                       data_layout='channels'):
     """
     Generates baseline CNN model for classifying HSI dataset.
 
@@ -408,6 +1146,8 @@ def baseline_cnn_model(img_rows, img_cols, img_channels,
         Learning rate for the model
     momentum : float
         Momentum value for optimizer
+    data_layout : str, optional
+        Input tensor layout, one of DATA_LAYOUTS
 
     Returns
     -------
@@ -415,15 +1155,19 @@ def baseline_cnn_model(img_rows, img_cols, img_channels,
         A keras API model of the constructed ML network.
     """
 
-    model_input = Input(shape=(1, img_rows, img_cols, img_channels))
-    conv_layer = Conv3D(nb_filters, (patch_size, patch_size, img_channels), 
-                        strides=(1, 1, 1),name='3d_convolution_layer', padding='same',
-                        kernel_regularizer=regularizers.l2(0.01))(model_input)
+    conv_dims = 2 if data_layout == '2d' else 3
+    conv, max_pool, _, _ = _get_layers(conv_dims)
+
+    model_input = Input(shape=get_input_shape(img_rows, img_cols, img_channels, data_layout),
+                        dtype=_get_input_dtype())
+    conv_layer = conv(nb_filters, (patch_size, patch_size, img_channels)[:conv_dims], 
+                      strides=1, name=f'{conv_dims}d_convolution_layer', padding='same',
+                      kernel_regularizer=regularizers.l2(0.01))(model_input)
     activation_layer = Activation('relu', name='activation_layer')(conv_layer)
-    max_pool_layer = MaxPooling3D(pool_size=(2, 2, 2), name='3d_max_pooling_layer', padding='same')(activation_layer)
+    max_pool_layer = max_pool(pool_size=2, name=f'{conv_dims}d_max_pooling_layer', padding='same')(activation_layer)
     flatten_layer = Flatten(name='flatten_layer')(max_pool_layer)
-    dense_layer = Dense(units=nb_classes, name='dense_layer')(flatten_layer)
-    classifier_layer = Activation('softmax', name='classifier_layer')(dense_layer)
+    dense_layer = Dense(units=nb_classes, name='dense_layer', dtype='float32')(flatten_layer)
+    classifier_layer = Activation('softmax', name='classifier_layer', dtype='float32')(dense_layer)
 
     model = Model(model_input, classifier_layer, name='baseline_cnn_model')
 
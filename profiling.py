@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Profiling module
+
+This script defines profiling helpers used by the test harness to find
+where experiment time and memory are spent.
+
+Author:  Christopher Good
+Version: 1.0.0
+
+Usage: profiling.py
+
+"""
+# See following link for proper docstring documentation
+# https://pandas.pydata.org/docs/development/contributing_docstring.html
+
+### Futures ###
+#TODO
+
+### Built-in Imports ###
+from contextlib import contextmanager
+import cProfile
+import os
+import pstats
+import tracemalloc
+
+### Constants ###
+
+# Phases of an experiment that can be wrapped with cProfile
+PROFILE_PHASES = ('dataset', 'model', 'train', 'evaluate')
+
+# Number of entries written to the human readable profile summaries
+PROFILE_SUMMARY_LINES = 40
+
+### Definitions ###
+
+def parse_profile_phases(phases):
+    """
+    Parses a comma separated list of profile phases.
+
+    Parameters
+    ----------
+    phases : str or None
+        Comma separated phase names, or None for all phases
+
+    Returns
+    -------
+    list of str
+        The phase names to profile
+    """
+    if phases is None:
+        return list(PROFILE_PHASES)
+
+    phase_list = [phase.strip() for phase in phases.split(',') if phase.strip()]
+    for phase in phase_list:
+        if phase not in PROFILE_PHASES:
+            raise ValueError(f"Unknown profile phase '{phase}'! "
+                             f"Valid phases are: {', '.join(PROFILE_PHASES)}")
+    return phase_list
+
+def parse_profile_steps(steps):
+    """
+    Parses a 'start,stop' training step window for the Tensorflow
+    profiler.
+
+    Parameters
+    ----------
+    steps : str or None
+        Comma separated start and stop training steps, or None
+
+    Returns
+    -------
+    tuple of int or None
+        The (start, stop) step window, or None if not specified
+    """
+    if steps is None:
+        return None
+
+    start, stop = (int(step) for step in steps.split(','))
+    if start < 0 or stop <= start:
+        raise ValueError("'profile_tf_steps' must be 'start,stop' with "
+                         "0 <= start < stop")
+    return start, stop
+
+def get_profile_path(output_path, iteration, name):
+    """Returns the path of a profiling output file for an experiment."""
+    profile_dir = os.path.join(output_path, 'profiles')
+    os.makedirs(profile_dir, exist_ok=True)
+    return os.path.join(profile_dir, f'experiment_{iteration+1}_{name}')
+
+@contextmanager
+def profile_phase(phase, enabled, output_path, iteration):
+    """
+    Context manager that profiles the wrapped code with cProfile and
+    dumps the statistics to a .pstats file.
+
+    Parameters
+    ----------
+    phase : str
+        Name of the experiment phase being profiled
+    enabled : bool
+        Whether profiling is enabled for this phase
+    output_path : str
+        Path to where the profiling files should be created
+    iteration : int
+        Experiment iteration number
+    """
+    if not enabled:
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        stats_path = get_profile_path(output_path, iteration, f'{phase}.pstats')
+        profiler.dump_stats(stats_path)
+
+        # Save a readable summary next to the raw statistics
+        with open(stats_path.replace('.pstats', '_summary.txt'), 'w') as sf:
+            stats = pstats.Stats(profiler, stream=sf)
+            stats.sort_stats('cumulative').print_stats(PROFILE_SUMMARY_LINES)
+
+        print(f'  >>> {phase} profile saved to {stats_path}')
+
+@contextmanager
+def trace_memory(phase, enabled, output_path, iteration, frames=25):
+    """
+    Context manager that traces Python memory allocations in the
+    wrapped code with tracemalloc and dumps a snapshot to file.
+
+    Parameters
+    ----------
+    phase : str
+        Name of the experiment phase being traced
+    enabled : bool
+        Whether memory tracing is enabled
+    output_path : str
+        Path to where the snapshot files should be created
+    iteration : int
+        Experiment iteration number
+    frames : int, optional
+        Number of stack frames stored per allocation traceback
+    """
+    if not enabled:
+        yield
+        return
+
+    tracemalloc.start(frames)
+    try:
+        yield
+    finally:
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        snapshot_path = get_profile_path(output_path, iteration,
+                                         f'{phase}.tracemalloc')
+        snapshot.dump(snapshot_path)
+
+        # Save a readable summary of the largest allocations
+        with open(snapshot_path + '_summary.txt', 'w') as sf:
+            sf.write(f'Current traced memory: {current / (1024 * 1024):.2f} MB\n')
+            sf.write(f'Peak traced memory:    {peak / (1024 * 1024):.2f} MB\n')
+            sf.write('\n')
+            for stat in snapshot.statistics('lineno')[:PROFILE_SUMMARY_LINES]:
+                sf.write(f'{stat}\n')
+
+        print(f'  >>> {phase} memory snapshot saved to {snapshot_path}')
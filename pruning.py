@@ -0,0 +1,618 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""DenseNet structured pruning module
+
+This script prunes trained DenseNet models built by DensenetBuilder.
+It ranks the filters of each dense layer (conv_block) and the dense
+layers of each dense block by batch normalization scale (gamma) or
+kernel magnitude, physically removes the lowest ranked ones by
+rebuilding a smaller model with the surviving weights, fine-tunes the
+pruned model and reports its accuracy against its measured CPU latency
+at each sparsity level.
+
+The model architecture and dataset are given with the same command-line
+flags as the test harness, and the trained checkpoint with --restore.
+
+Author:  Christopher Good
+Version: 1.0.0
+
+Usage: python pruning.py --restore CHECKPOINT [test harness flags]
+                         [--sparsities 0.25 0.5 0.75] [--criterion bn_gamma]
+       python pruning.py --check [--criterion bn_gamma]
+
+"""
+# See following link for proper docstring documentation
+# https://pandas.pydata.org/docs/development/contributing_docstring.html
+
+### Futures ###
+#TODO
+
+### Built-in Imports ###
+import json
+import os
+
+### Other Library Imports ###
+import numpy as np
+import pandas as pd
+from sklearn import metrics
+from tensorflow.keras.layers import BatchNormalization
+
+### Local Imports ###
+from model_profiler import (
+    count_flops,
+    measure_latency,
+)
+from models import (
+    DENSENET_DEFAULTS,
+    densenet_model,
+    get_densenet_config,
+    get_input_shape,
+    get_optimizer,
+)
+from test_harness import (
+    create_model,
+    load_experiment_datasets,
+    test_harness_parser,
+)
+from utilities import write_csv_atomic
+
+### Constants ###
+
+# Filter ranking criteria:
+#   'bn_gamma' - magnitude of the batch normalization scale applied to
+#                each filter's output (network slimming)
+#   'l1'       - L1 norm of each filter's kernel
+PRUNING_CRITERIA = ('bn_gamma', 'l1')
+
+### Definitions ###
+
+def _filter_l1(layer):
+    """Returns the L1 norm of each output filter of a convolution."""
+    kernel = layer.get_weights()[0]
+    return np.abs(kernel).reshape(-1, kernel.shape[-1]).sum(axis=0)
+
+def _keep_count(num_filters, sparsity):
+    """Returns the number of filters left after pruning a fraction."""
+    return max(int(round(num_filters * (1.0 - sparsity))), 1)
+
+def _top_indices(scores, count):
+    """Returns the sorted indices of the highest scores."""
+    return np.sort(np.argsort(scores)[::-1][:count])
+
+def _get_dense_layer_names(densenet_config):
+    """
+    Returns the building block names of each dense block, e.g.
+    [['conv1_block1', ...], ['conv2_block1', ...]].
+    """
+    return [[f'conv{stage+1}_block{i+1}' for i in range(stage_blocks)]
+            for stage, stage_blocks in enumerate(densenet_config['blocks'])]
+
+def _get_first_bn(model, block_name, bottleneck):
+    """Returns the batch normalization at the input of a building block."""
+    return model.get_layer(block_name + ('_0_bn' if bottleneck else '_1_bn'))
+
+def check_prunable(densenet_config, block_type='standard'):
+    """
+    Raises a ValueError if a DenseNet configuration cannot be pruned.
+
+    Only standard convolution blocks of the DenseNet that stores its
+    concatenations are supported, since factorized and separable blocks
+    and the memory-efficient layers do not have a single convolution
+    per filter.
+    """
+    if block_type != 'standard':
+        raise ValueError("Only DenseNets of 'standard' blocks can be pruned")
+    if densenet_config['memory_efficient']:
+        raise ValueError('The memory-efficient DenseNet cannot be pruned')
+
+def score_growth_filters(model, densenet_config, criterion):
+    """
+    Scores the output (growth) filters of every building block.
+
+    With the 'bn_gamma' criterion, the score of a filter is the mean
+    magnitude of the batch normalization scales its output channel gets
+    in every later building block and transition of its dense block.
+    The last building block of the network has no later normalization,
+    so its filters are scored by L1 norm.
+
+    Returns
+    -------
+    dict
+        Filter scores of each building block by name
+    """
+    bottleneck = densenet_config['bottleneck']
+    stage_layers = _get_dense_layer_names(densenet_config)
+
+    scores = {}
+    for stage, layer_names in enumerate(stage_layers):
+        # Channel offset of each block's output in the block's concatenation
+        offset = _get_first_bn(model, layer_names[0], bottleneck).input_shape[-1]
+
+        for i, name in enumerate(layer_names):
+            conv = model.get_layer(name + '_2_conv')
+            growth = conv.filters
+            channels = slice(offset, offset + growth)
+            offset += growth
+
+            later_bns = [_get_first_bn(model, later_name, bottleneck)
+                         for later_name in layer_names[i+1:]]
+            if stage + 1 < len(stage_layers):
+                later_bns.append(model.get_layer(f'pool{stage+1}_bn'))
+
+            if criterion == 'bn_gamma' and later_bns:
+                scores[name] = np.mean([np.abs(bn.gamma.numpy()[channels])
+                                        for bn in later_bns], axis=0)
+            else:
+                scores[name] = _filter_l1(conv)
+    return scores
+
+def score_bottleneck_filters(model, densenet_config, criterion):
+    """
+    Scores the bottleneck filters of every building block, by the
+    magnitude of the scale of the batch normalization that follows them
+    ('bn_gamma') or by L1 norm ('l1').
+
+    Returns
+    -------
+    dict
+        Filter scores of each building block by name (empty without
+        bottleneck layers)
+    """
+    if not densenet_config['bottleneck']:
+        return {}
+
+    scores = {}
+    for layer_names in _get_dense_layer_names(densenet_config):
+        for name in layer_names:
+            if criterion == 'bn_gamma':
+                scores[name] = np.abs(model.get_layer(name + '_1_bn').gamma.numpy())
+            else:
+                scores[name] = _filter_l1(model.get_layer(name + '_1_conv'))
+    return scores
+
+def make_pruning_plan(model, densenet_config, sparsity, layer_sparsity=0.0,
+                      criterion='bn_gamma'):
+    """
+    Chooses the dense layers and filters of a DenseNet to keep.
+
+    Parameters
+    ----------
+    model : tf.keras.Model
+        Trained DenseNet built by DensenetBuilder
+    densenet_config : dict
+        The model's DenseNet architecture parameters (see
+        get_densenet_config)
+    sparsity : float
+        Fraction of the bottleneck and growth filters of each building
+        block to remove
+    layer_sparsity : float, optional
+        Fraction of the building blocks of each dense block to remove.
+        Blocks are ranked by the mean score of their growth filters,
+        and every dense block keeps at least one building block.
+    criterion : str, optional
+        One of PRUNING_CRITERIA
+
+    Returns
+    -------
+    dict
+        'layer_widths', the (bottleneck filters, growth filters) of each
+        building block and the filters of each transition by name (for
+        DensenetBuilder.build), and 'keep', the indices of the kept
+        output filters of each pruned convolution by layer name
+    """
+    if criterion not in PRUNING_CRITERIA:
+        raise ValueError(f"Unknown pruning criterion '{criterion}'! "
+                         f"Valid criteria are: {', '.join(PRUNING_CRITERIA)}")
+
+    bottleneck = densenet_config['bottleneck']
+    growth_scores = score_growth_filters(model, densenet_config, criterion)
+    bottleneck_scores = score_bottleneck_filters(model, densenet_config, criterion)
+
+    layer_widths = {}
+    keep = {}
+    for stage, layer_names in enumerate(_get_dense_layer_names(densenet_config)):
+        # Rank the building blocks of the dense block. The last block of
+        # the network is scored by another criterion, so it is kept.
+        num_removed = len(layer_names) - _keep_count(len(layer_names), layer_sparsity)
+        layer_scores = {name: growth_scores[name].mean() for name in layer_names}
+        if criterion == 'bn_gamma' and stage + 1 == len(densenet_config['blocks']):
+            layer_scores[layer_names[-1]] = np.inf
+        removed = set(sorted(layer_names, key=layer_scores.get)[:num_removed])
+
+        for name in layer_names:
+            if name in removed:
+                layer_widths[name] = (None, 0)
+                continue
+
+            growth_keep = _top_indices(growth_scores[name],
+                _keep_count(len(growth_scores[name]), sparsity))
+            keep[name + '_2_conv'] = growth_keep
+
+            bottleneck_filters = None
+            if bottleneck:
+                bottleneck_keep = _top_indices(bottleneck_scores[name],
+                    _keep_count(len(bottleneck_scores[name]), sparsity))
+                keep[name + '_1_conv'] = bottleneck_keep
+                bottleneck_filters = len(bottleneck_keep)
+
+            layer_widths[name] = (bottleneck_filters, len(growth_keep))
+
+        # Transition layers keep their width, so later stages are only
+        # pruned by their own building blocks
+        if stage > 0:
+            layer_widths[f'pool{stage}'] = model.get_layer(f'pool{stage}_conv').filters
+
+    return {'layer_widths': layer_widths, 'keep': keep}
+
+def _copy_conv(source, target, in_channels=None, out_channels=None):
+    """Copies a convolution's weights for a subset of its channels."""
+    weights = source.get_weights()
+    kernel = weights[0]
+    if in_channels is not None:
+        kernel = kernel[..., in_channels, :]
+    if out_channels is not None:
+        kernel = kernel[..., out_channels]
+    new_weights = [kernel]
+    if len(weights) > 1:
+        bias = weights[1]
+        new_weights.append(bias if out_channels is None else bias[out_channels])
+    target.set_weights(new_weights)
+
+def _copy_bn(source, target, channels):
+    """Copies a batch normalization's weights for a subset of channels."""
+    target.set_weights([weight[channels] for weight in source.get_weights()])
+
+def transfer_weights(model, pruned_model, densenet_config, plan):
+    """
+    Copies the surviving weights of a DenseNet into its pruned model.
+
+    The channels of each concatenation are tracked as indices into the
+    original model's concatenation, so every layer gets the weights of
+    the input and output channels it kept.
+
+    Parameters
+    ----------
+    model : tf.keras.Model
+        The original DenseNet
+    pruned_model : tf.keras.Model
+        The DenseNet rebuilt with the plan's layer widths
+    densenet_config : dict
+        The original model's DenseNet architecture parameters
+    plan : dict
+        Pruning plan from make_pruning_plan
+    """
+    bottleneck = densenet_config['bottleneck']
+    keep = plan['keep']
+    layer_widths = plan['layer_widths']
+
+    pruned_model.get_layer('stem_conv').set_weights(
+        model.get_layer('stem_conv').get_weights())
+
+    # Original channel indices of the kept channels of the current
+    # feature map, and its original number of channels
+    num_channels = model.get_layer('stem_conv').filters
+    kept = np.arange(num_channels)
+
+    for stage, layer_names in enumerate(_get_dense_layer_names(densenet_config)):
+        if stage > 0:
+            name = f'pool{stage}'
+            _copy_bn(model.get_layer(name + '_bn'),
+                     pruned_model.get_layer(name + '_bn'), kept)
+            _copy_conv(model.get_layer(name + '_conv'),
+                       pruned_model.get_layer(name + '_conv'), in_channels=kept)
+            num_channels = model.get_layer(name + '_conv').filters
+            kept = np.arange(num_channels)
+
+        for name in layer_names:
+            growth = model.get_layer(name + '_2_conv').filters
+            if layer_widths[name][1] == 0:
+                num_channels += growth
+                continue
+
+            conv_inputs = kept
+            if bottleneck:
+                _copy_bn(model.get_layer(name + '_0_bn'),
+                         pruned_model.get_layer(name + '_0_bn'), kept)
+                _copy_conv(model.get_layer(name + '_1_conv'),
+                           pruned_model.get_layer(name + '_1_conv'),
+                           in_channels=kept, out_channels=keep[name + '_1_conv'])
+                conv_inputs = keep[name + '_1_conv']
+            _copy_bn(model.get_layer(name + '_1_bn'),
+                     pruned_model.get_layer(name + '_1_bn'), conv_inputs)
+            _copy_conv(model.get_layer(name + '_2_conv'),
+                       pruned_model.get_layer(name + '_2_conv'),
+                       in_channels=conv_inputs, out_channels=keep[name + '_2_conv'])
+
+            kept = np.concatenate([kept, num_channels + keep[name + '_2_conv']])
+            num_channels += growth
+
+    # The classifier follows global average pooling, so its inputs are
+    # the kept channels of the last feature map
+    _copy_conv(model.layers[-1], pruned_model.layers[-1], in_channels=kept)
+
+def prune_densenet(model, densenet_config, plan, data_layout='channels'):
+    """
+    Builds the pruned DenseNet of a pruning plan with the surviving
+    weights of the original model.
+
+    Parameters
+    ----------
+    model : tf.keras.Model
+        The original DenseNet
+    densenet_config : dict
+        The original model's DenseNet architecture parameters
+    plan : dict
+        Pruning plan from make_pruning_plan
+    data_layout : str, optional
+        The model's input tensor layout
+
+    Returns
+    -------
+    tf.keras.Model
+        The pruned DenseNet
+    """
+    img_rows, img_cols, img_channels = _get_patch_shape(model, data_layout)
+    pruned_model = densenet_model(img_rows, img_cols, img_channels,
+                                  model.output_shape[-1],
+                                  data_layout=data_layout,
+                                  layer_widths=plan['layer_widths'],
+                                  **densenet_config)
+    check_layer_widths(pruned_model, densenet_config, plan['layer_widths'])
+    transfer_weights(model, pruned_model, densenet_config, plan)
+    return pruned_model
+
+def check_layer_widths(pruned_model, densenet_config, layer_widths):
+    """
+    Raises a ValueError if the layers of a pruned DenseNet do not have
+    the widths of its pruning plan.
+
+    Parameters
+    ----------
+    pruned_model : tf.keras.Model
+        The pruned DenseNet
+    densenet_config : dict
+        The original model's DenseNet architecture parameters
+    layer_widths : dict
+        The plan's widths of each building block and transition by name
+    """
+    layer_names = {layer.name for layer in pruned_model.layers}
+    for name, widths in layer_widths.items():
+        if name.startswith('pool'):
+            expected = {name + '_conv': widths}
+        elif widths[1] == 0:
+            if name + '_2_conv' in layer_names:
+                raise ValueError(f'Pruned building block {name} is in the model')
+            continue
+        else:
+            expected = {name + '_2_conv': widths[1]}
+            if densenet_config['bottleneck']:
+                expected[name + '_1_conv'] = widths[0]
+
+        for layer_name, filters in expected.items():
+            actual = pruned_model.get_layer(layer_name).filters
+            if actual != filters:
+                raise ValueError(f'{layer_name} has {actual} filters, but the '
+                                 f'pruning plan gives it {filters}')
+
+def check_pruning(criterion='bn_gamma', seed=0):
+    """
+    Checks pruning on small DenseNets with random weights, with and
+    without bottleneck layers: a plan that prunes nothing must rebuild
+    a model with the same outputs, and the layers of a pruned model
+    must have the widths of its plan.
+
+    Parameters
+    ----------
+    criterion : str, optional
+        One of PRUNING_CRITERIA
+    seed : int, optional
+        Seed of the random weights and inputs
+
+    Raises
+    ------
+    ValueError
+        If a check fails
+    """
+    rng = np.random.default_rng(seed)
+    img_rows, img_cols, img_channels, num_classes = 5, 5, 8, 3
+    inputs = rng.normal(size=(16,) + get_input_shape(img_rows, img_cols,
+                                                      img_channels)).astype('float32')
+
+    for bottleneck in (True, False):
+        densenet_config = dict(DENSENET_DEFAULTS, blocks=(2, 2), growth_rate=4,
+                               bottleneck=bottleneck, stem_filters=8)
+        model = densenet_model(img_rows, img_cols, img_channels, num_classes,
+                               **densenet_config)
+
+        # Random normalization statistics, so that copying the wrong
+        # channels changes the outputs
+        for layer in model.layers:
+            if isinstance(layer, BatchNormalization):
+                gamma, beta, mean, variance = layer.get_weights()
+                layer.set_weights([rng.uniform(0.5, 1.5, gamma.shape),
+                                   rng.normal(size=beta.shape),
+                                   rng.normal(size=mean.shape),
+                                   rng.uniform(0.5, 1.5, variance.shape)])
+
+        plan = make_pruning_plan(model, densenet_config, 0.0, criterion=criterion)
+        pruned_model = prune_densenet(model, densenet_config, plan)
+        error = np.abs(model.predict(inputs) - pruned_model.predict(inputs)).max()
+        if error > 1e-5:
+            raise ValueError(f'Pruning nothing changed the outputs by {error} '
+                             f'(bottleneck={bottleneck})')
+
+        plan = make_pruning_plan(model, densenet_config, 0.5, layer_sparsity=0.5,
+                                 criterion=criterion)
+        pruned_model = prune_densenet(model, densenet_config, plan)
+        check_layer_widths(pruned_model, densenet_config, plan['layer_widths'])
+        print(f'  >>> Pruning checks passed (bottleneck={bottleneck})')
+
+def _get_patch_shape(model, data_layout):
+    """Returns the (rows, columns, bands) of a model's input patches."""
+    input_shape = model.input_shape[1:]
+    if data_layout == 'channels':
+        return input_shape[1], input_shape[2], input_shape[3]
+    return input_shape[0], input_shape[1], input_shape[2]
+
+def evaluate_accuracy(model, dataset):
+    """Returns the overall accuracy and Cohen's kappa of a model."""
+    pred = model.predict(dataset).argmax(axis=1)
+    target = np.asarray(dataset.labels)
+    return (metrics.accuracy_score(target, pred),
+            metrics.cohen_kappa_score(target, pred))
+
+def pruning_parser():
+    """
+    Sets up the parser for command-line flags for the pruning workflow.
+
+    The pruning workflow takes the test harness flags, which describe
+    the model, dataset and fine-tuning optimizer, and the pruning
+    options.
+
+    Returns
+    -------
+    argparse.ArgumentParser
+        An ArgumentParser object configured with the pruning.py
+        command-line arguments.
+    """
+    parser = test_harness_parser()
+
+    group_pruning = parser.add_argument_group("Pruning")
+    group_pruning.add_argument(
+        '--sparsities',
+        type=float,
+        nargs='+',
+        default=[0.25, 0.5, 0.75],
+        help='Fractions of the filters of each dense layer to prune, one '
+             'pruned model per value (default = 0.25 0.5 0.75)'
+    )
+    group_pruning.add_argument(
+        '--layer_sparsity',
+        type=float,
+        default=0.0,
+        help='Fraction of the dense layers of each dense block to prune '
+             'at every sparsity level (default = 0.0)'
+    )
+    group_pruning.add_argument(
+        '--criterion',
+        type=str,
+        choices=PRUNING_CRITERIA,
+        default='bn_gamma',
+        help='Filter ranking criterion (default = bn_gamma)'
+    )
+    group_pruning.add_argument(
+        '--finetune_epochs',
+        type=int,
+        default=5,
+        help='Epochs of fine-tuning after pruning (default = 5)'
+    )
+    group_pruning.add_argument(
+        '--experiment_number',
+        type=int,
+        default=1,
+        help='Experiment the checkpoint was trained in, used to reproduce '
+             'its data split (default = 1)'
+    )
+    group_pruning.add_argument(
+        '--check',
+        action='store_true',
+        help='Check pruning on small DenseNets with random weights, '
+             'instead of pruning a checkpoint'
+    )
+    return parser
+
+
+### Main ###
+
+if __name__ == "__main__":
+    parser = pruning_parser()
+    args = parser.parse_args()
+    hyperparams = vars(args)
+
+    if hyperparams['check']:
+        print('< Checking pruning >')
+        check_pruning(criterion=hyperparams['criterion'])
+        parser.exit()
+
+    if hyperparams['restore'] is None:
+        parser.error('--restore must give the checkpoint to prune')
+    hyperparams['model_id'] = '3d-densenet'
+
+    output_path = hyperparams['output_path']
+    os.makedirs(output_path, exist_ok=True)
+    data_layout = hyperparams.get('data_layout') or 'channels'
+    densenet_config = get_densenet_config(**hyperparams)
+    check_prunable(densenet_config, hyperparams.get('block_type', 'standard'))
+
+    print('-------------------------------------------------------------------')
+    print('LOADING DATASET...')
+    print('-------------------------------------------------------------------')
+    train_dataset, val_dataset, test_dataset, dataset_info, num_bands = \
+        load_experiment_datasets(hyperparams, hyperparams['experiment_number'])
+
+    print('-------------------------------------------------------------------')
+    print('LOADING MODEL...')
+    print('-------------------------------------------------------------------')
+    patch_size = hyperparams['patch_size']
+    model = create_model(patch_size, patch_size, num_bands,
+                         dataset_info['num_classes'], **hyperparams)
+    model.load_weights(hyperparams['restore'])
+    print(f'< Loaded {model.name} weights from {hyperparams["restore"]} >')
+
+    def report_row(pruned_model, sparsity, layer_sparsity):
+        """Measures the accuracy and cost of a (pruned) model."""
+        overall_acc, kappa = evaluate_accuracy(pruned_model, test_dataset)
+        latency = measure_latency(pruned_model, batch_size=1)
+        return {
+            'sparsity': sparsity,
+            'layer_sparsity': layer_sparsity,
+            'params': pruned_model.count_params(),
+            'flops': count_flops(pruned_model),
+            'cpu_latency_ms': latency['median'],
+            'overall_accuracy': overall_acc,
+            'cohen_kappa_score': kappa,
+        }
+
+    rows = [report_row(model, 0.0, 0.0)]
+    layer_sparsity = hyperparams['layer_sparsity']
+
+    for sparsity in hyperparams['sparsities']:
+        print('-------------------------------------------------------------------')
+        print(f'PRUNING {sparsity:.0%} OF FILTERS, {layer_sparsity:.0%} OF LAYERS')
+        print('-------------------------------------------------------------------')
+        plan = make_pruning_plan(model, densenet_config, sparsity,
+                                 layer_sparsity=layer_sparsity,
+                                 criterion=hyperparams['criterion'])
+        pruned_model = prune_densenet(model, densenet_config, plan, data_layout)
+
+        pruned_model.compile(loss='sparse_categorical_crossentropy',
+                             optimizer=get_optimizer(**hyperparams),
+                             metrics=['sparse_categorical_accuracy'])
+        if hyperparams['finetune_epochs'] > 0:
+            pruned_model.fit(train_dataset,
+                             validation_data=val_dataset,
+                             epochs=hyperparams['finetune_epochs'])
+
+        row = report_row(pruned_model, sparsity, layer_sparsity)
+        rows.append(row)
+        print(f'< Params: {row["params"]}, FLOPs: {row["flops"]}, '
+              f'CPU latency (ms): {row["cpu_latency_ms"]:.3f}, '
+              f'overall accuracy: {row["overall_accuracy"]:.4f} >')
+
+        # Save the pruned model and its layer widths, which rebuild it
+        # with densenet_model(..., layer_widths=...)
+        prefix = os.path.join(output_path,
+                              f'{model.name}_pruned_{int(sparsity * 100)}')
+        pruned_model.save(prefix + '.hdf5')
+        with open(prefix + '_layer_widths.json', 'w') as jf:
+            json.dump(plan['layer_widths'], jf, indent=4)
+
+    report = pd.DataFrame(rows)
+    report_path = os.path.join(output_path, f'{model.name}_pruning_report.csv')
+    write_csv_atomic(report, report_path)
+
+    print('-------------------------------------------------------------------')
+    print(report.to_string(index=False))
+    print('-------------------------------------------------------------------')
+    print(f'< Report written to {report_path} >')
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Pseudo-labelling module
+
+This script defines the semi-supervised pseudo-labelling rounds of the
+test harness. After a model is trained on the labelled pixels, it
+predicts every unlabelled pixel of the scene in streamed batches, keeps
+its confident predictions as compact (index, label, confidence) arrays,
+and merges them into a pseudo ground truth that the next round's
+training dataset (and class-balanced sampler) draws from. Only one batch
+of unlabelled patches is in memory at a time.
+
+Author:  Christopher Good
+Version: 1.0.0
+
+Usage: pseudo_labelling.py
+
+"""
+# See following link for proper docstring documentation
+# https://pandas.pydata.org/docs/development/contributing_docstring.html
+
+### Futures ###
+#TODO
+
+### Built-in Imports ###
+#TODO
+
+### Other Library Imports ###
+import numpy as np
+import tensorflow as tf
+
+### Local Imports ###
+from datasets import (
+    extract_patch_batch,
+    layout_patch_batch,
+)
+
+### Constants ###
+
+# Number of image rows whose unlabelled pixels are gathered at a time
+STREAM_CHUNK_ROWS = 64
+
+### Definitions ###
+
+def get_unlabelled_mask(gts, ignored_labels):
+    """
+    Returns the mask of the pixels without a label in any of a set of
+    ground truths (e.g. the training, validation and testing splits), so
+    pixels held out for evaluation are never pseudo-labelled.
+    """
+    labelled = np.zeros(gts[0].shape, dtype=bool)
+    for gt in gts:
+        labelled |= ~np.isin(gt, list(ignored_labels))
+    return ~labelled
+
+def stream_unlabelled_batches(data, unlabelled_mask, patch_size, batch_size,
+                              chunk_rows=STREAM_CHUNK_ROWS):
+    """
+    Yields the unlabelled pixels of an image and their patches in
+    batches, gathering the pixels a block of rows at a time.
+
+    Parameters
+    ----------
+    data : np.ndarray
+        (rows, cols, bands) image, padded like the harness datasets
+    unlabelled_mask : np.ndarray
+        (rows, cols) mask of the unlabelled pixels
+    patch_size : int
+        Size of the patches
+    batch_size : int
+        Number of patches per batch
+    chunk_rows : int, optional
+        Number of image rows whose pixels are gathered at a time
+
+    Yields
+    ------
+    indices : np.ndarray
+        (batch, 2) int32 array of the (row, column) of each pixel
+    patches : np.ndarray
+        (batch, patch_size, patch_size, bands) raw patches of the pixels
+    """
+    # Same patch bounds as HyperspectralDataset
+    half = patch_size // 2
+    rows, cols = unlabelled_mask.shape
+    row_start, row_stop = half + 1, rows - half
+    col_start, col_stop = half + 1, cols - half
+
+    for chunk_start in range(row_start, row_stop, chunk_rows):
+        chunk_stop = min(chunk_start + chunk_rows, row_stop)
+        chunk = unlabelled_mask[chunk_start:chunk_stop, col_start:col_stop]
+        indices = np.argwhere(chunk).astype(np.int32)
+        indices += np.array([chunk_start, col_start], dtype=np.int32)
+
+        for batch_start in range(0, len(indices), batch_size):
+            batch_indices = indices[batch_start:batch_start + batch_size]
+            yield batch_indices, extract_patch_batch(data, batch_indices, patch_size)
+
+def predict_pseudo_labels(model, data, unlabelled_mask, patch_size, ignored_labels,
+                          threshold=0.95, batch_size=256, data_layout='channels',
+                          input_dtype='float32'):
+    """
+    Predicts the unlabelled pixels of an image and keeps the confident
+    predictions.
+
+    Parameters
+    ----------
+    model : tf.keras.Model
+        The trained model, with a softmax output over the labels
+    data : np.ndarray
+        (rows, cols, bands) image, padded like the harness datasets
+    unlabelled_mask : np.ndarray
+        (rows, cols) mask of the pixels to predict
+    patch_size : int
+        Size of the model's input patches
+    ignored_labels : iterable of int
+        Labels that are never predicted
+    threshold : float, optional
+        Smallest confidence of a kept prediction
+    batch_size : int, optional
+        Number of pixels predicted at a time
+    data_layout : str, optional
+        Data layout of the model's input (see models.DATA_LAYOUTS)
+    input_dtype : str, optional
+        Dtype of the model's input
+
+    Returns
+    -------
+    indices : np.ndarray
+        (N, 2) int32 array of the (row, column) of each kept pixel
+    labels : np.ndarray
+        (N,) uint8 (or int32, for many classes) predicted labels
+    confidences : np.ndarray
+        (N,) float16 confidence of each prediction
+    """
+    @tf.function(experimental_relax_shapes=True)
+    def predict_step(patches):
+        patches = layout_patch_batch(patches, patch_size, data_layout)
+        return model(tf.cast(patches, input_dtype), training=False)
+
+    # Ignored labels (e.g. undefined) are never predicted
+    num_outputs = model.output_shape[-1]
+    allowed = np.ones(num_outputs, dtype=np.float32)
+    allowed[[label for label in ignored_labels if label < num_outputs]] = 0.0
+    label_dtype = np.uint8 if num_outputs <= 256 else np.int32
+
+    kept_indices, kept_labels, kept_confidences = [], [], []
+    num_predicted = 0
+    for batch_indices, patches in stream_unlabelled_batches(
+            data, unlabelled_mask, patch_size, batch_size):
+        probabilities = predict_step(tf.convert_to_tensor(patches, tf.float32))
+        probabilities = probabilities.numpy().astype(np.float32) * allowed
+        labels = probabilities.argmax(axis=1)
+        confidences = probabilities[np.arange(len(labels)), labels]
+
+        keep = confidences >= threshold
+        kept_indices.append(batch_indices[keep])
+        kept_labels.append(labels[keep].astype(label_dtype))
+        kept_confidences.append(confidences[keep].astype(np.float16))
+        num_predicted += len(batch_indices)
+
+    if not kept_indices:
+        return (np.empty((0, 2), dtype=np.int32), np.empty(0, dtype=label_dtype),
+                np.empty(0, dtype=np.float16))
+
+    indices = np.concatenate(kept_indices)
+    print(f'< Kept {len(indices)} of {num_predicted} unlabelled pixels with '
+          f'confidence >= {threshold} >')
+    return indices, np.concatenate(kept_labels), np.concatenate(kept_confidences)
+
+def limit_per_class(indices, labels, confidences, max_per_class):
+    """
+    Keeps at most the `max_per_class` most confident pseudo-labels of each
+    class, so the classes that dominate the scene do not dominate the
+    pseudo-labels.
+    """
+    order = np.lexsort((-confidences.astype(np.float32), labels))
+    sorted_labels = labels[order]
+    class_starts = np.searchsorted(sorted_labels, sorted_labels, side='left')
+    rank = np.arange(len(order)) - class_starts
+    keep = np.sort(order[rank < max_per_class])
+    return indices[keep], labels[keep], confidences[keep]
+
+def make_pseudo_gt(gt, indices, labels):
+    """
+    Returns a copy of a ground truth with the pseudo-labels written to
+    its pixels.
+    """
+    pseudo_gt = gt.copy()
+    pseudo_gt[indices[:, 0], indices[:, 1]] = labels
+    return pseudo_gt
@@ -0,0 +1,347 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Results store module
+
+This script defines the results store of the test harness, an
+append-only SQLite database with one row per finished experiment (and
+one row of per-class accuracies per successful experiment), along with
+the run metadata of each experiment: its configuration hash, the git
+revision of the harness, the device and its timings. Recording an
+experiment is a single insert, however large the sweep, and the results
+CSV files are regenerated from the database on export, so earlier
+results are never overwritten.
+
+Author:  Christopher Good
+Version: 1.0.0
+
+Usage: results_store.py [-h] [--sweep SWEEP] [--output_path OUTPUT_PATH]
+                        [--prefix PREFIX] database
+
+"""
+# See following link for proper docstring documentation
+# https://pandas.pydata.org/docs/development/contributing_docstring.html
+
+### Futures ###
+#TODO
+
+### Built-in Imports ###
+import argparse
+import datetime
+import json
+import os
+import sqlite3
+import subprocess
+
+### Local Imports ###
+from journal import _json_default
+from utilities import write_csv_atomic
+
+### Constants ###
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sweeps (
+    sweep_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started_at TEXT NOT NULL,
+    git_rev TEXT
+);
+CREATE TABLE IF NOT EXISTS experiments (
+    row_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    sweep_id INTEGER NOT NULL REFERENCES sweeps(sweep_id),
+    experiment_number INTEGER NOT NULL,
+    config_hash TEXT,
+    git_rev TEXT,
+    dataset_choice TEXT,
+    device TEXT,
+    success INTEGER NOT NULL,
+    train_time REAL,
+    test_time REAL,
+    recorded_at TEXT NOT NULL,
+    experiment_data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS experiments_sweep
+    ON experiments (sweep_id, experiment_number);
+CREATE TABLE IF NOT EXISTS class_results (
+    row_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    sweep_id INTEGER NOT NULL REFERENCES sweeps(sweep_id),
+    experiment_number INTEGER NOT NULL,
+    dataset_choice TEXT NOT NULL,
+    recorded_at TEXT NOT NULL,
+    per_class_data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS class_results_sweep
+    ON class_results (sweep_id, experiment_number);
+"""
+
+### Definitions ###
+
+def get_git_revision(path=None):
+    """
+    Returns the git commit hash of the repository containing a path
+    (by default this module), or None if it is not in a git repository.
+    """
+    if path is None:
+        path = os.path.dirname(os.path.abspath(__file__))
+    try:
+        revision = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=path,
+                                  capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return revision.stdout.strip() or None
+
+def _to_seconds(value):
+    """
+    Returns a duration in seconds, given as seconds, a timedelta, or a
+    timedelta string (e.g. '0:01:02.500000' or '1 day, 0:01:02') as the
+    journal records it, or None if it is not a duration.
+    """
+    if value is None:
+        return None
+    if isinstance(value, datetime.timedelta):
+        return value.total_seconds()
+    if isinstance(value, str):
+        days = 0
+        if 'day' in value:
+            day_part, value = value.split(',', 1)
+            days = int(day_part.split()[0])
+        try:
+            hours, minutes, seconds = value.strip().split(':')
+            return (days * 86400 + int(hours) * 3600 + int(minutes) * 60
+                    + float(seconds))
+        except ValueError:
+            return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def _now():
+    return datetime.datetime.now().isoformat(timespec='seconds')
+
+### Classes ###
+
+class ResultsStore:
+    """
+    Append-only SQLite store of the results of a harness's sweeps.
+
+    Every run of the harness that is not resumed starts a new sweep, and
+    a resumed run continues the last sweep. Rows are only ever inserted:
+    if an experiment is recorded twice in a sweep, its latest row is the
+    one exported.
+    """
+
+    def __init__(self, path, resume=True):
+        """
+        Parameters
+        ----------
+        path : str
+            Path of the SQLite database
+        resume : bool, optional
+            Whether to continue the last sweep in the database rather
+            than starting a new one
+        """
+        self.path = path
+        self.git_rev = get_git_revision()
+        self.connection = sqlite3.connect(path)
+        self.connection.row_factory = sqlite3.Row
+        # Readers (e.g. an export while the sweep runs) do not block the
+        # harness's writes
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.executescript(SCHEMA)
+
+        self.sweep_id = None
+        if resume:
+            self.sweep_id = self.get_last_sweep()
+        if self.sweep_id is None:
+            with self.connection:
+                cursor = self.connection.execute(
+                    'INSERT INTO sweeps (started_at, git_rev) VALUES (?, ?)',
+                    (_now(), self.git_rev))
+            self.sweep_id = cursor.lastrowid
+
+    def close(self):
+        self.connection.close()
+
+    def get_last_sweep(self):
+        """Returns the id of the last sweep in the database, or None."""
+        row = self.connection.execute('SELECT MAX(sweep_id) FROM sweeps').fetchone()
+        return row[0]
+
+    def has_experiment(self, experiment_number):
+        """Returns whether an experiment is recorded in this sweep."""
+        row = self.connection.execute(
+            'SELECT 1 FROM experiments WHERE sweep_id = ? AND experiment_number = ?',
+            (self.sweep_id, experiment_number)).fetchone()
+        return row is not None
+
+    def record(self, experiment_number, config_hash, experiment_data,
+               per_class_data, dataset_choice):
+        """
+        Inserts a finished experiment's results into the store. Its train
+        and test times are stored in seconds.
+
+        Parameters
+        ----------
+        experiment_number : int
+            The experiment number (iteration + 1)
+        config_hash : str
+            Hash of the experiment's configuration
+        experiment_data : dict
+            The experiment's results
+        per_class_data : dict or None
+            The experiment's per-class accuracies, which are only stored
+            for successful experiments
+        dataset_choice : str or None
+            The name of the dataset used by the experiment
+        """
+        recorded_at = _now()
+        success = bool(experiment_data.get('success', False))
+        with self.connection:
+            self.connection.execute(
+                'INSERT INTO experiments (sweep_id, experiment_number, config_hash, '
+                'git_rev, dataset_choice, device, success, train_time, test_time, '
+                'recorded_at, experiment_data) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (self.sweep_id, experiment_number, config_hash, self.git_rev,
+                 dataset_choice, experiment_data.get('device'), int(success),
+                 _to_seconds(experiment_data.get('train_time')),
+                 _to_seconds(experiment_data.get('test_time')),
+                 recorded_at, json.dumps(experiment_data, default=_json_default)))
+            if success and per_class_data is not None and dataset_choice is not None:
+                self.connection.execute(
+                    'INSERT INTO class_results (sweep_id, experiment_number, '
+                    'dataset_choice, recorded_at, per_class_data) VALUES (?, ?, ?, ?, ?)',
+                    (self.sweep_id, experiment_number, dataset_choice, recorded_at,
+                     json.dumps(per_class_data, default=_json_default)))
+
+    def _latest_rows(self, table, sweep_id):
+        """Returns the latest row of each experiment of a sweep in a table."""
+        if sweep_id is None:
+            sweep_id = self.sweep_id
+        return self.connection.execute(
+            f'SELECT * FROM {table} WHERE row_id IN ('
+            f'SELECT MAX(row_id) FROM {table} WHERE sweep_id = ? '
+            f'GROUP BY experiment_number) ORDER BY experiment_number',
+            (sweep_id,)).fetchall()
+
+    def read_results(self, sweep_id=None):
+        """
+        Returns the results of a sweep (by default the current sweep),
+        one row per experiment, with the run metadata columns.
+
+        Returns
+        -------
+        pd.DataFrame
+            The results of the sweep's experiments
+        """
+        import pandas as pd
+
+        results = []
+        for row in self._latest_rows('experiments', sweep_id):
+            experiment_data = json.loads(row['experiment_data'])
+            experiment_data.update({
+                'config_hash': row['config_hash'],
+                'git_rev': row['git_rev'],
+                'recorded_at': row['recorded_at'],
+            })
+            results.append(experiment_data)
+        return pd.DataFrame(results)
+
+    def read_class_results(self, sweep_id=None):
+        """
+        Returns the per-class results of a sweep (by default the current
+        sweep).
+
+        Returns
+        -------
+        dict
+            DataFrame of the per-class results of the experiments on each
+            dataset, keyed by dataset name
+        """
+        import pandas as pd
+
+        class_results = {}
+        for row in self._latest_rows('class_results', sweep_id):
+            class_results.setdefault(row['dataset_choice'], []).append(
+                json.loads(row['per_class_data']))
+        return {dataset_choice: pd.DataFrame(per_class_data_list)
+                for dataset_choice, per_class_data_list in class_results.items()}
+
+    def export_csvs(self, output_path, outfile_prefix, sweep_id=None):
+        """
+        Regenerates the results CSV file and the per-class results CSV
+        file of each dataset of a sweep (by default the current sweep).
+
+        Parameters
+        ----------
+        output_path : str
+            Path to where the results files should be created
+        outfile_prefix : str
+            The prefix of the results files
+        sweep_id : int, optional
+            The sweep to export
+        """
+        print()
+        print('-------------------------------------------------------------------')
+        print('SAVING RESULTS...')
+
+        experiments_results_file = f'{outfile_prefix}_results.csv'
+        write_csv_atomic(self.read_results(sweep_id),
+                         os.path.join(output_path, experiments_results_file))
+
+        print('  >>> Experiment results saved!')
+
+        for dataset_choice, per_class_data_results in self.read_class_results(sweep_id).items():
+            class_results_file = f'{outfile_prefix}__{dataset_choice}__class_results.csv'
+            write_csv_atomic(per_class_data_results,
+                             os.path.join(output_path, class_results_file))
+            print(f'  >>> {dataset_choice} per-class results saved!')
+
+        print('RESULTS SAVED!')
+        print('-------------------------------------------------------------------')
+
+def results_store_parser():
+    """
+    Sets up the parser for command-line flags for exporting the results
+    CSV files from a results store.
+
+    Returns
+    -------
+    argparse.ArgumentParser
+        An ArgumentParser object configured with the results_store.py
+        command-line arguments.
+    """
+    parser = argparse.ArgumentParser(
+        'Regenerates the results CSV files of a sweep from a results store')
+    parser.add_argument('database', type=str,
+        help='Path of the results store database')
+    parser.add_argument('--sweep', type=int, default=None,
+        help='Sweep to export (default = the last sweep)')
+    parser.add_argument('--output_path', type=str, default=None,
+        help='Path to write the CSV files to (default = the database directory)')
+    parser.add_argument('--prefix', type=str, default=None,
+        help='Prefix of the CSV files (default = the database name without '
+             'its _results.sqlite suffix)')
+    return parser
+
+
+### Main ###
+
+if __name__ == "__main__":
+    parser = results_store_parser()
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        parser.error(f'No results store at {args.database}')
+
+    output_path = args.output_path or os.path.dirname(os.path.abspath(args.database))
+    outfile_prefix = args.prefix
+    if outfile_prefix is None:
+        outfile_prefix = os.path.basename(args.database)
+        for suffix in ('_results.sqlite', '.sqlite'):
+            if outfile_prefix.endswith(suffix):
+                outfile_prefix = outfile_prefix[:-len(suffix)]
+                break
+
+    store = ResultsStore(args.database, resume=True)
+    store.export_csvs(output_path, outfile_prefix, sweep_id=args.sweep)
+    store.close()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Class-balanced sampling module
+
+This script defines the class-balanced batch sampler of the training
+datasets, which draws each batch's patches from per-class pools with
+class probabilities that favor the rare classes, instead of iterating
+the patches in their natural, imbalanced class distribution.
+
+Author:  Christopher Good
+Version: 1.0.0
+
+Usage: sampling.py
+
+"""
+# See following link for proper docstring documentation
+# https://pandas.pydata.org/docs/development/contributing_docstring.html
+
+### Futures ###
+#TODO
+
+### Built-in Imports ###
+#TODO
+
+### Other Library Imports ###
+import numpy as np
+
+### Local Imports ###
+#TODO
+
+### Constants ###
+
+# Class balancing modes:
+#   'inverse_median' - each patch is drawn with its class's inverse
+#                      median frequency weight, so every class is drawn
+#                      about as often as the median class, except that
+#                      no class is oversampled more than MAX_OVERSAMPLING
+#                      times its natural frequency
+#   'sqrt'           - classes are drawn in proportion to the square
+#                      root of their frequency
+#   'uniform'        - every class is drawn equally often
+CLASS_BALANCING_MODES = ('inverse_median', 'sqrt', 'uniform')
+
+# Largest factor by which inverse median frequency balancing oversamples
+# a class, so the few patches of the rarest classes are not repeated in
+# almost every batch
+MAX_OVERSAMPLING = 10.0
+
+### Definitions ###
+
+def get_class_probabilities(counts, mode):
+    """
+    Returns the probability of drawing each class.
+
+    Parameters
+    ----------
+    counts : np.ndarray
+        Number of patches of each class
+    mode : str
+        The class balancing mode (see CLASS_BALANCING_MODES)
+
+    Returns
+    -------
+    np.ndarray
+        The probability of drawing each class
+
+    Raises
+    ------
+    ValueError
+        If the mode is unknown
+    """
+    frequencies = counts / counts.sum()
+    if mode == 'inverse_median':
+        weights = np.minimum(np.median(frequencies) / frequencies, MAX_OVERSAMPLING)
+        probabilities = frequencies * weights
+    elif mode == 'sqrt':
+        probabilities = np.sqrt(frequencies)
+    elif mode == 'uniform':
+        probabilities = np.ones_like(frequencies)
+    else:
+        raise ValueError(f'Unknown class balancing mode: {mode}')
+    return probabilities / probabilities.sum()
+
+### Classes ###
+
+class ClassBalancedSampler(object):
+    """
+    Draws batches of patch indices with balanced class probabilities.
+
+    The patch indices are grouped into per-class pools once, so a batch
+    is drawn in O(batch size): the class of each sample is drawn with the
+    class probabilities, then a patch is drawn uniformly from the class's
+    pool. Oversampled patches are drawn again rather than copied.
+
+    An epoch keeps its natural length of the dataset's number of patches,
+    so epochs (and early stopping patience) mean the same amount of
+    training as without balancing. Each batch is drawn with a random
+    generator seeded by the sampler's seed, the epoch and the batch
+    number, so a batch is the same whichever worker thread fetches it
+    and however often.
+    """
+
+    def __init__(self, indices, labels, mode='inverse_median', seed=None):
+        """
+        Parameters
+        ----------
+        indices : np.ndarray
+            (N, 2) array of the (row, column) of each patch
+        labels : np.ndarray
+            The label of each patch
+        mode : str, optional
+            The class balancing mode (see CLASS_BALANCING_MODES)
+        seed : int, optional
+            Seed of the batch random generators (defaults to a seed drawn
+            from NumPy's global random state)
+        """
+        labels = np.asarray(labels)
+        order = np.argsort(labels, kind='stable')
+        self.classes, self.counts = np.unique(labels, return_counts=True)
+        self.offsets = np.concatenate([[0], np.cumsum(self.counts)[:-1]])
+        self.pools = np.asarray(indices, dtype=np.int32)[order]
+        self.probabilities = get_class_probabilities(self.counts, mode)
+        self.mode = mode
+        self.seed = np.random.randint(2 ** 31) if seed is None else seed
+        self.epoch = 0
+
+    def on_epoch_end(self):
+        self.epoch += 1
+
+    def draw_batch(self, batch, batch_size):
+        """
+        Draws the patch indices of a batch.
+
+        Parameters
+        ----------
+        batch : int
+            Number of the batch in the epoch
+        batch_size : int
+            Number of patches to draw
+
+        Returns
+        -------
+        np.ndarray
+            (batch_size, 2) array of the (row, column) of each patch
+        """
+        rng = np.random.default_rng([self.seed, self.epoch, batch])
+        classes = rng.choice(len(self.counts), size=batch_size, p=self.probabilities)
+        positions = (rng.random(batch_size) * self.counts[classes]).astype(np.int64)
+        return self.pools[self.offsets[classes] + positions]
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Parallel experiment scheduler module
+
+This script defines a scheduler that runs test harness experiments in
+a pool of worker processes, each pinned to its own device slot (a GPU
+or a set of CPU cores).
+
+Author:  Christopher Good
+Version: 1.0.0
+
+Usage: scheduler.py
+
+"""
+# See following link for proper docstring documentation
+# https://pandas.pydata.org/docs/development/contributing_docstring.html
+
+### Futures ###
+#TODO
+
+### Built-in Imports ###
+from concurrent.futures import (
+    ProcessPoolExecutor,
+    as_completed,
+)
+from contextlib import redirect_stdout
+import multiprocessing
+import os
+import traceback
+
+### Local Imports ###
+from datasets import (
+    get_shared_dataset_key,
+    save_shared_dataset,
+)
+
+### Globals ###
+
+# Device slot assigned to the current worker process
+_WORKER_SLOT = None
+
+### Definitions ###
+
+def get_available_cpus():
+    """Returns the list of CPU cores the current process may run on."""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count()))
+
+def parse_device_slots(spec, num_workers):
+    """
+    Parses a device slot specification into one slot per worker.
+
+    Parameters
+    ----------
+    spec : str or None
+        Comma separated device slots. Each slot is 'gpu:N' for a GPU,
+        'cpu:A-B' for a range of CPU cores, or 'cpu' for an unpinned CPU
+        worker. If None, the available CPU cores are split evenly
+        between the workers.
+    num_workers : int
+        Number of worker processes
+
+    Returns
+    -------
+    list of dict
+        Device slots with a 'gpu' ordinal (or None) and a list of 'cpus'
+        (or None), one per worker
+    """
+    if spec is None:
+        cpus = get_available_cpus()
+        cores_per_worker = max(len(cpus) // num_workers, 1)
+        return [{'gpu': None,
+                 'cpus': cpus[i * cores_per_worker:(i + 1) * cores_per_worker] or None}
+                for i in range(num_workers)]
+
+    slots = []
+    for item in spec.split(','):
+        item = item.strip().lower()
+        if item.startswith('gpu:'):
+            slots.append({'gpu': int(item[4:]), 'cpus': None})
+        elif item == 'cpu':
+            slots.append({'gpu': None, 'cpus': None})
+        elif item.startswith('cpu:'):
+            first, _, last = item[4:].partition('-')
+            last = last or first
+            slots.append({'gpu': None,
+                          'cpus': list(range(int(first), int(last) + 1))})
+        else:
+            raise ValueError(f"Invalid device slot '{item}'! Use 'gpu:N', "
+                             "'cpu:A-B' or 'cpu'")
+
+    # Repeat the slots if there are more workers than slots, e.g. to
+    # run two experiments per GPU
+    return [slots[i % len(slots)] for i in range(max(num_workers, 1))]
+
+def prepare_shared_datasets(jobs, directory, load_function):
+    """
+    Loads every distinct dataset used by a set of experiments once and
+    saves it so the worker processes can memory-map it.
+
+    Parameters
+    ----------
+    jobs : list of tuple
+        (iteration, hyperparams, experiment_name) for each experiment.
+        The hyperparams are updated in place with the shared dataset
+        directory.
+    directory : str
+        Directory where shared datasets are stored
+    load_function : callable
+        Function with the signature of test_harness.load_dataset
+    """
+    groups = {}
+    for _, hyperparams, _ in jobs:
+        key = get_shared_dataset_key(hyperparams['dataset'], **hyperparams)
+        groups.setdefault(key, []).append(hyperparams)
+
+    for key, group in groups.items():
+        # Pad the data enough for the largest patch size in the group
+        data_padding = max(int(hyperparams['patch_size']) for hyperparams in group) // 2
+
+        # Load the dataset without using any existing shared dataset
+        hyperparams = dict(group[0], shared_dataset_dir=None)
+
+        print(f'Preparing shared dataset {key}...')
+        data, train_gt, test_gt, dataset_info, _ = load_function(
+            hyperparams['dataset'], **hyperparams)
+        save_shared_dataset(directory, key, data, train_gt, test_gt,
+                            dataset_info, data_padding=data_padding)
+        del data
+
+        for hyperparams in group:
+            hyperparams['shared_dataset_dir'] = directory
+
+def _initialize_worker(slot_queue, intra_threads, inter_threads):
+    """
+    Pins a new worker process to a device slot and configures its
+    Tensorflow thread pools. Must run before Tensorflow initializes
+    its devices.
+    """
+    global _WORKER_SLOT
+    _WORKER_SLOT = slot_queue.get()
+
+    # Only expose the slot's GPU (or no GPU) to Tensorflow
+    if _WORKER_SLOT['gpu'] is None:
+        os.environ['CUDA_VISIBLE_DEVICES'] = '-1'
+    else:
+        os.environ['CUDA_VISIBLE_DEVICES'] = str(_WORKER_SLOT['gpu'])
+
+    # Pin the worker to the slot's CPU cores
+    if _WORKER_SLOT['cpus'] is not None:
+        if hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, _WORKER_SLOT['cpus'])
+        if intra_threads is None:
+            intra_threads = len(_WORKER_SLOT['cpus'])
+
+    # remove abundant output
+    os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
+
+    import tensorflow as tf
+    if intra_threads is not None:
+        tf.config.threading.set_intra_op_parallelism_threads(intra_threads)
+    if inter_threads is not None:
+        tf.config.threading.set_inter_op_parallelism_threads(inter_threads)
+
+def _run_experiment_job(iteration, hyperparams, experiment_name):
+    """
+    Runs a single experiment in a worker process, writing its output to
+    a log file in the output path.
+    """
+    import test_harness
+
+    # The worker only sees its own GPU, if it has one
+    hyperparams = dict(hyperparams)
+    hyperparams['cuda'] = -1 if _WORKER_SLOT['gpu'] is None else 0
+
+    log_path = os.path.join(hyperparams['output_path'],
+                            f'experiment_{iteration+1}_output.log')
+    with open(log_path, 'w') as log_file, redirect_stdout(log_file):
+        return test_harness.run_experiment(iteration, hyperparams,
+                                           experiment_name=experiment_name)
+
+def run_experiments_parallel(jobs, slots, on_result,
+                             intra_threads=None, inter_threads=None):
+    """
+    Runs experiments in a pool of worker processes, one per device slot.
+
+    Parameters
+    ----------
+    jobs : list of tuple
+        (iteration, hyperparams, experiment_name) for each experiment
+    slots : list of dict
+        Device slots from parse_device_slots, one per worker
+    on_result : callable
+        Called in the parent process as each experiment finishes with
+        (iteration, experiment_data, per_class_data, dataset_choice).
+        If the worker process failed, the last three are None.
+    intra_threads : int, optional
+        Tensorflow intra-op threads per worker (defaults to the number
+        of CPU cores in the worker's slot)
+    inter_threads : int, optional
+        Tensorflow inter-op threads per worker
+    """
+    # Spawn fresh interpreters so no Tensorflow state is inherited
+    context = multiprocessing.get_context('spawn')
+    slot_queue = context.Queue()
+    for slot in slots:
+        slot_queue.put(slot)
+
+    with ProcessPoolExecutor(max_workers=len(slots),
+                             mp_context=context,
+                             initializer=_initialize_worker,
+                             initargs=(slot_queue, intra_threads, inter_threads)) as executor:
+        futures = {executor.submit(_run_experiment_job, *job): job[0] for job in jobs}
+
+        for future in as_completed(futures):
+            iteration = futures[future]
+            try:
+                experiment_data, per_class_data, dataset_choice = future.result()
+            except Exception:
+                print(f'<!> Worker for experiment #{iteration+1} failed! <!>')
+                traceback.print_exc()
+                experiment_data, per_class_data, dataset_choice = None, None, None
+
+            on_result(iteration, experiment_data, per_class_data, dataset_choice)
@@ -21,9 +21,13 @@ Usage: test_harness.py
 ### Built-in Imports ###
 import argparse
 import datetime
+import functools
+import itertools
+import json
 from operator import truediv
 import os
 from pathlib import Path
+import sys
 import time
 import traceback
 
@@ -31,7 +35,6 @@ import traceback
 ### Other Library Imports ###
 import cpuinfo
 import numpy as np
-import pandas as pd
 from sklearn import metrics
 import tensorflow as tf
 from tensorflow.keras import backend as K
@@ -41,22 +44,92 @@ from tensorflow.keras.callbacks import (
 )
 
 ### Local Imports ###
+from asha import (
+    ASHACallback,
+    ASHAState,
+    get_rung_epochs,
+)
+from autotune import run_autotune
+from callbacks import (
+    ResumeCheckpoint,
+    TensorflowProfiler,
+    ThroughputMonitor,
+    load_resume_state,
+    remove_resume_checkpoint,
+)
+from distribution import (
+    DISTRIBUTION_STRATEGIES,
+    get_distribution_strategy,
+    get_worker_output_path,
+    make_distributed_dataset,
+)
+from distillation import (
+    Distiller,
+    get_teacher_logits,
+    get_teacher_logits_cache_path,
+)
+from journal import (
+    SweepJournal,
+    get_config_hash,
+)
+from metrics_log import (
+    MetricsLogCallback,
+    MetricsLogger,
+    log_phase,
+)
 from datasets import (
+    DistillationDataset,
+    HyperspectralDataset,
+    TimedBatchInput,
     hs_dataset_generator,
     preprocess_data,
     sample_gt,
     create_datasets,
+    load_shared_dataset,
     load_grss_dfc_2018_uh_dataset,
     load_indian_pines_dataset,
     load_pavia_center_dataset,
     load_university_of_pavia_dataset,
 )
+from model_profiler import (
+    profile_model,
+    report_layer_profile,
+)
 from models import (
+    BLOCK_TYPES,
+    DATA_LAYOUTS,
+    GradientAccumulationModel,
+    get_densenet_config,
+    get_mixed_precision_policy,
     get_optimizer,
+    get_xla_compile_options,
+    make_compiled_predict,
     densenet_model,
     cnn_3d_model,
     baseline_cnn_model,
 )
+from profiling import (
+    get_profile_path,
+    parse_profile_phases,
+    parse_profile_steps,
+    profile_phase,
+    trace_memory,
+)
+from pseudo_labelling import (
+    get_unlabelled_mask,
+    limit_per_class,
+    make_pseudo_gt,
+    predict_pseudo_labels,
+)
+from results_store import ResultsStore
+from sampling import CLASS_BALANCING_MODES
+from scheduler import (
+    parse_device_slots,
+    prepare_shared_datasets,
+    run_experiments_parallel,
+)
+import utilities
+from utilities import print_v
 
 ### Environment ###
 # remove abundant output
@@ -64,6 +137,44 @@ os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
 
 ### Constants ###
 
+# Hyperparameters that control the harness itself rather than a single
+# experiment, which are always taken from the command line
+HARNESS_HYPERPARAMS = (
+    'output_path',
+    'workers',
+    'profile',
+    'profile_phases',
+    'profile_tf_steps',
+    'parallel_workers',
+    'parallel_devices',
+    'worker_threads',
+    'worker_inter_threads',
+    'shared_dataset_dir',
+    'resume',
+    'teacher_logits_dir',
+    'profile_layers',
+    'device_memory_mb',
+    'autotune',
+    'autotune_bands',
+    'autotune_max_batch_size',
+    'autotune_workers',
+    'autotune_steps',
+    'distribute',
+    'logical_cpus',
+    'asha',
+    'asha_min_epochs',
+    'asha_reduction_factor',
+    'asha_metric',
+    'asha_state_path',
+    'results_export_interval',
+    'verbose',
+    'debug',
+)
+
+# Hyperparameters left out of the configuration hash used to recognize
+# finished experiments when resuming a sweep
+CONFIG_HASH_IGNORED = HARNESS_HYPERPARAMS + ('cuda', 'config_hash')
+
 ### Definitions ###
 
 def get_device(ordinal):
@@ -135,8 +246,33 @@ def band_selection(data, classes, **hyperparams):
     #TODO
     pass
 
+def predict_padded(predict_step, dataset):
+    """
+    Runs a fixed batch size prediction function over a dataset of
+    padded batches, dropping the predictions of the padding.
+
+    Parameters
+    ----------
+    predict_step : callable
+        Prediction function from models.make_compiled_predict
+    dataset : HyperspectralDataset
+        Dataset created with the `pad_batches` option
+
+    Returns
+    -------
+    np.ndarray
+        The model's predictions for every sample of the dataset
+    """
+    predictions = []
+    for i in range(len(dataset)):
+        batch_data, _, batch_weights = dataset[i]
+        batch_pred = predict_step(batch_data).numpy()
+        predictions.append(batch_pred[batch_weights.numpy() > 0])
+    return np.concatenate(predictions)
+
 def run_model(model, train_dataset, val_dataset, test_dataset, target_test,
-              labels, iteration = None, **hyperparams):
+              labels, iteration = None, strategy = None, metrics_logger = None,
+              pseudo_label_round = None, **hyperparams):
 
     # Get X and y from datasets
     target_test = test_dataset.labels
@@ -151,13 +287,46 @@ def run_model(model, train_dataset, val_dataset, test_dataset, target_test,
     if iteration is not None:
         best_weights_path = os.path.join(hyperparams['output_path'], 
             f'{model.name}_best_weights_experiment_{iteration+1}.hdf5')
+        last_checkpoint_path = os.path.join(output_path,
+            f'{model.name}_last_checkpoint_experiment_{iteration+1}')
     else:
         best_weights_path = os.path.join(output_path, 
             f'{model.name}_best_weights_experiment.hdf5')
+        last_checkpoint_path = os.path.join(output_path,
+            f'{model.name}_last_checkpoint_experiment')
+    # Each pseudo-labelling round resumes from its own checkpoint
+    if pseudo_label_round is not None:
+        last_checkpoint_path += f'_round_{pseudo_label_round+1}'
     patience = hyperparams['patience']
     optimizer = get_optimizer(**hyperparams)
     ignored_labels = hyperparams['ignored_labels']
     labels = [label for index, label in enumerate(labels) if index not in ignored_labels]
+    if hyperparams['profile']:
+        profile_phases = parse_profile_phases(hyperparams['profile_phases'])
+    else:
+        profile_phases = []
+    profile_tf_steps = parse_profile_steps(hyperparams['profile_tf_steps'])
+    restore = hyperparams.get('restore')
+    resume = hyperparams.get('resume', False)
+    config_hash = hyperparams.get('config_hash')
+    xla = hyperparams.get('xla', False)
+
+    # The datasets' batches are per replica, so each step of a
+    # distributed model trains on a batch from every replica
+    timed_train_input = None
+    if strategy is not None:
+        global_batch_size = batch_size * strategy.num_replicas_in_sync
+        fit_train_dataset = make_distributed_dataset(train_dataset, strategy)
+        fit_val_dataset = make_distributed_dataset(val_dataset, strategy)
+        fit_test_dataset = make_distributed_dataset(test_dataset, strategy)
+    else:
+        global_batch_size = batch_size
+        # Feed the training batches through a pipeline that times how
+        # long each training step waits for its batch
+        timed_train_input = TimedBatchInput(train_dataset, workers=workers)
+        fit_train_dataset = timed_train_input.dataset
+        fit_val_dataset = val_dataset
+        fit_test_dataset = test_dataset
 
     # Create callback to stop training early if metrics don't improve
     cb_early_stopping = EarlyStopping(monitor='val_loss', 
@@ -168,52 +337,123 @@ def run_model(model, train_dataset, val_dataset, test_dataset, target_test,
     cb_save_best_model = ModelCheckpoint(best_weights_path, 
         monitor='val_loss', verbose=1, save_best_only=True, mode='auto')
 
+    # Create callback to record training throughput and input pipeline
+    # stalls
+    cb_throughput = ThroughputMonitor(train_dataset, global_batch_size,
+        device=hyperparams.get('device'), timed_input=timed_train_input)
+
+    # XLA compiled models are fed padded batches with sample weights
+    # masking the padding, so their metrics must be weighted
+    if xla:
+        compile_options = get_xla_compile_options()
+        compile_metrics = None
+        compile_weighted_metrics = model_metrics
+    else:
+        compile_options = {}
+        compile_metrics = model_metrics
+        compile_weighted_metrics = None
+
     # Compile the model with the appropriate loss function, optimizer,
     # and metrics
     model.compile(loss=loss, 
                   optimizer=optimizer, 
-                  metrics=model_metrics,
+                  metrics=compile_metrics,
                   loss_weights=None,
-                  weighted_metrics=None,
+                  weighted_metrics=compile_weighted_metrics,
                   run_eagerly=None,
+                  **compile_options
                   )
     
-    # Display a summary of the model being trained
-    model.summary()
+    # Display a summary of the model being trained, and log it
+    summary_lines = []
+    model.summary(print_fn=summary_lines.append)
+    print_v('\n'.join(summary_lines))
+    if metrics_logger is not None:
+        metrics_logger.log('model_summary', model=model.name, summary=summary_lines)
+
+    # Resume interrupted training from the last epoch checkpoint, or
+    # initialize the model with the given weights
+    initial_epoch = 0
+    resume_state = None
+    if resume:
+        resume_state = load_resume_state(last_checkpoint_path, config_hash)
+    if resume_state is not None:
+        model.load_weights(last_checkpoint_path)
+        initial_epoch = resume_state['epoch'] + 1
+        if resume_state['best'] is not None:
+            cb_save_best_model.best = resume_state['best']
+        print(f'< Resuming training from epoch {initial_epoch+1} >')
+    elif restore is not None:
+        model.load_weights(restore)
+        print(f'< Initialized model weights from {restore} >')
+
+    # Create callback to save the model and optimizer state every epoch
+    # so training can be resumed if it is interrupted
+    cb_resume_checkpoint = ResumeCheckpoint(last_checkpoint_path,
+        monitor='val_loss', config_hash=config_hash,
+        best=resume_state['best'] if resume_state is not None else None,
+        early_stopping=cb_early_stopping,
+        early_stopping_state=(resume_state.get('early_stopping')
+                              if resume_state is not None else None))
+
+    callbacks = [cb_early_stopping, cb_save_best_model, cb_throughput,
+                 cb_resume_checkpoint]
+
+    # Create callback to stop training at the first successive halving
+    # rung where the model is not in the top fraction of the sweep
+    cb_asha = None
+    if hyperparams.get('asha') and pseudo_label_round is None:
+        reduction_factor = hyperparams['asha_reduction_factor']
+        cb_asha = ASHACallback(
+            ASHAState(hyperparams['asha_state_path']),
+            iteration + 1 if iteration is not None else 0,
+            get_rung_epochs(hyperparams['asha_min_epochs'], epochs, reduction_factor),
+            reduction_factor,
+            monitor=hyperparams['asha_metric'])
+        callbacks.append(cb_asha)
+
+    # Create callback to log each epoch's metrics and throughput to the
+    # experiment's metrics log
+    if metrics_logger is not None:
+        callbacks.append(MetricsLogCallback(metrics_logger, cb_throughput))
+
+    # Create callback to run the Tensorflow profiler over a window of
+    # training steps
+    if profile_tf_steps is not None:
+        start_step, stop_step = profile_tf_steps
+        callbacks.append(TensorflowProfiler(
+            get_profile_path(output_path, iteration, 'tf_trace'),
+            start_step, stop_step))
 
     # Record start time for model training
     model_train_start = time.process_time()
 
     # Train the model
-    model_history = model.fit(
-            train_dataset,
-            validation_data=val_dataset,
-            # batch_size=batch_size,
-            epochs=epochs, 
-            shuffle=True, 
-            # use_multiprocessing=True,
-            # workers=workers,
-            callbacks=[cb_early_stopping, cb_save_best_model]
-        )
-
-    # Write model history to file
-    with open(os.path.join(output_path,
-         f'Experiment_{iteration+1}_training_history.txt'), 'w') as hf:
-
-        hf.write(f'EXPERIMENT #{iteration+1} MODEL HISTORY:\n')
-        hf.write('-----------------------------------------------\n')
-        hf.write(f'MODEL: {model.name}\n')
-        hf.write('-----------------------------------------------\n')
-
-        # Save model summary to file as well
-        model.summary(print_fn=lambda x: hf.write(x + '\n'))
-        
-        # Save info from each epoch to file
-        for epoch in range(model_history.params['epochs']):
-            hf.write(f'EPOCH: {epoch+1}\n')
-            for key in model_history.history.keys():
-                hf.write(f'  {key}: {model_history.history[key][epoch]}\n')
+    with profile_phase('train', 'train' in profile_phases, output_path, iteration), \
+         log_phase(metrics_logger, 'train'):
+        try:
+            model.fit(
+                    fit_train_dataset,
+                    validation_data=fit_val_dataset,
+                    # batch_size=batch_size,
+                    epochs=epochs, 
+                    initial_epoch=initial_epoch,
+                    shuffle=True, 
+                    # use_multiprocessing=True,
+                    workers=workers,
+                    callbacks=callbacks,
+                    # One line per epoch unless verbose
+                    verbose=1 if utilities.verbose else 2
+                )
+        finally:
+            if timed_train_input is not None:
+                timed_train_input.stop()
+
+    # Training finished, so the resume checkpoint is no longer needed
+    remove_resume_checkpoint(last_checkpoint_path)
 
+    # Summarize training throughput over all epochs
+    throughput = cb_throughput.summary()
 
     # Record end time for model training
     model_train_end = time.process_time()
@@ -221,17 +461,23 @@ def run_model(model, train_dataset, val_dataset, test_dataset, target_test,
     # Record start time for model evaluation
     model_test_start = time.process_time()
 
-    # Evaluate the trained 3D-DenseNet
-    loss_and_metrics = model.evaluate(
-            test_dataset,
-            # batch_size=batch_size
-        )
-
-    # Record end time for model evaluation
-    model_test_end = time.process_time()
-
-    # Get prediction values for test dataset
-    pred_test = model.predict(test_dataset).argmax(axis=1)
+    with profile_phase('evaluate', 'evaluate' in profile_phases, output_path, iteration), \
+         log_phase(metrics_logger, 'evaluate'):
+        # Evaluate the trained 3D-DenseNet
+        loss_and_metrics = model.evaluate(
+                fit_test_dataset,
+                # batch_size=batch_size
+            )
+
+        # Record end time for model evaluation
+        model_test_end = time.process_time()
+
+        # Get prediction values for test dataset
+        if xla:
+            predict_step = make_compiled_predict(model, batch_size)
+            pred_test = predict_padded(predict_step, test_dataset).argmax(axis=1)
+        else:
+            pred_test = model.predict(fit_test_dataset).argmax(axis=1)
 
     # Calculate training and testing times
     model_train_time = datetime.timedelta(seconds=(model_train_end - model_train_start))
@@ -258,6 +504,8 @@ def run_model(model, train_dataset, val_dataset, test_dataset, target_test,
     print('---------------------------------------------------')
     print(f'{model.name} train time: {model_train_time}')
     print(f'{model.name} test time:  {model_test_time}')
+    print(f'{model.name} samples/sec: {throughput["samples_per_sec"]}')
+    print(f'{model.name} data wait ratio: {throughput["data_wait_ratio"]}')
     print('...................................................')
     print(f'{model.name} test score:     {loss_and_metrics[0]}')
     print(f'{model.name} test accuracy:  {loss_and_metrics[1]}')
@@ -290,10 +538,877 @@ def run_model(model, train_dataset, val_dataset, test_dataset, target_test,
         'confusion_matrix': confusion_matrix,
         'per_class_accuracies': each_acc,
         'labels': labels,
+        'asha_rungs': json.dumps(cb_asha.rung_results) if cb_asha is not None else None,
+        'asha_stopped_epoch': cb_asha.stopped_epoch if cb_asha is not None else None,
+        **throughput,
     }
 
     return results
 
+def get_experiment_seed(hyperparams, iteration):
+    """
+    Returns the random seed for an experiment.
+
+    If no seed is given in the hyperparameters, the seed is the prime
+    number at the experiment's position in the sequence of primes, so
+    every experiment gets the same seed regardless of the order or
+    process it is run in.
+
+    Parameters
+    ----------
+    hyperparams : dict
+        The experiment hyperparameters
+    iteration : int
+        The experiment iteration number
+
+    Returns
+    -------
+    int
+        The random seed for the experiment
+    """
+    if hyperparams['random_seed'] is not None:
+        return int(hyperparams['random_seed'])
+    return next(itertools.islice(prime_generator(), iteration, None))
+
+@functools.lru_cache(maxsize=None)
+def get_device_name(device):
+    """
+    Returns the model name of the CPU or GPU used for a device string.
+
+    Parameters
+    ----------
+    device : str
+        Tensorflow device string (e.g. '/CPU:0' or '/GPU:0')
+
+    Returns
+    -------
+    str
+        The model name of the device
+    """
+    if 'CPU' in device:
+        return cpuinfo.get_cpu_info()['brand_raw']
+
+    gpu_num = int(device.split(':')[-1])
+    gpu = tf.config.list_physical_devices('GPU')[gpu_num]
+    return tf.config.experimental.get_device_details(gpu)['device_name']
+
+def load_dataset(dataset_choice, **hyperparams):
+    """
+    Loads, preprocesses and runs band selection on a dataset.
+
+    Parameters
+    ----------
+    dataset_choice : str
+        The name of the dataset to load
+    **hyperparams : dict
+        The experiment hyperparameters
+
+    Returns
+    -------
+    data : np.ndarray
+        The dataset image data
+    train_gt : np.ndarray
+        The training ground truth image
+    test_gt : np.ndarray
+        The testing ground truth image
+    dataset_info : dict
+        Information about the dataset's name and classes
+    dataset_choice : str
+        The name of the dataset that was actually loaded
+    """
+    # Use a dataset shared with other processes, if one was prepared
+    if hyperparams.get('shared_dataset_dir') is not None:
+        data, train_gt, test_gt, dataset_info = load_shared_dataset(
+            hyperparams['shared_dataset_dir'], dataset_choice, **hyperparams)
+        return data, train_gt, test_gt, dataset_info, dataset_choice
+
+    if dataset_choice == 'grss_dfc_2018':
+        # Determine what parts of dataset to use
+        if (not hyperparams['use_hs_data']
+            and not hyperparams['use_lidar_ms_data']
+            and not hyperparams['use_lidar_ndsm_data']
+            and not hyperparams['use_vhr_data']
+            and not hyperparams['use_all_data']):
+
+            print('<!> No specific data selected, defaulting to using only hyperspectral data... <!>')
+            hyperparams['use_hs_data'] = True
+
+        data, train_gt, test_gt, dataset_info = load_grss_dfc_2018_uh_dataset(**hyperparams)
+    elif dataset_choice == 'indian_pines':
+        data, train_gt, test_gt, dataset_info = load_indian_pines_dataset(**hyperparams)
+    elif dataset_choice == 'pavia_center':
+        data, train_gt, test_gt, dataset_info = load_pavia_center_dataset(**hyperparams)
+    elif dataset_choice == 'university_of_pavia':
+        data, train_gt, test_gt, dataset_info = load_university_of_pavia_dataset(**hyperparams)
+    else:
+        print('No dataset chosen! Defaulting to only hyperspectral bands of grss_dfc_2018...')
+        dataset_choice = 'grss_dfc_2018'
+        hyperparams['use_hs_data'] = True
+        data, train_gt, test_gt, dataset_info = load_grss_dfc_2018_uh_dataset(**hyperparams)
+
+    print('^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^')
+    print('DATASET LOADED!')
+    print('-------------------------------------------------------------------')
+    print()
+
+    if not hyperparams['skip_data_preprocessing']:
+        print('-------------------------------------------------------------------')
+        print('PREPROCESS THE DATA')
+        print('-------------------------------------------------------------------')
+        data = preprocess_data(data, **hyperparams)
+        print('-------------------------------------------------------------------')
+        print()
+
+    if not hyperparams['skip_band_selection']:
+        print('-------------------------------------------------------------------')
+        print('RUN BAND SELECTION ALGORITHM')
+        print('-------------------------------------------------------------------')
+        data = band_selection(data, dataset_info['class_labels'], **hyperparams)
+        print('-------------------------------------------------------------------')
+        print()
+
+    return data, train_gt, test_gt, dataset_info, dataset_choice
+
+def load_experiment_datasets(hyperparams, experiment_number=1):
+    """
+    Loads a dataset and splits it the same way as a test harness
+    experiment, e.g. to evaluate a checkpoint of the experiment on the
+    same test split.
+
+    Parameters
+    ----------
+    hyperparams : dict
+        Test harness hyperparameters. They are updated in place with
+        the dataset's values, as in the test harness.
+    experiment_number : int, optional
+        Number of the experiment, used to reproduce its random seed and
+        data split
+
+    Returns
+    -------
+    train_dataset : HyperspectralDataset
+        The training split
+    val_dataset : HyperspectralDataset
+        The validation split
+    test_dataset : HyperspectralDataset
+        The testing split
+    dataset_info : dict
+        Information about the dataset's name and classes
+    num_bands : int
+        Number of spectral bands of the patches
+    """
+    np.random.seed(get_experiment_seed(hyperparams, experiment_number - 1))
+
+    data, train_gt, test_gt, dataset_info, _ = load_dataset(
+        hyperparams['dataset'], **hyperparams)
+
+    hyperparams.update({
+        'n_classes': dataset_info['num_classes'],
+        'n_bands': data.shape[-1],
+        'ignored_labels': dataset_info['ignored_labels'],
+        'supervision': 'full',
+        'center_pixel': True,
+        'loss': 'sparse_categorical_crossentropy',
+        'data_padding': dataset_info.get('data_padding', 0),
+    })
+
+    train_dataset, val_dataset, test_dataset, _ = create_datasets(
+        data, train_gt, test_gt, **hyperparams)
+
+    return train_dataset, val_dataset, test_dataset, dataset_info, data.shape[-1]
+
+def create_model(img_rows, img_cols, img_channels, num_classes, **hyperparams):
+    """
+    Creates the model specified by the 'model_id' hyperparameter.
+
+    Parameters
+    ----------
+    img_rows : int
+        Number of rows in neighborhood patch.
+    img_cols : int
+        Number of columns in neighborhood patch.
+    img_channels : int
+        Number of spectral bands.
+    num_classes : int
+        Number of label categories.
+    **hyperparams : dict
+        The experiment hyperparameters
+
+    Returns
+    -------
+    model : Model
+        A keras API model of the constructed ML network.
+    """
+    patch_size = hyperparams['patch_size']
+    data_layout = hyperparams.get('data_layout', 'channels')
+    block_type = hyperparams.get('block_type', 'standard')
+
+    if hyperparams['model_id'] == '3d-densenet':
+        model = densenet_model(img_rows=img_rows,
+                        img_cols=img_cols,
+                        img_channels=img_channels,
+                        nb_classes=num_classes,
+                        data_layout=data_layout,
+                        block_type=block_type,
+                        **get_densenet_config(**hyperparams))
+    elif hyperparams['model_id'] == '3d-cnn':
+        model = cnn_3d_model(img_rows=img_rows,
+                        img_cols=img_cols,
+                        img_channels=img_channels,
+                        nb_classes=num_classes,
+                        data_layout=data_layout,
+                        block_type=block_type)
+    elif hyperparams['model_id'] == 'cnn-baseline':
+        filter_size = patch_size // 2 + 1
+        nb_filters = hyperparams.get('baseline_filters') or num_classes * 2
+        model = baseline_cnn_model(img_rows=img_rows,
+                                img_cols=img_cols,
+                                img_channels=img_channels,
+                                patch_size=filter_size,
+                                nb_filters=nb_filters,
+                                nb_classes=num_classes,
+                                data_layout=data_layout)
+    else:
+        print('<!> No model specified, defaulting to 3d-densenet <!>')
+        model = densenet_model(img_rows=img_rows,
+                        img_cols=img_cols,
+                        img_channels=img_channels,
+                        nb_classes=num_classes,
+                        data_layout=data_layout,
+                        block_type=block_type,
+                        **get_densenet_config(**hyperparams))
+
+    return model
+
+def write_exception_log(e, output_path, iteration):
+    """
+    Prints an experiment exception and writes it to a log file.
+
+    Parameters
+    ----------
+    e : Exception
+        The exception raised by the experiment
+    output_path : str
+        Path to where the log file should be created
+    iteration : int
+        The experiment iteration number
+    """
+    print()
+    print('###################################################')
+    print('!!! EXCEPTION OCCURRED !!!')
+    print('###################################################')
+    print(f'Exception Type: {type(e)}')
+    print(f'Exception Line: {e.__traceback__.tb_lineno}')
+    print(f'Exception Desc: {e}')
+    print()
+    print('---------------------------------------------------')
+    print('** Full Traceback **')
+    print()
+    # Print full exception
+    traceback.print_exc()
+    print('###################################################')
+    print()
+
+    # Write exception to file
+    with open(os.path.join(output_path, f'experiment_{iteration+1}_exception.log'),'w') as ef:
+        ef.write('\n')
+        ef.write('###################################################\n')
+        ef.write('!!! EXCEPTION OCCURRED !!!\n')
+        ef.write('###################################################\n')
+        ef.write(f'Exception Type: {type(e)}\n')
+        ef.write(f'Exception Line: {e.__traceback__.tb_lineno}\n')
+        ef.write(f'Exception Desc: {e}\n')
+        ef.write('\n')
+        ef.write('---------------------------------------------------\n')
+        ef.write('** Full Traceback **\n')
+        ef.write('\n')
+        # Print full exception
+        ef.write(f'{traceback.format_exc()}\n')
+        ef.write('###################################################\n')
+        ef.write('\n')
+
+    print(f'Experiment #{iteration+1} crashed and thus failed!')
+
+def run_experiment(iteration, hyperparams, cache=None, experiment_name=None,
+                   strategy=None):
+    """
+    Runs a single experiment from loading its dataset through training
+    and evaluating its model.
+
+    Parameters
+    ----------
+    iteration : int
+        The experiment iteration number
+    hyperparams : dict
+        The experiment hyperparameters
+    cache : dict, optional
+        State carried over from the previous experiment, used to reuse
+        the last dataset when 'reuse_last_dataset' is set. It is updated
+        in place.
+    experiment_name : str, optional
+        The name of the experiment in the experiments file
+    strategy : tf.distribute.Strategy, optional
+        Distribution strategy to build and train the model with, instead
+        of the single device selected by 'cuda'
+
+    Returns
+    -------
+    experiment_data : dict
+        The experiment's results
+    per_class_data : dict
+        The experiment's per-class accuracies
+    dataset_choice : str
+        The name of the dataset used by the experiment
+    """
+    if cache is None:
+        cache = {}
+
+    # Worker processes get the verbosity with the hyperparameters
+    utilities.verbose = hyperparams.get('verbose', False)
+    utilities.debug = hyperparams.get('debug', False)
+
+    print('*******************************************************')
+    print(f'<<< EXPERIMENT #{iteration+1}  STARTING >>>')
+    print('*******************************************************')
+    print()
+
+    if experiment_name is not None:
+        print('<~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~>')
+        print(f'EXPERIMENT NAME: {experiment_name}')
+        print('<~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~>')
+        print()
+
+    output_path = hyperparams['output_path']
+    dataset_choice = None
+
+    experiment_data = {
+        'experiment_number': iteration + 1,
+        'success': False,
+        'random_seed': None,
+        'dataset': None,
+        'channels': None,
+        'model': None,
+        'device': None,
+        'epochs': None,
+        'batch_size': None,
+        'patch_size': None,
+        'train_split': None,
+        'optimizer': None,
+        'learning_rate': None,
+        'loss': None,
+        'train_time': 0.0,
+        'test_time': 0.0,
+        'test_score': 0.0,
+        'test_accuracy': 0.0,
+        'overall_accuracy': 0.0,
+        'average_accuracy': 0.0,
+        'precision_score': 0.0,
+        'recall_score': 0.0,
+        'cohen_kappa_score': 0.0,
+        'samples_per_sec': 0.0,
+        'data_wait_time': 0.0,
+        'compute_time': 0.0,
+        'data_wait_ratio': 0.0,
+        'peak_rss_mb': None,
+        'peak_gpu_mem_mb': None,
+        'params': None,
+        'flops': None,
+        'cpu_latency_ms': None,
+        'precision': None,
+        'replicas': None,
+        'pseudo_labels': None,
+        'asha_rungs': None,
+        'asha_stopped_epoch': None,
+    }
+
+    per_class_data = {
+        'experiment_number': iteration + 1,
+        'random_seed': None,
+        'model': None,
+        'overall_accuracy': 0.0,
+        'average_accuracy': 0.0,
+    }
+
+    # Log the experiment's events, which are written by a background
+    # thread
+    metrics_logger = MetricsLogger(
+        os.path.join(output_path, f'Experiment_{iteration+1}_metrics.jsonl'),
+        experiment=iteration + 1)
+    metrics_logger.log('experiment_begin', name=experiment_name,
+                       hyperparams=dict(hyperparams))
+
+    # Experiment has begun, so make sure to catch any failures that
+    # may occur
+    try:
+        # Print out parameters for experiment
+        header = '{:<40} | {:<40}'.format('PARAMETER', 'VALUE')
+        parameter_lines = [
+            '.......................................................',
+            'EXPERIMENT PARAMETERS',
+            '.......................................................',
+            header,
+            '=' * len(header),
+        ]
+        for key in hyperparams:
+            parameter_lines.append('{:<40} | {:<40}'.format(key, str(hyperparams[key])))
+            parameter_lines.append('-' * len(header))
+        parameter_lines.append('-' * len(header))
+        parameter_lines.append('.......................................................')
+        print_v('\n'.join(parameter_lines))
+
+        # Initialize random seed for sampling function
+        # Each random seed is a prime number, in order
+        seed = get_experiment_seed(hyperparams, iteration)
+        print(f'< Iteration #{iteration} random seed: {seed} >')
+        print()
+        np.random.seed(seed)
+
+        # Get the experiment phases to profile
+        profile = hyperparams['profile']
+        if profile:
+            profile_phases = parse_profile_phases(hyperparams['profile_phases'])
+        else:
+            profile_phases = []
+
+        # Choose the appropriate device from the hyperparameters
+        device = get_device(hyperparams['cuda'])
+        device_name = get_device_name(device)
+        metrics_logger.device = device
+
+        if 'GPU' in device:
+            gpu_num = int(device.split(':')[-1])
+            gpu = tf.config.list_physical_devices('GPU')[gpu_num]
+            tf.config.experimental.set_memory_growth(gpu, True)
+
+        # Set the precision policy of the model and input patches
+        precision_policy = 'float32'
+        if hyperparams.get('mixed_precision'):
+            precision_policy = get_mixed_precision_policy(device)
+            if precision_policy is None:
+                print('<!> Mixed precision is not supported on this device, using float32 <!>')
+                precision_policy = 'float32'
+        tf.keras.mixed_precision.set_global_policy(precision_policy)
+        input_dtype = tf.keras.mixed_precision.global_policy().compute_dtype
+        print(f'< Precision policy: {precision_policy} >')
+
+        # Device has been selected, so do all possible computation with
+        # device, or with every replica of the distribution strategy
+        if strategy is not None:
+            device_scope = strategy.scope()
+            print(f'< Distributing over {strategy.num_replicas_in_sync} replicas >')
+        else:
+            device_scope = tf.device(device)
+        with device_scope:
+            reuse_last_dataset = hyperparams['reuse_last_dataset']
+            if reuse_last_dataset and cache.get('dataset_choice') is not None:
+                dataset_choice = cache['dataset_choice']
+                print()
+                print(f'< Reusing last dataset: {dataset_choice} >')
+                data = cache['data']
+                dataset_info = cache['dataset_info']
+            else:
+
+                reuse_last_dataset = False
+
+                print()
+                print('-------------------------------------------------------------------')
+                print('LOADING DATASET...')
+                print('vvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvv')
+
+                # Get dataset choice parameter
+                dataset_choice = hyperparams['dataset']
+                print()
+                print(f' < Dataset Chosen: {dataset_choice} >')
+                print()
+
+                # Get selected dataset
+                with profile_phase('dataset_load', 'dataset' in profile_phases, output_path, iteration), \
+                     metrics_logger.phase('dataset_load'):
+                    data, train_gt, test_gt, dataset_info, dataset_choice = load_dataset(
+                        dataset_choice, **hyperparams)
+
+                cache.update({
+                    'dataset_choice': dataset_choice,
+                    'data': data,
+                    'dataset_info': dataset_info,
+                })
+
+            # Set dataset variables
+            dataset_name = dataset_info['name']
+            num_classes = dataset_info['num_classes']
+            ignored_labels = dataset_info['ignored_labels']
+            all_class_labels = dataset_info['class_labels']
+            valid_class_labels = [label for index, label in enumerate(all_class_labels)
+                                    if index not in ignored_labels]
+
+
+            epochs = hyperparams['epochs']
+            supervision = 'full'
+            batch_size = hyperparams['batch_size']
+            patch_size = hyperparams['patch_size']
+            train_split = hyperparams['train_split']
+            optimizer = hyperparams['optimizer']
+            learning_rate = hyperparams['lr']
+            loss = 'sparse_categorical_crossentropy'
+            img_channels = data.shape[-1]
+            img_rows = patch_size
+            img_cols = patch_size
+
+            # Add and update hyperparameters for model training
+            hyperparams.update(
+                {
+                    'n_classes': num_classes,
+                    'n_bands': img_channels,
+                    'ignored_labels': ignored_labels,
+                    'device': device,
+                    'supervision': supervision,
+                    'center_pixel': True,
+                    'one_hot_encoding': True,
+                    'metrics': ['sparse_categorical_accuracy'],
+                    'loss': loss,
+                    'data_padding': dataset_info.get('data_padding', 0),
+                    'input_dtype': input_dtype,
+                    'pad_batches': hyperparams.get('xla', False),
+                }
+            )
+
+            # Update experiment data
+            experiment_data.update({
+                'random_seed': seed,
+                'dataset': dataset_name,
+                'channels': img_channels,
+                'device': device_name,
+                'epochs': epochs,
+                'batch_size': batch_size,
+                'patch_size': patch_size,
+                'train_split': train_split,
+                'optimizer': optimizer,
+                'learning_rate': learning_rate,
+                'loss': loss,
+                'precision': precision_policy,
+                'replicas': strategy.num_replicas_in_sync if strategy is not None else 1,
+            })
+
+            # Update per-class data for experiment
+            per_class_data.update({
+                'random_seed': seed,
+            })
+            for label in valid_class_labels:
+                per_class_data[label] = 0.0
+
+            if not reuse_last_dataset:
+                print('-------------------------------------------------------------------')
+                print('SPLIT DATA FOR TRAINING, VALIDATION, AND TESTING')
+                print('-------------------------------------------------------------------')
+
+                print('Breaking down image into data patches and splitting data into train, validation, and test sets...')
+                with profile_phase('dataset_split', 'dataset' in profile_phases, output_path, iteration), \
+                     trace_memory('dataset_split', profile, output_path, iteration), \
+                     metrics_logger.phase('dataset_split'):
+                    train_dataset, val_dataset, test_dataset, target_test = create_datasets(data, train_gt, test_gt, **hyperparams)
+
+                cache.update({
+                    'train_dataset': train_dataset,
+                    'val_dataset': val_dataset,
+                    'test_dataset': test_dataset,
+                    'target_test': target_test,
+                })
+
+                print('-------------------------------------------------------------------')
+                print()
+            else:
+                train_dataset = cache['train_dataset']
+                val_dataset = cache['val_dataset']
+                test_dataset = cache['test_dataset']
+                target_test = cache['target_test']
+
+                # The reused datasets may have been created for a
+                # different precision policy, compilation mode,
+                # augmentation or class balancing
+                for dataset in (train_dataset, val_dataset, test_dataset):
+                    dataset.input_dtype = input_dtype
+                    dataset.pad_batches = hyperparams['pad_batches']
+                train_dataset.configure_augmentation(**hyperparams)
+                train_dataset.configure_sampling(**hyperparams)
+
+
+            print('-------------------------------------------------------------------')
+            print('CREATE MODEL')
+            print('-------------------------------------------------------------------')
+
+            # Create specified model
+            with profile_phase('model', 'model' in profile_phases, output_path, iteration), \
+                 metrics_logger.phase('model'):
+                model = create_model(img_rows, img_cols, img_channels,
+                                     num_classes, **hyperparams)
+
+            # Record model name for output
+            experiment_data['model'] = model.name
+            per_class_data['model'] = model.name
+
+            # Record the model's parameters, FLOPs and CPU latency
+            model_profile = profile_model(model,
+                measure_cpu_latency=hyperparams.get('measure_latency', False))
+            experiment_data['params'] = model_profile['params']
+            experiment_data['flops'] = model_profile['flops']
+            experiment_data['cpu_latency_ms'] = model_profile['cpu_latency_ms']
+            print(f'< Model parameters: {model_profile["params"]}, '
+                  f'FLOPs per sample: {model_profile["flops"]}, '
+                  f'CPU latency (ms): {model_profile["cpu_latency_ms"]} >')
+
+            # Profile the cost and latency of each layer and estimate the
+            # largest batch size that fits in the device's memory
+            if hyperparams.get('profile_layers'):
+                memory_mb = hyperparams.get('device_memory_mb')
+                report_layer_profile(model, batch_size, device,
+                    os.path.join(output_path, f'Experiment_{iteration+1}_layer_profile.csv'),
+                    memory_bytes=memory_mb * 1024 ** 2 if memory_mb else None)
+
+            # Train the model as the student of a saved teacher model,
+            # using teacher logits cached with the patch indices
+            distill_teacher = hyperparams.get('distill_teacher')
+            if distill_teacher is not None:
+                print('-------------------------------------------------------------------')
+                print('PREPARE KNOWLEDGE DISTILLATION')
+                print('-------------------------------------------------------------------')
+                cache_dir = hyperparams.get('teacher_logits_dir') or output_path
+                cache_path = get_teacher_logits_cache_path(distill_teacher,
+                                                           cache_dir, **hyperparams)
+                teacher_indices, teacher_logits = get_teacher_logits(
+                    distill_teacher, train_dataset, cache_path)
+                train_dataset = DistillationDataset(train_dataset.data,
+                                                    train_dataset.gt,
+                                                    teacher_indices,
+                                                    teacher_logits,
+                                                    augment=True,
+                                                    balance=True,
+                                                    **hyperparams)
+                model = Distiller(model,
+                                  temperature=hyperparams['distill_temperature'],
+                                  alpha=hyperparams['distill_alpha'])
+                print(f'< Distilling {distill_teacher} into {model.name} >')
+
+            # Train on micro-batches of each batch, accumulating their
+            # gradients into one update of the whole batch
+            accumulation_steps = hyperparams.get('accumulation_steps', 1)
+            if accumulation_steps > 1:
+                if distill_teacher is not None:
+                    raise ValueError('Gradient accumulation is not supported '
+                                     'with knowledge distillation')
+                model = GradientAccumulationModel(model, accumulation_steps)
+                print(f'< Accumulating gradients over {accumulation_steps} '
+                      f'micro-batches of {-(-batch_size // accumulation_steps)} samples >')
+
+            print('-------------------------------------------------------------------')
+            print()
+
+            print('-------------------------------------------------------------------')
+            print('RUN MODEL')
+            print('-------------------------------------------------------------------')
+
+            # Run experiment on model
+            results = run_model(model=model,
+                                train_dataset=train_dataset,
+                                val_dataset=val_dataset,
+                                test_dataset=test_dataset,
+                                target_test=target_test,
+                                labels=all_class_labels,
+                                iteration=iteration,
+                                strategy=strategy,
+                                metrics_logger=metrics_logger,
+                                **hyperparams)
+
+            # Pseudo-label the confident predictions of the unlabelled
+            # pixels and retrain on the labelled and pseudo-labelled
+            # pixels, for each round
+            pseudo_label_rounds = hyperparams.get('pseudo_label_rounds', 0)
+            if pseudo_label_rounds > 0 and results['asha_stopped_epoch'] is not None:
+                # The successive halving sweep stopped the base training,
+                # so the experiment is not refined further
+                pseudo_label_rounds = 0
+            if pseudo_label_rounds > 0:
+                if distill_teacher is not None:
+                    raise ValueError('Pseudo-labelling is not supported '
+                                     'with knowledge distillation')
+                labelled_gt = train_dataset.gt
+                unlabelled_mask = get_unlabelled_mask(
+                    (train_dataset.gt, val_dataset.gt, test_dataset.gt),
+                    ignored_labels)
+
+            for pseudo_label_round in range(pseudo_label_rounds):
+                print('-------------------------------------------------------------------')
+                print(f'PSEUDO-LABELLING ROUND {pseudo_label_round+1}/{pseudo_label_rounds}')
+                print('-------------------------------------------------------------------')
+                with metrics_logger.phase('pseudo_label', round=pseudo_label_round + 1):
+                    pseudo_indices, pseudo_labels, pseudo_confidences = predict_pseudo_labels(
+                        model, train_dataset.data, unlabelled_mask, patch_size,
+                        ignored_labels,
+                        threshold=hyperparams['pseudo_label_threshold'],
+                        batch_size=hyperparams.get('pseudo_label_batch_size') or batch_size,
+                        data_layout=hyperparams.get('data_layout', 'channels'),
+                        input_dtype=input_dtype)
+                if hyperparams.get('pseudo_label_max_per_class'):
+                    pseudo_indices, pseudo_labels, pseudo_confidences = limit_per_class(
+                        pseudo_indices, pseudo_labels, pseudo_confidences,
+                        hyperparams['pseudo_label_max_per_class'])
+                experiment_data['pseudo_labels'] = len(pseudo_indices)
+                metrics_logger.log('pseudo_labels', round=pseudo_label_round + 1,
+                                   count=len(pseudo_indices),
+                                   class_counts=np.bincount(pseudo_labels))
+                print(f'< Training on {len(pseudo_indices)} pseudo-labelled pixels >')
+
+                # Each round replaces the previous round's pseudo-labels
+                train_dataset = HyperspectralDataset(
+                    train_dataset.data,
+                    make_pseudo_gt(labelled_gt, pseudo_indices, pseudo_labels),
+                    augment=True, balance=True, **hyperparams)
+                # The rounds are not reported to the successive halving
+                # sweep, so the base training's rung results are kept
+                round_results = run_model(model=model,
+                                          train_dataset=train_dataset,
+                                          val_dataset=val_dataset,
+                                          test_dataset=test_dataset,
+                                          target_test=target_test,
+                                          labels=all_class_labels,
+                                          iteration=iteration,
+                                          strategy=strategy,
+                                          metrics_logger=metrics_logger,
+                                          pseudo_label_round=pseudo_label_round,
+                                          **hyperparams)
+                results = dict(round_results,
+                               asha_rungs=results['asha_rungs'],
+                               asha_stopped_epoch=results['asha_stopped_epoch'])
+
+            # Copy results to output data
+            experiment_data['train_time'] = results['train_time']
+            experiment_data['test_time'] = results['test_time']
+            experiment_data['test_score'] = results['test_score']
+            experiment_data['test_accuracy'] = results['test_accuracy']
+            experiment_data['overall_accuracy'] = results['overall_accuracy']
+            experiment_data['average_accuracy'] = results['average_accuracy']
+            experiment_data['precision_score'] = results['precision_score']
+            experiment_data['recall_score'] = results['recall_score']
+            experiment_data['cohen_kappa_score'] = results['cohen_kappa_score']
+            experiment_data['samples_per_sec'] = results['samples_per_sec']
+            experiment_data['data_wait_time'] = results['data_wait_time']
+            experiment_data['compute_time'] = results['compute_time']
+            experiment_data['data_wait_ratio'] = results['data_wait_ratio']
+            experiment_data['peak_rss_mb'] = results['peak_rss_mb']
+            experiment_data['peak_gpu_mem_mb'] = results['peak_gpu_mem_mb']
+            experiment_data['asha_rungs'] = results['asha_rungs']
+            experiment_data['asha_stopped_epoch'] = results['asha_stopped_epoch']
+
+            per_class_data['overall_accuracy'] = results['overall_accuracy']
+            per_class_data['average_accuracy'] = results['average_accuracy']
+
+            for index, acc in enumerate(results['per_class_accuracies']):
+                per_class_data[results['labels'][index]] = acc
+
+            print('-------------------------------------------------------------------')
+            print()
+
+            experiment_data['success'] = True
+
+    except Exception as e:
+        write_exception_log(e, output_path, iteration)
+        metrics_logger.log('error', error=repr(e))
+
+    finally:
+        metrics_logger.log('experiment_end', results=dict(experiment_data))
+        metrics_logger.close()
+
+    return experiment_data, per_class_data, dataset_choice
+
+def load_experiments(hyperparams):
+    """
+    Loads the set of experiments to run from an experiments JSON or CSV
+    file, if one was given.
+
+    Parameters
+    ----------
+    hyperparams : dict
+        The command line hyperparameters
+
+    Returns
+    -------
+    experiments : pd.DataFrame or None
+        The experiments to run, one per row, or None if no experiments
+        file was given
+    iterations : int
+        The number of experiments to run
+    outfile_prefix : str
+        The prefix of the results files
+    """
+    # pandas is only needed to read experiments files, so worker
+    # processes do not import it
+    import pandas as pd
+
+    if hyperparams['experiments_json'] is not None:
+        # Transpose the json dataframe, since the experiments are read
+        # in as columns instead of rows
+        experiments = pd.read_json(hyperparams['experiments_json']).T
+        iterations = experiments.shape[0]
+        outfile_prefix = Path(hyperparams['experiments_json']).stem
+    elif hyperparams['experiments_csv'] is not None:
+        experiments = pd.read_csv(hyperparams['experiments_csv'])
+        iterations = experiments.shape[0]
+        outfile_prefix = Path(hyperparams['experiments_csv']).stem
+    else:
+        experiments = None
+        iterations = hyperparams['iterations']
+        outfile_prefix = 'experiment'
+
+    return experiments, iterations, outfile_prefix
+
+def get_experiment_hyperparams(experiments, iteration, cli_hyperparams):
+    """
+    Returns the hyperparameters for an experiment.
+
+    Experiment file values override the command line values, except for
+    the harness-level options (output path, workers, profiling and
+    scheduling) which always come from the command line.
+
+    Parameters
+    ----------
+    experiments : pd.DataFrame or None
+        The experiments to run, or None if no experiments file was given
+    iteration : int
+        The experiment iteration number
+    cli_hyperparams : dict
+        The command line hyperparameters
+
+    Returns
+    -------
+    hyperparams : dict
+        The experiment hyperparameters
+    experiment_name : str or None
+        The name of the experiment in the experiments file
+    """
+    hyperparams = dict(cli_hyperparams)
+    experiment_name = None
+
+    # If loading experiments from a file, get new set of hyperparams
+    if experiments is not None:
+        # Keep the command line values as defaults for any
+        # hyperparameters that are missing from the experiments file
+        hyperparams.update(
+            {key: value for key, value
+                in experiments.iloc[iteration].to_dict().items()
+                if not (isinstance(value, float) and np.isnan(value))})
+
+        # Ignore harness-level arguments in experiments, use the values
+        # from command line arguments
+        for key in HARNESS_HYPERPARAMS:
+            hyperparams[key] = cli_hyperparams[key]
+
+        experiment_name = experiments.index[iteration]
+
+    # Get output path
+    if hyperparams['output_path'] is None:
+        hyperparams['output_path'] = './'
+
+    return hyperparams, experiment_name
+
 def test_harness_parser():
     """
     Sets up the parser for command-line flags for the test harness 
@@ -321,7 +1436,7 @@ def test_harness_parser():
         "--workers",
         type=int,
         default=1,
-        help="Specify number of workers (processes) to use when training (defaults to 1)",
+        help="Specify number of workers (threads) loading batches when training (defaults to 1)",
     )
     parser.add_argument("--runs", type=int, default=1, help="Number of runs (default: 1)")
     parser.add_argument(
@@ -336,6 +1451,17 @@ def test_harness_parser():
         default='./',
         help='Path to where output files should be created'
     )
+    parser.add_argument(
+        '--verbose',
+        action='store_true',
+        help='Print each experiment\'s parameters, model summary and a '
+             'progress bar for each training epoch'
+    )
+    parser.add_argument(
+        '--debug',
+        action='store_true',
+        help='Also print every event written to the experiment metrics logs'
+    )
     parser.add_argument(
         '--experiments_csv',
         type=str,
@@ -377,6 +1503,328 @@ def test_harness_parser():
         default=None,
         help='The identifier for the machine learning model to used on the dataset'
     )
+    parser.add_argument(
+        '--data_layout',
+        type=str,
+        default='channels',
+        choices=DATA_LAYOUTS,
+        help="Input patch layout: 'channels' (1, rows, cols, bands), "
+             "'spectral' (rows, cols, bands, 1) for 3D convolutions along "
+             "the spectrum, or '2d' (rows, cols, bands) for 2D convolutions "
+             "(defaults to 'channels')"
+    )
+    parser.add_argument(
+        '--block_type',
+        type=str,
+        default='standard',
+        choices=BLOCK_TYPES,
+        help="Convolution building block of the DenseNet and 3D-CNN "
+             "models: 'standard', 'factorized' (spectral then spatial "
+             "convolution) or 'separable' (depthwise separable; 3D "
+             "models require a GPU) (defaults to 'standard')"
+    )
+    parser.add_argument(
+        '--mixed_precision',
+        action='store_true',
+        help='Train and evaluate with mixed precision (float16 on GPU, '
+             'bfloat16 on CPUs with AVX512-BF16 or AMX instructions)'
+    )
+    parser.add_argument(
+        '--baseline_filters',
+        type=int,
+        default=None,
+        help='Number of convolution filters of the cnn-baseline model '
+             '(defaults to twice the number of classes)'
+    )
+
+    # DenseNet architecture options
+    group_densenet = parser.add_argument_group("DenseNet architecture")
+    group_densenet.add_argument(
+        '--densenet_blocks',
+        type=str,
+        default=None,
+        help="Comma separated number of layers in each dense block "
+             "(defaults to '6,6,6')"
+    )
+    group_densenet.add_argument(
+        '--growth_rate',
+        type=int,
+        default=None,
+        help='Number of filters each dense layer adds (defaults to 32)'
+    )
+    group_densenet.add_argument(
+        '--no_bottleneck',
+        action='store_true',
+        help='Remove the 1x1 bottleneck convolution from the dense layers'
+    )
+    group_densenet.add_argument(
+        '--compression',
+        type=float,
+        default=None,
+        help='Fraction of filters kept by each transition block '
+             '(defaults to 0.5)'
+    )
+    group_densenet.add_argument(
+        '--stem_filters',
+        type=int,
+        default=None,
+        help='Number of filters in the stem convolution (defaults to 64)'
+    )
+    group_densenet.add_argument(
+        '--memory_efficient',
+        action='store_true',
+        help='Recompute the dense layer concatenations and batch '
+             'normalizations during backpropagation instead of storing '
+             'them, trading step time for activation memory'
+    )
+    group_densenet.add_argument(
+        '--measure_latency',
+        action='store_true',
+        help='Measure the CPU forward pass latency of each model and '
+             'record it in the results'
+    )
+
+    # Knowledge distillation options
+    group_distill = parser.add_argument_group("Knowledge distillation")
+    group_distill.add_argument(
+        '--distill_teacher',
+        type=str,
+        default=None,
+        help='Saved teacher model (e.g. a best weights checkpoint) to '
+             'distill into the model given by --model_id'
+    )
+    group_distill.add_argument(
+        '--distill_temperature',
+        type=float,
+        default=4.0,
+        help='Softmax temperature of the teacher soft targets (default = 4.0)'
+    )
+    group_distill.add_argument(
+        '--distill_alpha',
+        type=float,
+        default=0.5,
+        help='Weight of the distillation loss against the true label loss '
+             '(default = 0.5)'
+    )
+    group_distill.add_argument(
+        '--teacher_logits_dir',
+        type=str,
+        default=None,
+        help='Directory where teacher logits are cached (defaults to the '
+             'output path)'
+    )
+
+    # Sweep resumption options
+    group_resume = parser.add_argument_group("Sweep resumption")
+    group_resume.add_argument(
+        "--resume",
+        action="store_true",
+        help="Resume an interrupted sweep, skipping the experiments the "
+             "sweep journal shows have finished and resuming training of "
+             "unfinished experiments from their last epoch checkpoint",
+    )
+    group_resume.add_argument(
+        "--results_export_interval",
+        type=int,
+        default=10,
+        help="Number of finished experiments between regenerations of the "
+             "results CSV files from the results store, which are always "
+             "regenerated at the end of the sweep (default = 10)",
+    )
+
+    # Successive halving options
+    group_asha = parser.add_argument_group("Successive halving")
+    group_asha.add_argument(
+        "--asha",
+        action="store_true",
+        help="Stop a sweep's experiments early with asynchronous successive "
+             "halving: at each rung epoch, only experiments whose validation "
+             "metric is in the top 1/reduction_factor so far keep training",
+    )
+    group_asha.add_argument(
+        "--asha_min_epochs",
+        type=int,
+        default=1,
+        help="Epoch of the first successive halving rung (default: 1)",
+    )
+    group_asha.add_argument(
+        "--asha_reduction_factor",
+        type=int,
+        default=3,
+        help="Factor between the rung epochs, and the inverse of the fraction "
+             "of experiments promoted at each rung (default: 3)",
+    )
+    group_asha.add_argument(
+        "--asha_metric",
+        type=str,
+        default='val_loss',
+        help="Validation metric the experiments are compared by "
+             "(default: val_loss)",
+    )
+
+    # Parallel scheduling options
+    group_parallel = parser.add_argument_group("Parallel scheduling")
+    group_parallel.add_argument(
+        "--parallel_workers",
+        type=int,
+        default=0,
+        help="Number of worker processes to run experiments in parallel "
+             "(defaults to 0, which runs experiments one after another)",
+    )
+    group_parallel.add_argument(
+        "--parallel_devices",
+        type=str,
+        default=None,
+        help="Comma separated device slots for the workers, each either "
+             "'gpu:N', 'cpu:A-B' (a range of CPU cores) or 'cpu' "
+             "(defaults to splitting the CPU cores evenly between workers)",
+    )
+    group_parallel.add_argument(
+        "--worker_threads",
+        type=int,
+        default=None,
+        help="Tensorflow intra-op threads per worker (defaults to the "
+             "number of CPU cores in the worker's slot)",
+    )
+    group_parallel.add_argument(
+        "--worker_inter_threads",
+        type=int,
+        default=None,
+        help="Tensorflow inter-op threads per worker",
+    )
+    group_parallel.add_argument(
+        "--shared_dataset_dir",
+        type=str,
+        default=None,
+        help="Directory where loaded datasets are saved and memory-mapped "
+             "by every experiment (defaults to <output_path>/shared_datasets "
+             "when running in parallel)",
+    )
+
+    # Profiling options
+    group_profile = parser.add_argument_group("Profiling")
+    group_profile.add_argument(
+        "--profile",
+        action="store_true",
+        help="Profile experiment phases with cProfile and trace the dataset "
+             "build with tracemalloc (files are written to <output_path>/profiles)",
+    )
+    group_profile.add_argument(
+        "--profile_phases",
+        type=str,
+        default=None,
+        help="Comma separated phases to profile with cProfile "
+             "(dataset, model, train, evaluate; default = all)",
+    )
+    group_profile.add_argument(
+        "--profile_tf_steps",
+        type=str,
+        default=None,
+        help="Run the Tensorflow profiler over a 'start,stop' window of "
+             "training steps (e.g. '10,20')",
+    )
+    group_profile.add_argument(
+        "--profile_layers",
+        action="store_true",
+        help="Write the FLOPs, activation memory, parameter memory and latency "
+             "of each model layer to <output_path>/Experiment_N_layer_profile.csv "
+             "and estimate the maximum batch size",
+    )
+    group_profile.add_argument(
+        "--device_memory_mb",
+        type=int,
+        default=None,
+        help="Device memory used to estimate the maximum batch size "
+             "(defaults to the detected memory)",
+    )
+
+    # Pseudo-labelling options
+    group_pseudo = parser.add_argument_group("Pseudo-labelling")
+    group_pseudo.add_argument(
+        "--pseudo_label_rounds",
+        type=int,
+        default=0,
+        help="After training, pseudo-label the confidently predicted unlabelled "
+             "pixels and retrain on the labelled and pseudo-labelled pixels, "
+             "this many times (default: 0)",
+    )
+    group_pseudo.add_argument(
+        "--pseudo_label_threshold",
+        type=float,
+        default=0.95,
+        help="Smallest prediction confidence of a pseudo-label (default: 0.95)",
+    )
+    group_pseudo.add_argument(
+        "--pseudo_label_max_per_class",
+        type=int,
+        default=None,
+        help="Keep at most this many of the most confident pseudo-labels of "
+             "each class (default: no limit)",
+    )
+    group_pseudo.add_argument(
+        "--pseudo_label_batch_size",
+        type=int,
+        default=None,
+        help="Number of unlabelled pixels predicted at a time "
+             "(defaults to --batch_size)",
+    )
+
+    # Distributed training options
+    group_distribute = parser.add_argument_group("Distributed training")
+    group_distribute.add_argument(
+        "--distribute",
+        type=str,
+        default=None,
+        choices=DISTRIBUTION_STRATEGIES,
+        help="Train each experiment's model with a distribution strategy: "
+             "'mirrored' replicates it on every local GPU (or logical CPU device), "
+             "'multi_worker' on every worker of the TF_CONFIG cluster. "
+             "The batch size is per replica",
+    )
+    group_distribute.add_argument(
+        "--logical_cpus",
+        type=int,
+        default=0,
+        help="Split the CPU into this many logical devices to distribute over "
+             "when there are no GPUs, e.g. to test distributed training (default: 0)",
+    )
+
+    # Autotuning options
+    group_autotune = parser.add_argument_group("Autotuning")
+    group_autotune.add_argument(
+        "--autotune",
+        action="store_true",
+        help="Instead of running the experiments, find the largest batch size of "
+             "the first experiment's model that fits in device memory, measure the "
+             "training throughput of candidate batch sizes and worker counts, and "
+             "write the best configuration to <output_path>/autotune_*.json",
+    )
+    group_autotune.add_argument(
+        "--autotune_bands",
+        type=int,
+        default=None,
+        help="Number of bands of synthetic patches to autotune on "
+             "(defaults to loading the experiment's dataset)",
+    )
+    group_autotune.add_argument(
+        "--autotune_max_batch_size",
+        type=int,
+        default=4096,
+        help="Largest batch size to try when autotuning (default: 4096)",
+    )
+    group_autotune.add_argument(
+        "--autotune_workers",
+        type=int,
+        nargs='+',
+        default=[1, 2, 4],
+        help="Worker counts to measure when autotuning (default: 1 2 4)",
+    )
+    group_autotune.add_argument(
+        "--autotune_steps",
+        type=int,
+        default=20,
+        help="Number of timed training steps per autotuning trial (default: 20)",
+    )
 
     # Training options
     group_train = parser.add_argument_group("Training")
@@ -418,8 +1866,14 @@ def test_harness_parser():
     )
     group_train.add_argument(
         "--class_balancing",
-        action="store_true",
-        help="Inverse median frequency class balancing (default = False)",
+        type=str,
+        nargs='?',
+        const='inverse_median',
+        default=None,
+        choices=CLASS_BALANCING_MODES,
+        help="Draw class-balanced training batches, with classes weighted by "
+             "inverse median frequency (the default mode), the square root of "
+             "their frequency, or uniformly (default = natural distribution)",
     )
     group_train.add_argument(
         "--test_stride",
@@ -433,6 +1887,21 @@ def test_harness_parser():
         default=1,
         help="Number of iterations to run the model for (default = 1)",
     )
+    group_train.add_argument(
+        "--xla",
+        action="store_true",
+        help="Compile the training, evaluation and prediction steps with XLA, "
+             "padding the last batch so every batch has the same shape",
+    )
+    group_train.add_argument(
+        "--accumulation_steps",
+        type=int,
+        default=1,
+        help="Split each training batch into this many micro-batches and "
+             "accumulate their gradients before updating the model, so "
+             "--batch_size is the effective batch size and memory use is that "
+             "of a micro-batch. It should divide --batch_size (default: 1)",
+    )
     group_train.add_argument(
         "--patience",
         type=int,
@@ -567,44 +2036,95 @@ if __name__ == "__main__":
     parser = test_harness_parser()
     args = parser.parse_args()
 
-    hyperparams = vars(args)
+    cli_hyperparams = vars(args)
 
     # Get output path
-    if hyperparams['output_path'] is not None:
-        output_path = hyperparams['output_path']
+    if cli_hyperparams['output_path'] is not None:
+        output_path = cli_hyperparams['output_path']
     else:
         output_path = './'
-    
-    # Get number of worker processes
-    workers = hyperparams['workers']
+    cli_hyperparams['output_path'] = output_path
+
+    utilities.verbose = cli_hyperparams['verbose']
+    utilities.debug = cli_hyperparams['debug']
+
+    # Create the distribution strategy before any other Tensorflow
+    # operations run, so every experiment is trained with it
+    strategy = None
+    if cli_hyperparams['distribute'] is not None:
+        if cli_hyperparams['parallel_workers'] > 0:
+            parser.error('--distribute can not be combined with --parallel_workers')
+        strategy = get_distribution_strategy(cli_hyperparams['distribute'],
+                                             cli_hyperparams['logical_cpus'])
+        output_path = get_worker_output_path(output_path)
+        os.makedirs(output_path, exist_ok=True)
+        cli_hyperparams['output_path'] = output_path
 
     # Get hyperparam derived variable values
-    if hyperparams['experiments_json'] is not None:
-        # Transpose the json dataframe, since the experiments are read
-        # in as columns instead of rows
-        experiments = pd.read_json(hyperparams['experiments_json']).T
-        iterations = experiments.shape[0]
-        outfile_prefix = Path(hyperparams['experiments_json']).stem
-    elif hyperparams['experiments_csv'] is not None:
-        experiments = pd.read_csv(hyperparams['experiments_csv'])
-        iterations = experiments.shape[0]
-        outfile_prefix = Path(hyperparams['experiments_csv']).stem
-    else:
-        experiments = None
-        iterations = hyperparams['iterations']
-        outfile_prefix = 'experiment'
-
-    # Get model name of CPU
-    cpu_name = cpuinfo.get_cpu_info()['brand_raw']
-
-    # Get model names of all GPUs on system
-    gpu_names = []
-    for gpu in tf.config.list_physical_devices(device_type = 'GPU'):
-        gpu_names.append(tf.config.experimental.get_device_details(gpu)['device_name'])
+    experiments, iterations, outfile_prefix = load_experiments(cli_hyperparams)
+    cli_hyperparams['asha_state_path'] = os.path.join(
+        output_path, f'{outfile_prefix}_asha.json')
+
+    # Autotune the first experiment's batch size and workers instead of
+    # running the experiments
+    if cli_hyperparams['autotune']:
+        hyperparams, _ = get_experiment_hyperparams(experiments, 0, cli_hyperparams)
+        device = get_device(hyperparams['cuda'])
+        if hyperparams.get('mixed_precision'):
+            tf.keras.mixed_precision.set_global_policy(
+                get_mixed_precision_policy(device) or 'float32')
+        run_autotune(hyperparams, device, create_model, load_dataset)
+        sys.exit()
+
+    # Open the sweep journal, which records finished experiments so an
+    # interrupted sweep can be resumed
+    journal = SweepJournal(
+        os.path.join(output_path, f'{outfile_prefix}_journal.jsonl'),
+        resume=cli_hyperparams['resume'])
+    config_hashes = {}
+
+    # Open the results store, which keeps a row for every finished
+    # experiment and regenerates the results CSV files
+    results_store = ResultsStore(
+        os.path.join(output_path, f'{outfile_prefix}_results.sqlite'),
+        resume=cli_hyperparams['resume'])
+    results_export_interval = cli_hyperparams['results_export_interval']
+    num_recorded = 0
+
+    # Start the successive halving rungs of a new sweep, or keep those of
+    # the resumed sweep
+    if cli_hyperparams['asha']:
+        ASHAState(cli_hyperparams['asha_state_path'],
+                  reset=not cli_hyperparams['resume'])
+
+    def record_experiment(iteration, experiment_data, per_class_data,
+                          dataset_choice, journaled=False):
+        """Records a finished experiment's results and saves them."""
+        global num_recorded
+
+        if experiment_data is None:
+            # The experiment's worker process failed
+            experiment_data = {'experiment_number': iteration + 1, 'success': False}
+
+        if not journaled:
+            journal.record(iteration + 1, config_hashes[iteration],
+                           experiment_data, per_class_data, dataset_choice)
+
+        # Experiments skipped on resumption are already in the results
+        # store, unless it was created after they finished
+        if not journaled or not results_store.has_experiment(iteration + 1):
+            results_store.record(iteration + 1, config_hashes[iteration],
+                                 experiment_data, per_class_data, dataset_choice)
+            num_recorded += 1
+            if (results_export_interval > 0
+                    and num_recorded % results_export_interval == 0):
+                results_store.export_csvs(output_path, outfile_prefix)
 
-    # Initialize data list variables for CSV output at end of program
-    experiment_data_list = []
-    per_class_data_lists = {}
+        print()
+        print('*******************************************************')
+        print(f'<<< EXPERIMENT #{iteration+1}  COMPLETE! >>>')
+        print('*******************************************************')
+        print()
 
     print('-------------------------------------------------------------------')
     print('-------------------------------------------------------------------')
@@ -613,405 +2133,58 @@ if __name__ == "__main__":
     print('vvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvv')
     print()
 
-    # Make a generater to create prime number random seeds
-    primes = prime_generator()
-
-    # Set variables that carry state over experiments to None
-    dataset_choice = None
-    data = None
-    train_gt = None
-    test_gt = None
-    dataset_info = {
-        'name': None,
-        'num_classes': None,
-        'ignored_labels': None,
-        'class_labels': None,
-        'label_mapping': None,
-    }
-    train_dataset = None
-    val_dataset = None
-    test_dataset = None
-    target_test = None
-
-    # Go through experiment iterations
+    # Get the hyperparameters of every experiment, skipping experiments
+    # the journal shows have already finished with the same configuration
+    jobs = []
     for iteration in range(iterations):
-
-        print('*******************************************************')
-        print(f'<<< EXPERIMENT #{iteration+1}  STARTING >>>')
-        print('*******************************************************')
-        print()
-
-        experiment_data = {
-            'experiment_number': iteration + 1,
-            'success': False,
-            'random_seed': None,
-            'dataset': None,
-            'channels': None,
-            'model': None,
-            'device': None,
-            'epochs': None,
-            'batch_size': None,
-            'patch_size': None,
-            'train_split': None,
-            'optimizer': None,
-            'learning_rate': None,
-            'loss': None,
-            'train_time': 0.0,
-            'test_time': 0.0,
-            'test_score': 0.0,
-            'test_accuracy': 0.0,
-            'overall_accuracy': 0.0,
-            'average_accuracy': 0.0,
-            'precision_score': 0.0,
-            'recall_score': 0.0,
-            'cohen_kappa_score': 0.0,
-        }
-
-        per_class_data = {
-            'experiment_number': iteration + 1, 
-            'random_seed': None,
-            'model': None, 
-            'overall_accuracy': 0.0, 
-            'average_accuracy': 0.0,
-        }
-
-        experiments_results_file = f'{outfile_prefix}_results.csv'
-        class_results_file = f'{outfile_prefix}__{dataset_choice}__class_results.csv'
-
-        # Experiment has begun, so make sure to catch any failures that
-        # may occur
-        try:
-            # If loading experiments from a file, get new set of hyperparams
-            if experiments is not None:
-                hyperparams = experiments.iloc[iteration].to_dict()
-
-                # Ignore the output path in the experiments, use the path
-                # from command line arguments
-                hyperparams['output_path'] = output_path
-
-                # Ignore the workers argument in experiments, use the
-                # value from the command line
-                hyperparams['workers'] = workers
-
-                print('<~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~>')
-                print(f'EXPERIMENT NAME: {experiments.index[iteration]}')
-                print('<~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~>')
-                print()
-
-
-            # Print out parameters for experiment
-            print('.......................................................')
-            print('EXPERIMENT PARAMETERS')
-            print('.......................................................')
-            header = '{:<40} | {:<40}'.format('PARAMETER', 'VALUE')
-            print(header)
-            print('=' * len(header))
-            for key in hyperparams:
-                print('{:<40} | {:<40}'.format(key, str(hyperparams[key])))
-                print('-' * len(header))
-            print('-' * len(header))
-            print('.......................................................')
-
-            # Initialize random seed for sampling function
-            # Each random seed is a prime number, in order
-            if hyperparams['random_seed'] is not None:
-                seed = hyperparams['random_seed']
-            else:
-                seed = next(primes)
-            print(f'< Iteration #{iteration} random seed: {seed} >')
-            print()
-            np.random.seed(seed)
-
-            # Choose the appropriate device from the hyperparameters
-            device = get_device(hyperparams['cuda'])
-
-            if 'CPU' in device:
-                device_name = cpu_name
-            else:
-                gpu_num = int(device.split(':')[-1])
-                device_name = gpu_names[gpu_num]
-                gpu = tf.config.list_physical_devices('GPU')[gpu_num]
-                tf.config.experimental.set_memory_growth(gpu, True)
-        
-            # Device has been selected, so do all possible computation with device
-            with tf.device(device):
-                reuse_last_dataset = hyperparams['reuse_last_dataset']
-                if reuse_last_dataset and dataset_choice is not None:
-                    print()
-                    print(f'< Reusing last dataset: {dataset_choice} >')
-                else:
-
-                    reuse_last_dataset = False
-
-                    print()
-                    print('-------------------------------------------------------------------')
-                    print('LOADING DATASET...')
-                    print('vvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvv')
-
-                    # Get dataset choice parameter
-                    dataset_choice = hyperparams['dataset']
-                    class_results_file = f'{outfile_prefix}__{dataset_choice}__class_results.csv'
-                    print()
-                    print(f' < Dataset Chosen: {dataset_choice} >')
-                    print()
-
-                    # Make sure dataset is in per-class data list dictionary
-                    if dataset_choice not in per_class_data_lists:
-                        per_class_data_lists[dataset_choice] = []
-
-                    # Get selected dataset
-                    if not reuse_last_dataset:
-                        if dataset_choice == 'grss_dfc_2018':
-                            # Determine what parts of dataset to use
-                            if (not hyperparams['use_hs_data']
-                                and not hyperparams['use_lidar_ms_data']
-                                and not hyperparams['use_lidar_ndsm_data']
-                                and not hyperparams['use_vhr_data']
-                                and not hyperparams['use_all_data']):
-
-                                print('<!> No specific data selected, defaulting to using only hyperspectral data... <!>')
-                                hyperparams['use_hs_data'] = True
-                            
-                            data, train_gt, test_gt, dataset_info = load_grss_dfc_2018_uh_dataset(**hyperparams)
-                        elif dataset_choice == 'indian_pines':
-                            data, train_gt, test_gt, dataset_info = load_indian_pines_dataset(**hyperparams)
-                        elif dataset_choice == 'pavia_center':
-                            data, train_gt, test_gt, dataset_info = load_pavia_center_dataset(**hyperparams)
-                        elif dataset_choice == 'university_of_pavia':
-                            data, train_gt, test_gt, dataset_info = load_university_of_pavia_dataset(**hyperparams)
-                        else:
-                            print('No dataset chosen! Defaulting to only hyperspectral bands of grss_dfc_2018...')
-                            dataset_choice = 'grss_dfc_2018'
-                            hyperparams['use_hs_data'] = True
-                            data, train_gt, test_gt, dataset_info = load_grss_dfc_2018_uh_dataset(**hyperparams)
-
-                    print('^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^')
-                    print('DATASET LOADED!')
-                    print('-------------------------------------------------------------------')
-                    print()
-
-                    if not hyperparams['skip_data_preprocessing']:
-                        print('-------------------------------------------------------------------')
-                        print('PREPROCESS THE DATA')
-                        print('-------------------------------------------------------------------')
-                        data = preprocess_data(data, **hyperparams)
-                        print('-------------------------------------------------------------------')
-                        print()
-                    
-                    if not hyperparams['skip_band_selection']:
-                        print('-------------------------------------------------------------------')
-                        print('RUN BAND SELECTION ALGORITHM')
-                        print('-------------------------------------------------------------------')
-                        data = band_selection(data, dataset_info['class_labels'], **hyperparams)
-                        print('-------------------------------------------------------------------')
-                        print()
-
-                # Set dataset variables
-                dataset_name = dataset_info['name']
-                num_classes = dataset_info['num_classes']
-                ignored_labels = dataset_info['ignored_labels']
-                all_class_labels = dataset_info['class_labels']
-                valid_class_labels = [label for index, label in enumerate(all_class_labels) 
-                                        if index not in ignored_labels]
-
-
-                epochs = hyperparams['epochs']
-                supervision = 'full'
-                batch_size = hyperparams['batch_size']
-                patch_size = hyperparams['patch_size']
-                train_split = hyperparams['train_split']
-                optimizer = hyperparams['optimizer']
-                learning_rate = hyperparams['lr']
-                loss = 'sparse_categorical_crossentropy'
-                img_channels = data.shape[-1]
-                img_rows = patch_size
-                img_cols = patch_size
-
-                # Add and update hyperparameters for model training
-                hyperparams.update(
-                    {
-                        'n_classes': num_classes,
-                        'n_bands': img_channels,
-                        'ignored_labels': ignored_labels,
-                        'device': device,
-                        'supervision': supervision,
-                        'center_pixel': True,
-                        'one_hot_encoding': True,
-                        'metrics': ['sparse_categorical_accuracy'],
-                        'loss': loss,
-                    }
-                )
-
-                # Update experiment data
-                experiment_data.update({
-                    'random_seed': seed,
-                    'dataset': dataset_name,
-                    'channels': img_channels,
-                    'device': device_name,
-                    'epochs': epochs,
-                    'batch_size': batch_size,
-                    'patch_size': patch_size,
-                    'train_split': train_split,
-                    'optimizer': optimizer,
-                    'learning_rate': learning_rate,
-                    'loss': loss,
-                })
-
-                # Update per-class data for experiment
-                per_class_data.update({
-                    'random_seed': seed,
-                })
-                for label in valid_class_labels:
-                    per_class_data[label] = 0.0
-
-                if not reuse_last_dataset:
-                    print('-------------------------------------------------------------------')
-                    print('SPLIT DATA FOR TRAINING, VALIDATION, AND TESTING')
-                    print('-------------------------------------------------------------------')
-
-                    print('Breaking down image into data patches and splitting data into train, validation, and test sets...')
-                    train_dataset, val_dataset, test_dataset, target_test = create_datasets(data, train_gt, test_gt, **hyperparams)
-
-                    print('-------------------------------------------------------------------')
-                    print()
-
-
-                print('-------------------------------------------------------------------')
-                print('CREATE MODEL')
-                print('-------------------------------------------------------------------')
-
-                # Create specified model
-                if hyperparams['model_id'] == '3d-densenet':
-                    model = densenet_model(img_rows=img_rows, 
-                                    img_cols=img_cols, 
-                                    img_channels=img_channels, 
-                                    nb_classes=num_classes)
-                elif hyperparams['model_id'] == '3d-cnn':
-                    model = cnn_3d_model(img_rows=img_rows, 
-                                    img_cols=img_cols, 
-                                    img_channels=img_channels, 
-                                    nb_classes=num_classes)
-                elif hyperparams['model_id'] == 'cnn-baseline':
-                    filter_size = patch_size // 2 + 1
-                    model = baseline_cnn_model(img_rows=img_rows, 
-                                            img_cols=img_cols, 
-                                            img_channels=img_channels, 
-                                            patch_size=filter_size, 
-                                            nb_filters=num_classes * 2, 
-                                            nb_classes=num_classes)
-                else:
-                    print('<!> No model specified, defaulting to 3d-densenet <!>')
-                    model = densenet_model(img_rows=img_rows, 
-                                    img_cols=img_cols, 
-                                    img_channels=img_channels, 
-                                    nb_classes=num_classes)
-                
-                # Record model name for output
-                experiment_data['model'] = model.name
-                per_class_data['model'] = model.name
-
-                print('-------------------------------------------------------------------')
-                print()
-                
-                print('-------------------------------------------------------------------')
-                print('RUN MODEL')
-                print('-------------------------------------------------------------------')
-
-                # Run experiment on model
-                results = run_model(model=model, 
-                                    train_dataset=train_dataset, 
-                                    val_dataset=val_dataset, 
-                                    test_dataset=test_dataset,
-                                    target_test=target_test, 
-                                    labels=all_class_labels, 
-                                    iteration=iteration,
-                                    **hyperparams)
-                
-                # Copy results to output data
-                experiment_data['train_time'] = results['train_time']
-                experiment_data['test_time'] = results['test_time']
-                experiment_data['test_score'] = results['test_score']
-                experiment_data['test_accuracy'] = results['test_accuracy']
-                experiment_data['overall_accuracy'] = results['overall_accuracy']
-                experiment_data['average_accuracy'] = results['average_accuracy']
-                experiment_data['precision_score'] = results['precision_score']
-                experiment_data['recall_score'] = results['recall_score']
-                experiment_data['cohen_kappa_score'] = results['cohen_kappa_score']
-
-                per_class_data['overall_accuracy'] = results['overall_accuracy']
-                per_class_data['average_accuracy'] = results['average_accuracy']
-
-                for index, acc in enumerate(results['per_class_accuracies']):
-                    per_class_data[results['labels'][index]] = acc
-
-                print('-------------------------------------------------------------------')
-                print()
-
-                experiment_data['success'] = True
-
-        except Exception as e:
-            print()
-            print('###################################################')
-            print('!!! EXCEPTION OCCURRED !!!')
-            print('###################################################')
-            print(f'Exception Type: {type(e)}')
-            print(f'Exception Line: {e.__traceback__.tb_lineno}')
-            print(f'Exception Desc: {e}')
-            print()
-            print('---------------------------------------------------')
-            print('** Full Traceback **')
-            print()
-            # Print full exception
-            traceback.print_exc()
-            print('###################################################')
-            print()
-
-            # Write exception to file
-            with open(os.path.join(output_path, f'experiment_{iteration+1}_exception.log'),'w') as ef:
-                ef.write('\n')
-                ef.write('###################################################\n')
-                ef.write('!!! EXCEPTION OCCURRED !!!\n')
-                ef.write('###################################################\n')
-                ef.write(f'Exception Type: {type(e)}\n')
-                ef.write(f'Exception Line: {e.__traceback__.tb_lineno}\n')
-                ef.write(f'Exception Desc: {e}\n')
-                ef.write('\n')
-                ef.write('---------------------------------------------------\n')
-                ef.write('** Full Traceback **\n')
-                ef.write('\n')
-                # Print full exception
-                ef.write(f'{traceback.format_exc()}\n')
-                ef.write('###################################################\n')
-                ef.write('\n')
-
-            print(f'Experiment #{iteration+1} crashed and thus failed!')
-        
-        experiment_data_list.append(experiment_data)
-        per_class_data_lists[dataset_choice].append(per_class_data)
-
+        hyperparams, experiment_name = get_experiment_hyperparams(
+            experiments, iteration, cli_hyperparams)
+        config_hash = get_config_hash(hyperparams, CONFIG_HASH_IGNORED)
+        hyperparams['config_hash'] = config_hash
+        config_hashes[iteration] = config_hash
+
+        record = journal.get_completed(iteration + 1, config_hash)
+        if record is not None:
+            print(f'< Experiment #{iteration+1} already complete, skipping >')
+            record_experiment(iteration, record['experiment_data'],
+                              record['per_class_data'], record['dataset_choice'],
+                              journaled=True)
+            continue
+
+        jobs.append((iteration, hyperparams, experiment_name))
+
+    # Load each dataset once and share it between experiments (and
+    # worker processes) by memory-mapping it
+    parallel_workers = cli_hyperparams['parallel_workers']
+    shared_dataset_dir = cli_hyperparams['shared_dataset_dir']
+    if parallel_workers > 0 and shared_dataset_dir is None:
+        shared_dataset_dir = os.path.join(output_path, 'shared_datasets')
+    if shared_dataset_dir is not None and jobs:
+        prepare_shared_datasets(jobs, shared_dataset_dir, load_dataset)
+
+    if parallel_workers > 0:
+        # Fan the experiments out across a pool of worker processes
+        slots = parse_device_slots(cli_hyperparams['parallel_devices'],
+                                   parallel_workers)
+        print(f'< Running experiments on {len(slots)} worker processes >')
         print()
-        print('-------------------------------------------------------------------')
-        print('SAVING RESULTS...')
-
-        experiment_results = pd.DataFrame(experiment_data_list)
-        experiment_results.to_csv(os.path.join(output_path, experiments_results_file))
-        
-        print('  >>> Experiment results saved!')
-
-        for dataset_choice in per_class_data_lists:
-            per_class_data_results = pd.DataFrame(per_class_data_lists[dataset_choice])
-            per_class_data_results.to_csv(os.path.join(output_path, class_results_file))
-            print(f'  >>> {dataset_choice} per-class results saved!')
-
-        print('RESULTS SAVED!')
-        print('-------------------------------------------------------------------')
-
-        print()
-        print('*******************************************************')
-        print(f'<<< EXPERIMENT #{iteration+1}  COMPLETE! >>>')
-        print('*******************************************************')
-        print()
-    
+        run_experiments_parallel(jobs, slots, record_experiment,
+                                 intra_threads=cli_hyperparams['worker_threads'],
+                                 inter_threads=cli_hyperparams['worker_inter_threads'])
+    else:
+        # Set variables that carry state over experiments
+        cache = {}
+
+        # Go through experiment iterations
+        for iteration, hyperparams, experiment_name in jobs:
+            experiment_data, per_class_data, dataset_choice = run_experiment(
+                iteration, hyperparams, cache, experiment_name=experiment_name,
+                strategy=strategy)
+            record_experiment(iteration, experiment_data, per_class_data, dataset_choice)
+
+    # Regenerate the results CSV files from every experiment of the sweep
+    results_store.export_csvs(output_path, outfile_prefix)
+    results_store.close()
     print()
     print()
     print('^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^')
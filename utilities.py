@@ -5,6 +5,10 @@
 File with utility functions and variables.
 """
 
+### Built-in Imports ###
+import os
+import tempfile
+
 ### Global Variables ###
 verbose = False
 debug = False
@@ -34,4 +38,26 @@ def print_d(str):
         A string to print if debug is on.
     """
     if debug:
-        print(str)
\ No newline at end of file
+        print(str)
+
+def write_csv_atomic(dataframe, path):
+    """
+    Writes a DataFrame to a CSV file atomically, by writing it to a
+    temporary file in the same directory and renaming it over the path.
+
+    Parameters
+    ----------
+    dataframe : pd.DataFrame
+        The DataFrame to write.
+    path : str
+        Path of the CSV file.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(suffix='.csv.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', newline='') as outfile:
+            dataframe.to_csv(outfile)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise